@@ -0,0 +1,209 @@
+import asyncio
+import logging
+from typing import AsyncIterator, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from .cache import make_result_cache_key, result_cache
+from .concurrency import (
+    DECODE_STAGE,
+    INFERENCE_STAGE,
+    REPORT_STAGE,
+    StageSaturatedError,
+    run_cpu_bound,
+    run_io_bound
+)
+from .config import settings
+from .image_store import image_store
+from .metrics import record_error
+from .models import BatchItemResult, CachedDiagnosis, DiagnosisResponse, SeriesReport
+from .services import (
+    convert_dicom_to_pil_and_png,
+    detect_objects_roboflow_sdk_batch,
+    generate_series_report,
+    summarize_annotations
+)
+
+logger = logging.getLogger(__name__)
+
+DETECTION_FAILED_REPORT = "Automated detection could not be performed on this image. No findings are reported; the image requires manual review."
+
+
+def _batch_cache_key(contents: bytes) -> str:
+    # Batch items carry a per-image findings summary rather than the full LLM
+    # report cached by /api/diagnose, so they live under their own key.
+    return make_result_cache_key(contents) + ":batch-item"
+
+
+def _failed_item(index: int, filename: str, error: str, image_fields: Optional[dict] = None) -> BatchItemResult:
+    return BatchItemResult(
+        index=index,
+        result=DiagnosisResponse(
+            image_filename=filename,
+            **(image_fields or {}),
+            annotations=[],
+            diagnostic_report="Could not process DICOM file." if not image_fields else DETECTION_FAILED_REPORT,
+            error=error
+        )
+    )
+
+
+async def stream_batch_diagnosis(uploads: List[Tuple[str, bytes]]) -> AsyncIterator[str]:
+    """
+    Diagnoses a series of uploads and yields NDJSON lines: one BatchItemResult per
+    file in completion order, then a single SeriesReport. Files are decoded in
+    parallel (at most DECODE_CONCURRENCY at a time), and decoded images that are
+    ready at the same time are grouped into one batched inference call of up to
+    INFERENCE_BATCH_SIZE images.
+    """
+    total = len(uploads)
+    # Every file puts exactly one item on `decoded`: either a finished result
+    # (cache hit or failure) or a decoded image awaiting inference. Every item
+    # handed to inference puts exactly one result on `finished`.
+    decoded: asyncio.Queue = asyncio.Queue()
+    finished: asyncio.Queue = asyncio.Queue()
+    decode_slots = asyncio.Semaphore(max(1, settings.DECODE_CONCURRENCY))
+
+    async def decode(index: int, filename: str, contents: bytes):
+        try:
+            if result_cache is not None:
+                cached = await run_in_threadpool(result_cache.get, _batch_cache_key(contents))
+                if cached is not None:
+                    image_id = await run_in_threadpool(image_store.put, cached.image_png)
+                    await decoded.put(BatchItemResult(
+                        index=index,
+                        result=DiagnosisResponse(
+                            image_filename=filename,
+                            image_id=image_id,
+                            image_width=cached.image_width,
+                            image_height=cached.image_height,
+                            annotations=cached.annotations,
+                            diagnostic_report=cached.diagnostic_report
+                        )
+                    ))
+                    return
+            async with decode_slots:
+                pil_image, png_bytes, error_dicom = await run_cpu_bound(
+                    DECODE_STAGE, convert_dicom_to_pil_and_png, contents
+                )
+            if error_dicom or not pil_image or not png_bytes:
+                logger.error(f"DICOM conversion error for {filename} in batch: {error_dicom}")
+                record_error(DECODE_STAGE)
+                await decoded.put(_failed_item(index, filename, f"Failed to convert DICOM: {error_dicom}"))
+            else:
+                image_id = await run_in_threadpool(image_store.put, png_bytes)
+                image_fields = {"image_id": image_id, "image_width": pil_image.width, "image_height": pil_image.height}
+                await decoded.put((index, filename, pil_image, image_fields, contents, png_bytes))
+        except StageSaturatedError as e:
+            logger.warning(f"Decode stage saturated for {filename} in batch.")
+            await decoded.put(_failed_item(index, filename, f"Server busy: {e}"))
+        except Exception as e:
+            logger.error(f"Unexpected error decoding {filename} in batch: {e}", exc_info=True)
+            await decoded.put(_failed_item(index, filename, f"Failed to convert DICOM: {e}"))
+
+    async def infer(batch):
+        emitted = set()
+        try:
+            try:
+                outcomes = await run_io_bound(
+                    INFERENCE_STAGE, detect_objects_roboflow_sdk_batch, [item[2] for item in batch]
+                )
+            except StageSaturatedError as e:
+                outcomes = [([], f"Server busy: {e}") for _ in batch]
+            if len(outcomes) != len(batch):
+                raise RuntimeError(f"Detector returned {len(outcomes)} results for {len(batch)} images.")
+            for (index, filename, _, image_fields, contents, png_bytes), (annotations, error_roboflow) in zip(batch, outcomes):
+                if error_roboflow:
+                    record_error(INFERENCE_STAGE)
+                    item = _failed_item(
+                        index, filename,
+                        f"Roboflow detection failed: {error_roboflow}.",
+                        image_fields
+                    )
+                else:
+                    item = BatchItemResult(
+                        index=index,
+                        result=DiagnosisResponse(
+                            image_filename=filename,
+                            **image_fields,
+                            annotations=annotations,
+                            diagnostic_report=summarize_annotations(annotations)
+                        )
+                    )
+                    if result_cache is not None:
+                        await run_in_threadpool(
+                            result_cache.set,
+                            _batch_cache_key(contents),
+                            CachedDiagnosis(
+                                image_png=png_bytes,
+                                image_width=image_fields["image_width"],
+                                image_height=image_fields["image_height"],
+                                annotations=item.result.annotations,
+                                diagnostic_report=item.result.diagnostic_report
+                            )
+                        )
+                await finished.put(item)
+                emitted.add(index)
+        except Exception as e:
+            logger.error(f"Unexpected error during batch inference of {len(batch)} images: {e}", exc_info=True)
+            for index, filename, _, image_fields, _, _ in batch:
+                if index not in emitted:
+                    await finished.put(_failed_item(index, filename, f"Roboflow detection failed: {e}.", image_fields))
+
+    async def dispatch():
+        inference_tasks = []
+        consumed = 0
+
+        async def route(item, batch):
+            if isinstance(item, BatchItemResult):
+                await finished.put(item)
+            else:
+                batch.append(item)
+
+        while consumed < total:
+            batch = []
+            await route(await decoded.get(), batch)
+            consumed += 1
+            while consumed < total and len(batch) < max(1, settings.INFERENCE_BATCH_SIZE):
+                try:
+                    item = decoded.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                consumed += 1
+                await route(item, batch)
+            if batch:
+                inference_tasks.append(asyncio.create_task(infer(batch)))
+        await asyncio.gather(*inference_tasks)
+
+    async def next_finished() -> BatchItemResult:
+        # Surfaces a dispatcher failure instead of waiting on `finished` forever.
+        getter = asyncio.ensure_future(finished.get())
+        await asyncio.wait({getter, dispatcher}, return_when=asyncio.FIRST_COMPLETED)
+        if not getter.done() and dispatcher.done() and dispatcher.exception() is not None:
+            getter.cancel()
+            raise dispatcher.exception()
+        return await getter
+
+    tasks = [asyncio.create_task(decode(i, name, data)) for i, (name, data) in enumerate(uploads)]
+    dispatcher = asyncio.create_task(dispatch())
+    tasks.append(dispatcher)
+    try:
+        series: List[Tuple[str, list]] = []
+        failed = 0
+        for _ in range(total):
+            item = await next_finished()
+            if item.result.error:
+                failed += 1
+            else:
+                series.append((item.result.image_filename, item.result.annotations))
+            yield item.model_dump_json(by_alias=True) + "\n"
+
+        try:
+            series_report = await run_io_bound(REPORT_STAGE, generate_series_report, series)
+        except StageSaturatedError as e:
+            series_report = f"Series report unavailable: {e}"
+        logger.info(f"Batch of {total} files finished ({failed} failed).")
+        yield SeriesReport(files=total, failed=failed, diagnostic_report=series_report).model_dump_json() + "\n"
+    finally:
+        for task in tasks:
+            task.cancel()
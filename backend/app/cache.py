@@ -0,0 +1,353 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Generic, Optional, Tuple, TypeVar
+
+from .config import settings
+from .models import CachedDiagnosis
+from .prompts import REPORT_PROMPT_VERSION
+
+logger = logging.getLogger(__name__)
+
+V = TypeVar("V")
+
+
+class LRUCache(Generic[V]):
+    """Thread-safe in-memory LRU with entry-count, byte-size and TTL eviction."""
+
+    def __init__(
+        self,
+        max_entries: int,
+        max_bytes: int,
+        ttl_seconds: float,
+        size_of: Callable[[V], int] = lambda value: 1,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._size_of = size_of
+        self._entries: "OrderedDict[str, Tuple[float, int, V]]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[V]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, _, value = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: V) -> None:
+        size = self._size_of(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, size, value)
+            self._total_bytes += size
+            while self._entries and (
+                len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes
+            ):
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+
+    def _remove(self, key: str) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._total_bytes -= size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+
+class SQLiteCache:
+    """Persistent key/value tier storing bytes in a single SQLite file, with TTL expiry."""
+
+    def __init__(self, path: str, ttl_seconds: float, table: str = "cache"):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._table = table
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, expires_at REAL NOT NULL, value BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT expires_at, value FROM {self._table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            expires_at, value = row
+            if expires_at < time.time():
+                self._conn.execute(f"DELETE FROM {self._table} WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            return value
+
+    def set(self, key: str, value: bytes) -> None:
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self._table} (key, expires_at, value) VALUES (?, ?, ?)",
+                (key, time.time() + self.ttl_seconds, value),
+            )
+            self._conn.commit()
+
+    def purge_expired(self) -> None:
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self._table} WHERE expires_at < ?", (time.time(),))
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self._table}")
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class ResultCache:
+    """
+    Two-tier cache of diagnosis results keyed by upload content: an in-memory LRU
+    in front of an optional SQLite file that survives restarts.
+    """
+
+    def __init__(self, memory: LRUCache[CachedDiagnosis], disk: Optional[SQLiteCache] = None):
+        self.memory = memory
+        self.disk = disk
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._counter_lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[CachedDiagnosis]:
+        cached = self.memory.get(key)
+        if cached is not None:
+            self._count("memory_hits")
+            return cached
+        if self.disk is not None:
+            raw = self.disk.get(key)
+            if raw is not None:
+                try:
+                    cached = CachedDiagnosis.model_validate_json(raw)
+                except Exception as e:
+                    logger.warning(f"Discarding unreadable disk cache entry {key[:12]}: {e}")
+                else:
+                    self.memory.set(key, cached)
+                    self._count("disk_hits")
+                    return cached
+        self._count("misses")
+        return None
+
+    def set(self, key: str, value: CachedDiagnosis) -> None:
+        self.memory.set(key, value)
+        if self.disk is not None:
+            try:
+                self.disk.set(key, value.model_dump_json(by_alias=True).encode("utf-8"))
+            except Exception as e:
+                logger.warning(f"Failed to persist cache entry {key[:12]}: {e}")
+
+    def _count(self, counter: str) -> None:
+        with self._counter_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.memory_hits + self.disk_hits,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "entries": len(self.memory),
+            "bytes": self.memory.total_bytes,
+        }
+
+    def clear(self) -> None:
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+
+class ReportCache:
+    """
+    Cache of LLM report text keyed by a findings signature: an in-memory LRU in
+    front of an optional SQLite table. Many studies share a signature, so one
+    Gemini call serves all of them.
+    """
+
+    def __init__(self, memory: LRUCache[str], disk: Optional[SQLiteCache] = None):
+        self.memory = memory
+        self.disk = disk
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._counter_lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        report = self.memory.get(key)
+        if report is None and self.disk is not None:
+            raw = self.disk.get(key)
+            if raw is not None:
+                report = raw.decode("utf-8")
+                self.memory.set(key, report)
+        self._count("hits" if report is not None else "misses")
+        return report
+
+    def set(self, key: str, report: str) -> None:
+        self.memory.set(key, report)
+        if self.disk is not None:
+            try:
+                self.disk.set(key, report.encode("utf-8"))
+            except Exception as e:
+                logger.warning(f"Failed to persist report cache entry: {e}")
+
+    def count_coalesced(self) -> None:
+        self._count("coalesced")
+
+    def _count(self, counter: str) -> None:
+        with self._counter_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "entries": len(self.memory),
+        }
+
+    def clear(self) -> None:
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller runs the
+    function, later callers block until it finishes and receive the same result
+    (or exception). Callers run on pool threads, so waiting is a plain Event.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, "_Call"] = {}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Returns (result, shared); shared is True for callers that waited on another's call."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+def _cached_diagnosis_size(value: CachedDiagnosis) -> int:
+    return len(value.image_png) + len(value.diagnostic_report) + 128 * len(value.annotations)
+
+
+def make_result_cache_key(file_bytes: bytes) -> str:
+    """Hash of the upload plus every setting that changes the detector output or the report."""
+    return make_result_cache_key_for_digest(hashlib.sha256(file_bytes).hexdigest())
+
+
+def make_result_cache_key_for_digest(digest: str) -> str:
+    """Like make_result_cache_key, for an upload whose SHA-256 was computed while streaming it."""
+    if settings.DETECTOR_BACKEND.lower() == "onnx":
+        detector_id = f"onnx={settings.ONNX_MODEL_PATH}"
+    else:
+        # The upload size and encoding change what the hosted model sees.
+        detector_id = (
+            f"{settings.ROBOFLOW_MODEL_ID}@{settings.ROBOFLOW_INPUT_SIZE}"
+            f"{settings.ROBOFLOW_IMAGE_FORMAT}{settings.ROBOFLOW_JPEG_QUALITY}"
+        )
+    return (
+        f"{digest}:{detector_id}:"
+        f"{settings.ROBOFLOW_CONFIDENCE:.4f}:{settings.ROBOFLOW_OVERLAP:.4f}:"
+        f"{settings.GEMINI_MODEL}:p{REPORT_PROMPT_VERSION}"
+    )
+
+
+def create_result_cache() -> Optional[ResultCache]:
+    if not settings.RESULT_CACHE_ENABLED:
+        return None
+    memory: LRUCache[CachedDiagnosis] = LRUCache(
+        max_entries=settings.RESULT_CACHE_MAX_ENTRIES,
+        max_bytes=settings.RESULT_CACHE_MAX_BYTES,
+        ttl_seconds=settings.RESULT_CACHE_TTL_SECONDS,
+        size_of=_cached_diagnosis_size,
+    )
+    disk = None
+    if settings.RESULT_CACHE_DB_PATH:
+        try:
+            disk = SQLiteCache(settings.RESULT_CACHE_DB_PATH, settings.RESULT_CACHE_TTL_SECONDS, table="diagnosis_results")
+        except Exception as e:
+            logger.error(f"Could not open result cache database {settings.RESULT_CACHE_DB_PATH}: {e}")
+    return ResultCache(memory, disk)
+
+
+def create_report_cache() -> Optional[ReportCache]:
+    if not settings.REPORT_CACHE_ENABLED:
+        return None
+    memory: LRUCache[str] = LRUCache(
+        max_entries=settings.REPORT_CACHE_MAX_ENTRIES,
+        max_bytes=settings.REPORT_CACHE_MAX_ENTRIES * 16 * 1024,
+        ttl_seconds=settings.REPORT_CACHE_TTL_SECONDS,
+        size_of=len,
+    )
+    disk = None
+    if settings.REPORT_CACHE_DB_PATH:
+        try:
+            disk = SQLiteCache(settings.REPORT_CACHE_DB_PATH, settings.REPORT_CACHE_TTL_SECONDS, table="llm_reports")
+        except Exception as e:
+            logger.error(f"Could not open report cache database {settings.REPORT_CACHE_DB_PATH}: {e}")
+    return ReportCache(memory, disk)
+
+
+result_cache = create_result_cache()
+report_cache = create_report_cache()
+report_singleflight = SingleFlight()
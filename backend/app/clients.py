@@ -0,0 +1,289 @@
+"""
+Long-lived clients for the external services, created once per process and
+tied to the FastAPI lifespan: a pooled keep-alive HTTP session for the hosted
+Roboflow API and a Gemini model configured once. Warmup at startup opens the
+first connections so the first requests do not pay for the TLS handshakes.
+"""
+import base64
+import contextvars
+import io
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from .config import settings
+from .metrics import observe_size, stage_timer
+
+logger = logging.getLogger(__name__)
+
+
+def rescale_result(result: Any, factor: float) -> Any:
+    """Multiplies prediction boxes (and the reported image size) by factor, in place."""
+    if factor == 1.0 or not isinstance(result, dict):
+        return result
+    for prediction in result.get("predictions") or []:
+        if isinstance(prediction, dict):
+            for key in ("x", "y", "width", "height"):
+                if isinstance(prediction.get(key), (int, float)):
+                    prediction[key] = prediction[key] * factor
+    image = result.get("image")
+    if isinstance(image, dict):
+        for key in ("width", "height"):
+            if isinstance(image.get(key), (int, float)):
+                image[key] = round(image[key] * factor)
+    return result
+
+
+class RoboflowClient:
+    """
+    Calls the hosted Roboflow detect API (the v0 API used by inference-sdk for
+    detect.roboflow.com) over one pooled requests.Session, so connections and
+    TLS sessions are reused across requests.
+    """
+
+    def __init__(
+        self,
+        api_url: str,
+        api_key: str,
+        model_id: str,
+        confidence: float,
+        overlap: float,
+        pool_size: int = 16,
+        connect_timeout: float = 3.0,
+        read_timeout: float = 30.0,
+        input_size: int = 0,
+        image_format: str = "jpeg",
+        jpeg_quality: int = 90,
+    ):
+        self.api_url = api_url.rstrip("/")
+        self.api_key = api_key
+        self.model_id = model_id
+        self.confidence = confidence
+        self.overlap = overlap
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_size = max(1, pool_size)
+        self.input_size = input_size
+        self.image_format = image_format.lower()
+        self.jpeg_quality = jpeg_quality
+
+        # Imported here so deployments that never call Roboflow do not load requests at startup.
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.session = requests.Session()
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+        self.session.mount("https://", self._adapter)
+        self.session.mount("http://", self._adapter)
+        self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="roboflow")
+
+        self.requests = 0
+        self.total_seconds = 0.0
+        self._stats_lock = threading.Lock()
+
+    def prepare_image(self, pil_image: Image.Image) -> Tuple[str, float]:
+        """
+        Downscales the image so its longer side is at most input_size (the model
+        resizes to that anyway) and encodes it. Returns the base64 payload and the
+        scale applied, which is used to map predictions back to original pixels.
+        """
+        scale = 1.0
+        longest = max(pil_image.size)
+        if self.input_size > 0 and longest > self.input_size:
+            scale = self.input_size / longest
+            pil_image = pil_image.resize(
+                (max(1, round(pil_image.width * scale)), max(1, round(pil_image.height * scale))),
+                Image.Resampling.BILINEAR,
+            )
+        if pil_image.mode not in ("L", "RGB"):
+            pil_image = pil_image.convert("RGB")
+        buffered = io.BytesIO()
+        if self.image_format == "png":
+            pil_image.save(buffered, format="PNG", compress_level=1)
+        else:
+            pil_image.save(buffered, format="JPEG", quality=self.jpeg_quality)
+        return base64.b64encode(buffered.getvalue()).decode("ascii"), scale
+
+    def infer(self, pil_image: Image.Image, read_timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Runs one image through the model and returns the decoded JSON response, in
+        original-image pixels. read_timeout overrides the client's read timeout.
+        """
+        with stage_timer("roboflow_encode"):
+            payload, scale = self.prepare_image(pil_image)
+        observe_size("roboflow_request", len(payload))
+        started = time.perf_counter()
+        with stage_timer("roboflow_request"):
+            response = self.session.post(
+                f"{self.api_url}/{self.model_id}",
+                params={"api_key": self.api_key, "confidence": self.confidence, "overlap": self.overlap},
+                data=payload,
+                headers={"Content-Type": "application/x-www-form-urlencoded"},
+                timeout=self.timeout if read_timeout is None else (self.timeout[0], read_timeout),
+            )
+        elapsed = time.perf_counter() - started
+        with self._stats_lock:
+            self.requests += 1
+            self.total_seconds += elapsed
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Roboflow request took %.1f ms (HTTP %d, %d pooled connections).",
+                elapsed * 1000, response.status_code, self.open_connections()
+            )
+        response.raise_for_status()
+        return rescale_result(response.json(), 1.0 / scale)
+
+    def infer_many(
+        self,
+        pil_images: List[Image.Image],
+        infer: Optional[Callable[[Image.Image], Dict[str, Any]]] = None,
+    ) -> List[Tuple[Optional[Dict[str, Any]], Optional[Exception]]]:
+        """
+        Runs several images concurrently over the shared pool, through `infer`
+        (default: self.infer) in the caller's context. Returns (result, exception) per image.
+        """
+        infer = infer or self.infer
+
+        def run(pil_image):
+            try:
+                return infer(pil_image), None
+            except Exception as e:
+                return None, e
+
+        context = contextvars.copy_context()
+        return list(self._executor.map(lambda pil_image: context.copy().run(run, pil_image), pil_images))
+
+    def open_connections(self) -> int:
+        """Number of connections the pool has opened so far (reused connections are not counted again)."""
+        pools = self._adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys())
+
+    def warmup(self) -> None:
+        """Opens a pooled connection to the API host so the first inference skips the handshake."""
+        import requests
+
+        try:
+            self.session.head(self.api_url, timeout=self.timeout)
+        except requests.RequestException as e:
+            logger.warning(f"Roboflow warmup request failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            average_ms = self.total_seconds / self.requests * 1000 if self.requests else 0.0
+            return {
+                "requests": self.requests,
+                "connections_opened": self.open_connections(),
+                "average_latency_ms": round(average_ms, 1),
+            }
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+
+class GeminiClient:
+    """A Gemini GenerativeModel configured once and reused for every report."""
+
+    def __init__(self, api_key: str, model_name: str, timeout: float = 60.0, api_endpoint: str = ""):
+        import google.generativeai as genai
+
+        if api_endpoint:
+            genai.configure(api_key=api_key, transport="rest", client_options={"api_endpoint": api_endpoint})
+        else:
+            genai.configure(api_key=api_key)
+        self.genai = genai
+        self.model_name = model_name
+        self.timeout = timeout
+        self.model = genai.GenerativeModel(model_name)
+
+    def generate_content(self, prompt: str, timeout: Optional[float] = None, **kwargs):
+        # The SDK's default retry keeps retrying 503s for up to ten minutes; failures are
+        # handled by the caller (circuit breaker, simulated report, job stage retries) instead.
+        return self.model.generate_content(
+            prompt,
+            request_options={"timeout": self.timeout if timeout is None else timeout, "retry": None},
+            **kwargs
+        )
+
+    def warmup(self) -> None:
+        """Fetches the model description, which opens the channel to the API."""
+        try:
+            self.genai.get_model(f"models/{self.model_name}", request_options={"timeout": self.timeout})
+        except Exception as e:
+            logger.warning(f"Gemini warmup request failed: {e}")
+
+
+_roboflow_client: Optional[RoboflowClient] = None
+_gemini_client: Optional[GeminiClient] = None
+_clients_lock = threading.Lock()
+
+
+def _create_roboflow_client() -> RoboflowClient:
+    return RoboflowClient(
+        api_url=settings.ROBOFLOW_API_URL,
+        api_key=settings.ROBOFLOW_API_KEY,
+        model_id=settings.ROBOFLOW_MODEL_ID,
+        confidence=settings.ROBOFLOW_CONFIDENCE,
+        overlap=settings.ROBOFLOW_OVERLAP,
+        pool_size=settings.HTTP_POOL_SIZE,
+        connect_timeout=settings.HTTP_CONNECT_TIMEOUT_SECONDS,
+        read_timeout=settings.ROBOFLOW_TIMEOUT_SECONDS,
+        input_size=settings.ROBOFLOW_INPUT_SIZE,
+        image_format=settings.ROBOFLOW_IMAGE_FORMAT,
+        jpeg_quality=settings.ROBOFLOW_JPEG_QUALITY,
+    )
+
+
+def get_roboflow_client() -> RoboflowClient:
+    global _roboflow_client
+    if _roboflow_client is None:
+        with _clients_lock:
+            if _roboflow_client is None:
+                _roboflow_client = _create_roboflow_client()
+    return _roboflow_client
+
+
+def get_gemini_client() -> GeminiClient:
+    global _gemini_client
+    if _gemini_client is None:
+        with _clients_lock:
+            if _gemini_client is None:
+                _gemini_client = GeminiClient(
+                    settings.GEMINI_API_KEY,
+                    settings.GEMINI_MODEL,
+                    timeout=settings.GEMINI_TIMEOUT_SECONDS,
+                    api_endpoint=settings.GEMINI_API_ENDPOINT,
+                )
+    return _gemini_client
+
+
+def start_clients(roboflow: bool, gemini: bool) -> None:
+    """Creates the clients that will be used and, if CLIENT_WARMUP is set, warms them up."""
+    if roboflow:
+        client = get_roboflow_client()
+        if settings.CLIENT_WARMUP:
+            client.warmup()
+    if gemini:
+        try:
+            client = get_gemini_client()
+        except Exception as e:
+            logger.error(f"Could not create Gemini client: {e}", exc_info=True)
+        else:
+            if settings.CLIENT_WARMUP:
+                client.warmup()
+
+
+def close_clients() -> None:
+    global _roboflow_client, _gemini_client
+    with _clients_lock:
+        if _roboflow_client is not None:
+            _roboflow_client.close()
+            _roboflow_client = None
+        _gemini_client = None
+
+
+def client_stats() -> Dict[str, Any]:
+    return {"roboflow": _roboflow_client.stats() if _roboflow_client is not None else None}
@@ -0,0 +1,187 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+
+from .config import settings
+from .logs import configure_logging, current_request_id, run_with_request_id
+from .metrics import record_stage_timings, run_with_stage_timings, stage_timer
+
+logger = logging.getLogger(__name__)
+
+DECODE_STAGE = "decode"
+INFERENCE_STAGE = "inference"
+REPORT_STAGE = "report"
+
+
+class StageSaturatedError(Exception):
+    """Raised when a pipeline stage is at its concurrency limit and its wait queue is full."""
+
+    def __init__(self, stage: str, retry_after: int):
+        super().__init__(f"The '{stage}' stage is saturated. Please retry later.")
+        self.stage = stage
+        self.retry_after = retry_after
+
+
+class StageLimiter:
+    """
+    Caps how many requests run a stage at once and how many may wait for a slot.
+    Requests arriving when both are exhausted are rejected instead of queued.
+    """
+
+    def __init__(self, name: str, concurrency: int, max_waiting: int):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.max_waiting = max(0, max_waiting)
+        self.in_flight = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    async def __aenter__(self):
+        if self.in_flight >= self.concurrency and self.waiting >= self.max_waiting:
+            raise StageSaturatedError(self.name, settings.RETRY_AFTER_SECONDS)
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.in_flight -= 1
+        self._semaphore.release()
+        return False
+
+
+_limiters: Dict[str, StageLimiter] = {}
+_process_pool: Optional[ProcessPoolExecutor] = None
+_thread_pool: Optional[ThreadPoolExecutor] = None
+_cpu_initializer: Optional[Callable[[], None]] = None
+
+
+def _stage_concurrency(stage: str) -> int:
+    return {
+        DECODE_STAGE: settings.DECODE_CONCURRENCY,
+        INFERENCE_STAGE: settings.INFERENCE_CONCURRENCY,
+        REPORT_STAGE: settings.REPORT_CONCURRENCY,
+    }.get(stage, settings.INFERENCE_CONCURRENCY)
+
+
+def get_limiter(stage: str) -> StageLimiter:
+    limiter = _limiters.get(stage)
+    if limiter is None:
+        limiter = StageLimiter(stage, _stage_concurrency(stage), settings.STAGE_QUEUE_LIMIT)
+        _limiters[stage] = limiter
+    return limiter
+
+
+def get_io_executor() -> ThreadPoolExecutor:
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(
+            max_workers=max(1, settings.IO_THREAD_WORKERS),
+            thread_name_prefix="diagnose-io",
+        )
+    return _thread_pool
+
+
+def get_cpu_executor() -> Executor:
+    global _process_pool
+    if settings.DECODE_PROCESS_WORKERS <= 0:
+        return get_io_executor()
+    if _process_pool is None:
+        # "spawn" avoids forking a process that already runs executor and event loop threads.
+        _process_pool = ProcessPoolExecutor(
+            max_workers=settings.DECODE_PROCESS_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_cpu_worker,
+            initargs=(_cpu_initializer,),
+        )
+    return _process_pool
+
+
+def _init_cpu_worker(initializer: Optional[Callable[[], None]]) -> None:
+    configure_logging()
+    if initializer is not None:
+        initializer()
+
+
+def set_cpu_initializer(initializer: Optional[Callable[[], None]]) -> None:
+    """Sets a picklable function each decode worker process runs when it starts."""
+    global _cpu_initializer
+    _cpu_initializer = initializer
+
+
+async def start_cpu_workers() -> int:
+    """
+    Starts all decode worker processes now rather than on the first uploads, so
+    their interpreter startup and initializer are off the request path. Returns
+    how many distinct workers answered (0 when decoding runs on the thread pool).
+    """
+    if settings.DECODE_PROCESS_WORKERS <= 0:
+        return 0
+    loop = asyncio.get_running_loop()
+    executor = get_cpu_executor()
+    # Each submission that finds no idle worker starts a new process.
+    pids = await asyncio.gather(*(
+        loop.run_in_executor(executor, os.getpid) for _ in range(settings.DECODE_PROCESS_WORKERS)
+    ))
+    return len(set(pids))
+
+
+async def run_cpu_bound(stage: str, fn: Callable[..., Any], *args: Any) -> Any:
+    """
+    Runs a picklable CPU-bound function on the decode pool, subject to the stage
+    limit. Stage timings recorded inside the worker are replayed in this process.
+    """
+    global _process_pool
+    with stage_timer(stage):
+        async with get_limiter(stage):
+            loop = asyncio.get_running_loop()
+            # Worker processes do not share this context; the correlation ID is passed along explicitly.
+            call = functools.partial(run_with_request_id, current_request_id(), fn, *args)
+            try:
+                if not settings.METRICS_ENABLED:
+                    return await loop.run_in_executor(get_cpu_executor(), call)
+                result, timings = await loop.run_in_executor(
+                    get_cpu_executor(), functools.partial(run_with_stage_timings, call)
+                )
+                record_stage_timings(timings)
+                return result
+            except BrokenProcessPool:
+                logger.error(f"Decode process pool broke while running stage '{stage}'. Recreating it.")
+                if _process_pool is not None:
+                    _process_pool.shutdown(wait=False, cancel_futures=True)
+                    _process_pool = None
+                raise
+
+
+async def run_io_bound(stage: str, fn: Callable[..., Any], *args: Any) -> Any:
+    """Runs a blocking network-bound function on the I/O thread pool, subject to the stage limit."""
+    with stage_timer(stage):
+        async with get_limiter(stage):
+            loop = asyncio.get_running_loop()
+            # Run in a copy of the request context so stages timed inside fn reach its Server-Timing.
+            context = contextvars.copy_context()
+            return await loop.run_in_executor(get_io_executor(), functools.partial(context.run, fn, *args))
+
+
+def limiter_snapshot() -> Dict[str, Dict[str, int]]:
+    return {name: {"in_flight": limiter.in_flight, "waiting": limiter.waiting} for name, limiter in _limiters.items()}
+
+
+def shutdown_executors() -> None:
+    global _process_pool, _thread_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+    if _thread_pool is not None:
+        _thread_pool.shutdown(wait=False, cancel_futures=True)
+        _thread_pool = None
+    _limiters.clear()
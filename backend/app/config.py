@@ -7,12 +7,175 @@ load_dotenv()
 class Settings(BaseSettings):
     ROBOFLOW_API_KEY: str = os.getenv("ROBOFLOW_API_KEY", "YOUR_ROBOFLOW_API_KEY_PLACEHOLDER")
     ROBOFLOW_MODEL_ID: str = os.getenv("ROBOFLOW_MODEL_ID", "your_model_project/version") # e.g., "adr/6"
+    ROBOFLOW_CONFIDENCE: float = float(os.getenv("ROBOFLOW_CONFIDENCE", "0.30"))
+    ROBOFLOW_OVERLAP: float = float(os.getenv("ROBOFLOW_OVERLAP", "0.50"))
+    ROBOFLOW_API_URL: str = os.getenv("ROBOFLOW_API_URL", "https://detect.roboflow.com")
+    # Images are downscaled to the model input size before upload (0 = send full
+    # resolution) and encoded as "jpeg" (at ROBOFLOW_JPEG_QUALITY) or lossless "png".
+    ROBOFLOW_INPUT_SIZE: int = int(os.getenv("ROBOFLOW_INPUT_SIZE", "640"))
+    ROBOFLOW_IMAGE_FORMAT: str = os.getenv("ROBOFLOW_IMAGE_FORMAT", "jpeg")
+    ROBOFLOW_JPEG_QUALITY: int = int(os.getenv("ROBOFLOW_JPEG_QUALITY", "90"))
+    
+    # Detector backend: "roboflow" (hosted API) or "onnx" (in-process ONNX Runtime
+    # on CPU). The ONNX backend reuses the confidence/overlap thresholds above.
+    # ONNX_CLASS_NAMES is comma-separated; if empty, the model's "names" metadata is used.
+    DETECTOR_BACKEND: str = os.getenv("DETECTOR_BACKEND", "roboflow")
+    ONNX_MODEL_PATH: str = os.getenv("ONNX_MODEL_PATH", "")
+    ONNX_CLASS_NAMES: str = os.getenv("ONNX_CLASS_NAMES", "")
+    ONNX_INPUT_SIZE: int = int(os.getenv("ONNX_INPUT_SIZE", "640"))
+    ONNX_MAX_DETECTIONS: int = int(os.getenv("ONNX_MAX_DETECTIONS", "300"))
+    ONNX_INTRA_OP_THREADS: int = int(os.getenv("ONNX_INTRA_OP_THREADS", "0"))
+    
+    # Tiled detection: images whose longer side exceeds TILING_THRESHOLD_PIXELS
+    # (0 = never tile) are split into TILING_TILE_SIZE tiles overlapping by TILING_OVERLAP
+    # (a fraction of the tile), plus the whole image when TILING_INCLUDE_FULL_IMAGE
+    # is set. Duplicates across tiles are merged per class with "nms" or "wbf"
+    # (weighted box fusion) when they overlap by more than TILING_MATCH_THRESHOLD of
+    # the smaller box. A tile size equal to the model input size avoids any downscaling.
+    # (TILE_SIZE below is the unrelated tile size of the image viewer's pyramid.)
+    TILING_THRESHOLD_PIXELS: int = int(os.getenv("TILING_THRESHOLD_PIXELS", "2048"))
+    TILING_TILE_SIZE: int = int(os.getenv("TILING_TILE_SIZE", "1024"))
+    TILING_OVERLAP: float = float(os.getenv("TILING_OVERLAP", "0.2"))
+    TILING_INCLUDE_FULL_IMAGE: bool = os.getenv("TILING_INCLUDE_FULL_IMAGE", "true").lower() == "true"
+    TILING_MERGE: str = os.getenv("TILING_MERGE", "nms")
+    TILING_MATCH_THRESHOLD: float = float(os.getenv("TILING_MATCH_THRESHOLD", "0.6"))
     
     OPENAI_API_KEY: str | None = os.getenv("OPENAI_API_KEY")
     GEMINI_API_KEY: str | None = os.getenv("GEMINI_API_KEY")
+    GEMINI_MODEL: str = os.getenv("GEMINI_MODEL", "gemini-1.5-flash-latest")
+    # Alternative Gemini REST endpoint (e.g. a proxy, or benchmarks/stub_servers.py);
+    # empty uses Google's default endpoint and transport.
+    GEMINI_API_ENDPOINT: str = os.getenv("GEMINI_API_ENDPOINT", "")
+
+    # Long-lived HTTP clients: connections to Roboflow are pooled and kept alive
+    # across requests. CLIENT_WARMUP opens them (and the Gemini channel) at startup.
+    HTTP_POOL_SIZE: int = int(os.getenv("HTTP_POOL_SIZE", "16"))
+    HTTP_CONNECT_TIMEOUT_SECONDS: float = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "3"))
+    ROBOFLOW_TIMEOUT_SECONDS: float = float(os.getenv("ROBOFLOW_TIMEOUT_SECONDS", "30"))
+    GEMINI_TIMEOUT_SECONDS: float = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "60"))
+    CLIENT_WARMUP: bool = os.getenv("CLIENT_WARMUP", "true").lower() == "true"
+
+    # Upstream resilience. Each /api/diagnose request has REQUEST_BUDGET_SECONDS
+    # (0 = no budget) for its Roboflow and Gemini calls; each call's timeout is the
+    # smaller of its own cap above and what is left of the budget, and detection
+    # leaves REPORT_RESERVE_SECONDS of it for the report. A service that fails
+    # BREAKER_FAILURE_THRESHOLD calls in a row (timeouts, connection errors, 5xx,
+    # 429) is skipped for BREAKER_RESET_SECONDS, then probed with one call. With a
+    # *_HEDGE_AFTER_SECONDS above 0, a call still running after that long is sent a
+    # second time and the first answer wins.
+    REQUEST_BUDGET_SECONDS: float = float(os.getenv("REQUEST_BUDGET_SECONDS", "60"))
+    REPORT_RESERVE_SECONDS: float = float(os.getenv("REPORT_RESERVE_SECONDS", "10"))
+    BREAKER_FAILURE_THRESHOLD: int = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+    BREAKER_RESET_SECONDS: float = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+    ROBOFLOW_HEDGE_AFTER_SECONDS: float = float(os.getenv("ROBOFLOW_HEDGE_AFTER_SECONDS", "0"))
+    GEMINI_HEDGE_AFTER_SECONDS: float = float(os.getenv("GEMINI_HEDGE_AFTER_SECONDS", "0"))
+
+    # Startup: heavy SDKs (pydicom, numpy, onnxruntime, requests, google-generativeai)
+    # are imported only by the backends that are configured. STARTUP_WARMUP picks
+    # when the detector, clients and decoders are initialized: "blocking" before the
+    # app accepts requests, "background" right after it starts accepting them (the
+    # fastest cold start on scale-to-zero hosts), or "off" (on first use, or when
+    # POST /api/warmup is called).
+    STARTUP_WARMUP: str = os.getenv("STARTUP_WARMUP", "blocking")
+
+    # Executors: DICOM decode/windowing is CPU-bound and goes to a process pool
+    # (0 workers = run it on the thread pool instead); Roboflow/Gemini calls are
+    # network-bound and go to a thread pool.
+    DECODE_PROCESS_WORKERS: int = int(os.getenv("DECODE_PROCESS_WORKERS", "2"))
+    IO_THREAD_WORKERS: int = int(os.getenv("IO_THREAD_WORKERS", "16"))
+
+    # Per-stage concurrency limits and how many requests may queue behind each
+    # stage before new ones are rejected with 503 + Retry-After.
+    DECODE_CONCURRENCY: int = int(os.getenv("DECODE_CONCURRENCY", "2"))
+    INFERENCE_CONCURRENCY: int = int(os.getenv("INFERENCE_CONCURRENCY", "8"))
+    REPORT_CONCURRENCY: int = int(os.getenv("REPORT_CONCURRENCY", "8"))
+    STAGE_QUEUE_LIMIT: int = int(os.getenv("STAGE_QUEUE_LIMIT", "32"))
+    RETRY_AFTER_SECONDS: int = int(os.getenv("RETRY_AFTER_SECONDS", "5"))
+
+    # Upload ingestion: uploads are streamed to a temp file in UPLOAD_CHUNK_BYTES
+    # chunks and rejected with 413 past UPLOAD_MAX_BYTES. DECODE_MAX_PIXEL_BYTES
+    # caps the decoded pixel buffer, checked from the header before decoding.
+    UPLOAD_MAX_BYTES: int = int(os.getenv("UPLOAD_MAX_BYTES", str(128 * 1024 * 1024)))
+    UPLOAD_CHUNK_BYTES: int = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+    UPLOAD_TMP_DIR: str = os.getenv("UPLOAD_TMP_DIR", "")
+    DECODE_MAX_PIXEL_BYTES: int = int(os.getenv("DECODE_MAX_PIXEL_BYTES", str(1024 * 1024 * 1024)))
+    DICOM_DEFER_SIZE: str = os.getenv("DICOM_DEFER_SIZE", "1 KB")
+    # Longest side of the converted image (0 = full resolution). JPEG 2000 and JPEG
+    # baseline are decoded at the smallest power-of-two reduction that still covers
+    # it; other syntaxes are decoded in full and scaled down. Leave at 0 when viewers
+    # need full-resolution tiles or large images are tiled for detection.
+    DECODE_MAX_SIDE: int = int(os.getenv("DECODE_MAX_SIDE", "0"))
+
+    # Batch diagnosis: maximum files per request (after zip expansion) and how many
+    # decoded images are grouped into one inference call.
+    BATCH_MAX_FILES: int = int(os.getenv("BATCH_MAX_FILES", "40"))
+    INFERENCE_BATCH_SIZE: int = int(os.getenv("INFERENCE_BATCH_SIZE", "8"))
+    BATCH_MAX_FILE_BYTES: int = int(os.getenv("BATCH_MAX_FILE_BYTES", str(64 * 1024 * 1024)))
+    BATCH_MAX_TOTAL_BYTES: int = int(os.getenv("BATCH_MAX_TOTAL_BYTES", str(512 * 1024 * 1024)))
+
+    # Asynchronous jobs (/api/jobs): uploads and job state live in JOB_DATA_DIR so
+    # queued jobs survive restarts. JOB_WORKERS worker processes are started with
+    # the app (0 = run them separately with `python -m app.jobs`). A job whose
+    # worker stops heartbeating for JOB_LEASE_SECONDS is handed to another worker;
+    # failed detection/report stages are retried JOB_STAGE_RETRIES times and a
+    # crashed job is re-run up to JOB_MAX_ATTEMPTS times with exponential backoff.
+    JOB_DATA_DIR: str = os.getenv("JOB_DATA_DIR", "job_data")
+    JOB_WORKERS: int = int(os.getenv("JOB_WORKERS", "2"))
+    JOB_POLL_INTERVAL_SECONDS: float = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "0.5"))
+    JOB_LEASE_SECONDS: float = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+    JOB_MAX_ATTEMPTS: int = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+    JOB_STAGE_RETRIES: int = int(os.getenv("JOB_STAGE_RETRIES", "2"))
+    JOB_RETRY_BACKOFF_SECONDS: float = float(os.getenv("JOB_RETRY_BACKOFF_SECONDS", "2"))
+    JOB_RETENTION_SECONDS: int = int(os.getenv("JOB_RETENTION_SECONDS", str(24 * 3600)))
+
+    # Result cache for repeat uploads of the same study. The on-disk SQLite tier is
+    # only used when RESULT_CACHE_DB_PATH is set.
+    RESULT_CACHE_ENABLED: bool = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+    RESULT_CACHE_MAX_ENTRIES: int = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "256"))
+    RESULT_CACHE_MAX_BYTES: int = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+    RESULT_CACHE_TTL_SECONDS: int = int(os.getenv("RESULT_CACHE_TTL_SECONDS", str(24 * 3600)))
+    RESULT_CACHE_DB_PATH: str = os.getenv("RESULT_CACHE_DB_PATH", "")
+
+    # LLM report cache keyed by the findings signature (classes, counts and
+    # confidences rounded to REPORT_CONFIDENCE_BUCKET), shared by all studies with
+    # the same findings. Concurrent requests for one signature share one LLM call.
+    REPORT_CACHE_ENABLED: bool = os.getenv("REPORT_CACHE_ENABLED", "true").lower() == "true"
+    REPORT_CACHE_MAX_ENTRIES: int = int(os.getenv("REPORT_CACHE_MAX_ENTRIES", "1024"))
+    REPORT_CACHE_TTL_SECONDS: int = int(os.getenv("REPORT_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+    REPORT_CACHE_DB_PATH: str = os.getenv("REPORT_CACHE_DB_PATH", "")
+    REPORT_CONFIDENCE_BUCKET: float = float(os.getenv("REPORT_CONFIDENCE_BUCKET", "0.1"))
+
+    # Converted images are served by ID from /api/images instead of being inlined
+    # as base64. PNG_COMPRESS_LEVEL trades size for encode time (0-9, zlib levels).
+    PNG_COMPRESS_LEVEL: int = int(os.getenv("PNG_COMPRESS_LEVEL", "3"))
+    PREVIEW_SIZE: int = int(os.getenv("PREVIEW_SIZE", "512"))
+    PREVIEW_QUALITY: int = int(os.getenv("PREVIEW_QUALITY", "80"))
+    TILE_SIZE: int = int(os.getenv("TILE_SIZE", "512"))
+    IMAGE_STORE_MAX_ENTRIES: int = int(os.getenv("IMAGE_STORE_MAX_ENTRIES", "256"))
+    IMAGE_STORE_MAX_BYTES: int = int(os.getenv("IMAGE_STORE_MAX_BYTES", str(1024 * 1024 * 1024)))
+    IMAGE_STORE_TTL_SECONDS: int = int(os.getenv("IMAGE_STORE_TTL_SECONDS", str(24 * 3600)))
+    IMAGE_STORE_DIR: str = os.getenv("IMAGE_STORE_DIR", "")
+
+    # Instrumentation: per-stage latency histograms and counters on /metrics, and
+    # optionally a Server-Timing header with the per-request stage breakdown.
+    METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    SERVER_TIMING_ENABLED: bool = os.getenv("SERVER_TIMING_ENABLED", "false").lower() == "true"
+
+    # Logging (see app/logs.py). LOG_FORMAT is "text" or "json"; with LOG_QUEUE the
+    # records are written by a background thread instead of the thread that logs.
+    # LOG_STAGE_LEVELS overrides the level per stage logger, e.g.
+    # "detection=DEBUG,report=WARNING". Per-item debug records (one per prediction)
+    # are kept with probability LOG_SAMPLE_RATE and at most LOG_SAMPLE_MAX_PER_SECOND
+    # (0 = no limit) per kind.
+    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
+    LOG_FORMAT: str = os.getenv("LOG_FORMAT", "text")
+    LOG_QUEUE: bool = os.getenv("LOG_QUEUE", "true").lower() == "true"
+    LOG_STAGE_LEVELS: str = os.getenv("LOG_STAGE_LEVELS", "")
+    LOG_SAMPLE_RATE: float = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+    LOG_SAMPLE_MAX_PER_SECOND: float = float(os.getenv("LOG_SAMPLE_MAX_PER_SECOND", "50"))
 
     class Config:
         env_file = ".env"
         extra = "ignore"
 
-settings = Settings()
\ No newline at end of file
+settings = Settings()
@@ -0,0 +1,166 @@
+"""
+Pixel decoding for DICOM datasets, one frame at a time.
+
+`ds.pixel_array` decodes every frame at full resolution with whichever plugin
+pydicom tries first. Here a frame is decoded on its own (only its fragments are
+read), with the plugin that is fastest for the transfer syntax, and JPEG 2000
+and JPEG baseline frames can be decoded at a reduced resolution when the
+caller only needs an image of a given size: JPEG 2000 skips wavelet levels and
+JPEG scales while decoding the DCT blocks. Several frames can be decoded on a
+thread pool; that only runs in parallel with a decoder that releases the GIL.
+
+Imported by the decode workers, never by the web process at startup.
+"""
+import functools
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence
+
+import numpy as np
+import pydicom
+from PIL import Image
+from pydicom.encaps import get_frame
+from pydicom.pixels import get_decoder, pixel_array
+from pydicom.uid import (
+    JPEG2000,
+    JPEG2000Lossless,
+    JPEGBaseline8Bit,
+    JPEGExtended12Bit,
+    JPEGLossless,
+    JPEGLosslessSV1,
+    JPEGLSLossless,
+    JPEGLSNearLossless,
+    RLELossless,
+    UID,
+)
+
+logger = logging.getLogger(__name__)
+
+# Fastest first, as measured by `python -m benchmarks.bench_decode --decoders`
+# (2000x1600 frame: JPEG 2000 pylibjpeg 820 ms vs. pillow 1320 ms; JPEG baseline
+# pillow 22 ms vs. pylibjpeg 89 ms). Unlisted syntaxes use pydicom's own order.
+DECODER_PREFERENCE = {
+    JPEG2000Lossless: ("pylibjpeg", "gdcm", "pillow"),
+    JPEG2000: ("pylibjpeg", "gdcm", "pillow"),
+    JPEGBaseline8Bit: ("pillow", "pylibjpeg", "gdcm"),
+    JPEGExtended12Bit: ("pylibjpeg", "pillow", "gdcm"),
+    JPEGLossless: ("pylibjpeg", "gdcm"),
+    JPEGLosslessSV1: ("pylibjpeg", "gdcm"),
+    JPEGLSLossless: ("pylibjpeg", "pyjpegls", "gdcm"),
+    JPEGLSNearLossless: ("pylibjpeg", "pyjpegls", "gdcm"),
+    RLELossless: ("pylibjpeg", "pydicom", "gdcm"),
+}
+# Plugins whose codec runs without holding the GIL, so frames decode in parallel on threads.
+GIL_RELEASING_DECODERS = ("pillow",)
+
+JPEG2000_SYNTAXES = (JPEG2000Lossless, JPEG2000)
+# Pillow can decode these at 1/2, 1/4, ... resolution directly from the codestream.
+REDUCIBLE_SYNTAXES = JPEG2000_SYNTAXES + (JPEGBaseline8Bit,)
+MAX_REDUCE_LEVEL = 5
+
+
+@functools.lru_cache(maxsize=None)
+def available_decoders(transfer_syntax: UID) -> Sequence[str]:
+    """The installed pydicom decoding plugins for a transfer syntax; empty for uncompressed data."""
+    try:
+        return tuple(get_decoder(transfer_syntax).available_plugins)
+    except NotImplementedError:
+        return ()
+
+
+@functools.lru_cache(maxsize=None)
+def select_decoder(transfer_syntax: UID, parallel: bool = False) -> str:
+    """
+    The plugin to decode a transfer syntax with, or "" to let pydicom choose.
+    With `parallel`, a GIL-releasing plugin is preferred when one is installed.
+    """
+    available = available_decoders(transfer_syntax)
+    if parallel:
+        for plugin in GIL_RELEASING_DECODERS:
+            if plugin in available:
+                return plugin
+    for plugin in DECODER_PREFERENCE.get(transfer_syntax, ()):
+        if plugin in available:
+            return plugin
+    return ""
+
+
+def frame_count(ds: pydicom.Dataset) -> int:
+    return int(ds.get("NumberOfFrames", 1) or 1)
+
+
+def reduce_level(width: int, height: int, max_side: int) -> int:
+    """How many times the image can be halved with its longer side staying at least max_side."""
+    if max_side <= 0:
+        return 0
+    longest, level = max(width, height), 0
+    while level < MAX_REDUCE_LEVEL and longest // 2 ** (level + 1) >= max_side:
+        level += 1
+    return level
+
+
+def _decode_reduced(ds: pydicom.Dataset, index: int, level: int) -> Optional[np.ndarray]:
+    """Decodes one frame at 1/2**level resolution with Pillow, or returns None if that is not possible."""
+    transfer_syntax = ds.file_meta.TransferSyntaxUID
+    if int(ds.get("SamplesPerPixel", 1)) != 1 or int(ds.get("PixelRepresentation", 0)) != 0:
+        return None
+    frame = get_frame(ds.PixelData, index, number_of_frames=frame_count(ds))
+    try:
+        with Image.open(io.BytesIO(frame)) as image:
+            if transfer_syntax in JPEG2000_SYNTAXES:
+                image.reduce = level
+            else:
+                image.draft("L", (int(ds.Columns) >> level, int(ds.Rows) >> level))
+            image.load()
+            pixels = np.asarray(image)
+    except Exception as e:
+        logger.warning(f"Reduced-resolution decode failed, decoding at full resolution: {e}")
+        return None
+    bits_stored = int(ds.get("BitsStored", 16))
+    if pixels.dtype == np.uint16 and bits_stored < 16:
+        # Pillow scales JPEG 2000 samples up to the full 16 bits; undo it to get stored values.
+        pixels = pixels >> (16 - bits_stored)
+    return pixels
+
+
+def decode_frame(ds: pydicom.Dataset, index: int = 0, max_side: int = 0, decoding_plugin: Optional[str] = None) -> np.ndarray:
+    """
+    Decodes frame `index` of the dataset's pixel data, leaving the other frames
+    encoded. With max_side > 0, JPEG 2000 and JPEG baseline frames may come back
+    reduced by a power of two, never below max_side on the longer side.
+    """
+    transfer_syntax = ds.file_meta.TransferSyntaxUID
+    if max_side > 0 and transfer_syntax in REDUCIBLE_SYNTAXES:
+        level = reduce_level(int(ds.Columns), int(ds.Rows), max_side)
+        if level > 0:
+            pixels = _decode_reduced(ds, index, level)
+            if pixels is not None:
+                return pixels
+    if decoding_plugin is None:
+        decoding_plugin = select_decoder(transfer_syntax)
+    return pixel_array(ds, index=index, decoding_plugin=decoding_plugin)
+
+
+def decode_frames(
+    ds: pydicom.Dataset,
+    indices: Optional[Sequence[int]] = None,
+    max_side: int = 0,
+    max_workers: int = 0,
+) -> List[np.ndarray]:
+    """
+    Decodes several frames (all by default) on up to max_workers threads
+    (0 = one per CPU). When more than one thread is used, a GIL-releasing
+    plugin is chosen so the frames really decode in parallel.
+    """
+    indices = list(range(frame_count(ds)) if indices is None else indices)
+    workers = min(max_workers or os.cpu_count() or 1, len(indices))
+    transfer_syntax = ds.file_meta.TransferSyntaxUID
+    if workers <= 1 or not transfer_syntax.is_compressed:
+        return [decode_frame(ds, index, max_side) for index in indices]
+    plugin = select_decoder(transfer_syntax, parallel=True)
+    # Load deferred pixel data once, before the threads share the dataset.
+    _ = ds.PixelData
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="frame-decode") as pool:
+        return list(pool.map(lambda index: decode_frame(ds, index, max_side, plugin), indices))
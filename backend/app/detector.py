@@ -0,0 +1,50 @@
+"""
+Pluggable object detectors. `detect_objects_roboflow_sdk` delegates to the
+detector selected by DETECTOR_BACKEND: the hosted Roboflow API (services.py) or
+the in-process ONNX Runtime backend (onnx_detector.py). This module holds only
+the interface, so importing it does not pull in numpy or onnxruntime.
+"""
+import ast
+import logging
+from abc import ABC, abstractmethod
+from typing import List, Optional, Tuple
+
+from PIL import Image
+
+from .models import RoboflowPrediction
+
+logger = logging.getLogger(__name__)
+
+
+class Detector(ABC):
+    """Runs object detection on PIL images and returns one (predictions, error) per image."""
+
+    name = "detector"
+
+    @abstractmethod
+    def detect_batch(self, pil_images: List[Image.Image]) -> List[Tuple[List[RoboflowPrediction], Optional[str]]]:
+        ...
+
+    def detect(self, pil_image: Image.Image) -> Tuple[List[RoboflowPrediction], Optional[str]]:
+        return self.detect_batch([pil_image])[0]
+
+    def warmup(self) -> None:
+        """Does whatever makes the first real detection as fast as later ones. No-op by default."""
+
+
+def parse_class_names(raw: Optional[str]) -> List[str]:
+    """
+    Accepts a comma-separated list ("caries,calculus") or the dict literal that
+    Ultralytics writes to the model's `names` metadata ("{0: 'caries', ...}").
+    """
+    if not raw:
+        return []
+    raw = raw.strip()
+    if raw.startswith("{"):
+        try:
+            names = ast.literal_eval(raw)
+            return [str(names[i]) for i in sorted(names)]
+        except (ValueError, SyntaxError, TypeError) as e:
+            logger.warning(f"Could not parse class names metadata: {e}")
+            return []
+    return [name.strip() for name in raw.split(",") if name.strip()]
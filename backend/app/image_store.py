@@ -0,0 +1,157 @@
+import hashlib
+import io
+import logging
+import math
+import os
+import re
+import tempfile
+from typing import Callable, Optional, Tuple
+
+from PIL import Image
+
+from .cache import LRUCache
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+IMAGE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+PREVIEW_FORMATS = {"webp": ("WEBP", "image/webp"), "jpeg": ("JPEG", "image/jpeg"), "png": ("PNG", "image/png")}
+
+
+def make_image_id(png_bytes: bytes) -> str:
+    """Content hash of the PNG, so the ID doubles as a strong ETag."""
+    return hashlib.sha256(png_bytes).hexdigest()[:32]
+
+
+class ImageStore:
+    """
+    Holds converted radiographs by ID: an in-memory LRU of PNG bytes, an optional
+    directory that survives restarts, and an LRU of derived previews and tiles.
+    """
+
+    def __init__(self, memory: LRUCache[bytes], variants: LRUCache[bytes], directory: Optional[str] = None):
+        self.memory = memory
+        self.variants = variants
+        self.directory = directory
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, image_id: str) -> str:
+        return os.path.join(self.directory, f"{image_id}.png")
+
+    def put(self, png_bytes: bytes) -> str:
+        image_id = make_image_id(png_bytes)
+        self.memory.set(image_id, png_bytes)
+        if self.directory and not os.path.exists(self._path(image_id)):
+            try:
+                fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+                with os.fdopen(fd, "wb") as f:
+                    f.write(png_bytes)
+                os.replace(tmp_path, self._path(image_id))
+            except OSError as e:
+                logger.warning(f"Failed to persist image {image_id}: {e}")
+        return image_id
+
+    def get(self, image_id: str) -> Optional[bytes]:
+        if not IMAGE_ID_PATTERN.match(image_id):
+            return None
+        png_bytes = self.memory.get(image_id)
+        if png_bytes is None and self.directory:
+            try:
+                with open(self._path(image_id), "rb") as f:
+                    png_bytes = f.read()
+            except FileNotFoundError:
+                return None
+            self.memory.set(image_id, png_bytes)
+        return png_bytes
+
+    def get_variant(self, image_id: str, variant: str, render: Callable[[bytes], Optional[bytes]]) -> Optional[bytes]:
+        """Returns a derived rendition of the image, rendering and caching it on first use."""
+        key = f"{image_id}:{variant}"
+        cached = self.variants.get(key)
+        if cached is not None:
+            return cached
+        png_bytes = self.get(image_id)
+        if png_bytes is None:
+            return None
+        rendered = render(png_bytes)
+        if rendered is not None:
+            self.variants.set(key, rendered)
+        return rendered
+
+    def clear(self) -> None:
+        self.memory.clear()
+        self.variants.clear()
+
+
+def _encode(image: Image.Image, fmt: str) -> bytes:
+    pil_format, _ = PREVIEW_FORMATS[fmt]
+    buffered = io.BytesIO()
+    if pil_format == "PNG":
+        image.save(buffered, format="PNG", compress_level=settings.PNG_COMPRESS_LEVEL)
+    else:
+        image.save(buffered, format=pil_format, quality=settings.PREVIEW_QUALITY)
+    return buffered.getvalue()
+
+
+def image_size(png_bytes: bytes) -> Tuple[int, int]:
+    with Image.open(io.BytesIO(png_bytes)) as image:
+        return image.size
+
+
+def render_preview(png_bytes: bytes, max_size: int, fmt: str) -> bytes:
+    """Aspect-preserving downscale so the longer side is at most max_size."""
+    with Image.open(io.BytesIO(png_bytes)) as image:
+        preview = image.convert("L")
+        preview.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+        return _encode(preview, fmt)
+
+
+def pyramid_levels(width: int, height: int, tile_size: int) -> int:
+    """Number of levels; level 0 is full resolution and each level halves the previous one."""
+    longest = max(width, height, 1)
+    return max(1, math.ceil(math.log2(longest / tile_size)) + 1) if longest > tile_size else 1
+
+
+def render_tile(png_bytes: bytes, level: int, col: int, row: int, tile_size: int, fmt: str) -> Optional[bytes]:
+    with Image.open(io.BytesIO(png_bytes)) as image:
+        width, height = image.size
+        if level < 0 or level >= pyramid_levels(width, height, tile_size):
+            return None
+        scale = 2 ** level
+        level_width, level_height = math.ceil(width / scale), math.ceil(height / scale)
+        left, top = col * tile_size, row * tile_size
+        if col < 0 or row < 0 or left >= level_width or top >= level_height:
+            return None
+        # Crop in full-resolution coordinates, then downscale only the crop.
+        box = (
+            left * scale,
+            top * scale,
+            min((left + tile_size) * scale, width),
+            min((top + tile_size) * scale, height),
+        )
+        tile = image.crop(box)
+        if scale > 1:
+            tile = tile.resize(
+                (math.ceil((box[2] - box[0]) / scale), math.ceil((box[3] - box[1]) / scale)),
+                Image.Resampling.BOX,
+            )
+        return _encode(tile, fmt)
+
+
+image_store = ImageStore(
+    memory=LRUCache(
+        max_entries=settings.IMAGE_STORE_MAX_ENTRIES,
+        max_bytes=settings.IMAGE_STORE_MAX_BYTES,
+        ttl_seconds=settings.IMAGE_STORE_TTL_SECONDS,
+        size_of=len,
+    ),
+    variants=LRUCache(
+        max_entries=settings.IMAGE_STORE_MAX_ENTRIES * 8,
+        max_bytes=settings.IMAGE_STORE_MAX_BYTES // 4,
+        ttl_seconds=settings.IMAGE_STORE_TTL_SECONDS,
+        size_of=len,
+    ),
+    directory=settings.IMAGE_STORE_DIR or None,
+)
@@ -0,0 +1,99 @@
+"""
+Streaming ingestion of uploaded DICOM files: the upload is copied to a temp
+file in fixed-size chunks, hashed on the way, rejected as soon as it exceeds
+UPLOAD_MAX_BYTES, and checked for the DICOM preamble before anything parses it.
+Decoding then works from the file path, so the request never holds the whole
+file as a bytes object.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+from dataclasses import dataclass
+from typing import Optional
+
+from fastapi import UploadFile
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+DICOM_PREAMBLE_LENGTH = 128
+DICOM_MAGIC = b"DICM"
+
+
+class UploadTooLargeError(Exception):
+    def __init__(self, max_bytes: int):
+        super().__init__(f"File exceeds the maximum upload size of {max_bytes} bytes.")
+        self.max_bytes = max_bytes
+
+
+class NotDicomError(Exception):
+    pass
+
+
+@dataclass
+class SpooledUpload:
+    path: str
+    size: int
+    sha256: str
+
+    def remove(self) -> None:
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def has_dicom_magic(header: bytes) -> bool:
+    """True if the bytes start with the 128-byte preamble followed by 'DICM'."""
+    end = DICOM_PREAMBLE_LENGTH + len(DICOM_MAGIC)
+    return len(header) >= end and header[DICOM_PREAMBLE_LENGTH:end] == DICOM_MAGIC
+
+
+async def spool_upload(
+    upload: UploadFile,
+    max_bytes: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+) -> SpooledUpload:
+    """
+    Copies the upload to a temp file chunk by chunk. Raises UploadTooLargeError
+    as soon as the size limit is crossed (or up front if the declared size is
+    already over it), NotDicomError if the DICOM magic is missing, and ValueError
+    for an empty upload. The caller owns the returned file and must remove() it.
+    """
+    max_bytes = settings.UPLOAD_MAX_BYTES if max_bytes is None else max_bytes
+    chunk_size = chunk_size or settings.UPLOAD_CHUNK_BYTES
+    if upload.size is not None and upload.size > max_bytes:
+        raise UploadTooLargeError(max_bytes)
+
+    digest = hashlib.sha256()
+    size = 0
+    header = b""
+    fd, path = tempfile.mkstemp(prefix="upload-", suffix=".dcm", dir=settings.UPLOAD_TMP_DIR or None)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await upload.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLargeError(max_bytes)
+                if len(header) < DICOM_PREAMBLE_LENGTH + len(DICOM_MAGIC):
+                    header += chunk[: DICOM_PREAMBLE_LENGTH + len(DICOM_MAGIC) - len(header)]
+                    if len(header) == DICOM_PREAMBLE_LENGTH + len(DICOM_MAGIC) and not has_dicom_magic(header):
+                        raise NotDicomError("File is not DICOM: the 'DICM' prefix after the 128-byte preamble is missing.")
+                digest.update(chunk)
+                out.write(chunk)
+        if size == 0:
+            raise ValueError("Empty file received.")
+        if not has_dicom_magic(header):
+            raise NotDicomError("File is not DICOM: it is too short to contain the DICOM preamble.")
+    except BaseException:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        raise
+    return SpooledUpload(path=path, size=size, sha256=digest.hexdigest())
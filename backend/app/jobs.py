@@ -0,0 +1,482 @@
+"""
+Asynchronous diagnosis jobs. `POST /api/jobs` spools the upload into
+JOB_DATA_DIR and enqueues a row in a SQLite job table; worker processes claim
+jobs from that table, run decode -> inference -> report, and write the
+DiagnosisResponse back. Clients poll `GET /api/jobs/{id}` or follow
+`GET /api/jobs/{id}/events` (Server-Sent Events).
+
+There is no broker: the table is the queue. A claim takes a lease that the
+worker renews at every stage, so a job whose worker died is picked up again
+once its lease expires, and queued jobs survive restarts with the data dir.
+
+Workers can run embedded in the web app (JOB_WORKERS > 0) or on their own:
+    python -m app.jobs --workers 4
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import List, Optional
+
+from .cache import make_result_cache_key_for_digest, result_cache
+from .concurrency import DECODE_STAGE, INFERENCE_STAGE, REPORT_STAGE
+from .config import settings
+from .image_store import image_store
+from .logs import configure_logging, correlation_scope
+from .metrics import record_error
+from .models import CachedDiagnosis, DiagnosisResponse, JobStatus
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+FINISHED_STATUSES = (COMPLETED, FAILED)
+
+_COLUMNS = (
+    "id, filename, status, stage, attempts, input_path, sha256, result, error, "
+    "created_at, updated_at, available_at, lease_expires_at, worker_id"
+)
+
+
+@dataclass
+class JobRecord:
+    id: str
+    filename: str
+    status: str
+    stage: str
+    attempts: int
+    input_path: str
+    sha256: str
+    result: Optional[str]
+    error: Optional[str]
+    created_at: float
+    updated_at: float
+    available_at: float
+    lease_expires_at: Optional[float]
+    worker_id: Optional[str]
+
+    def to_status(self) -> JobStatus:
+        return JobStatus(
+            job_id=self.id,
+            status=self.status,
+            stage=self.stage,
+            attempts=self.attempts,
+            created_at=self.created_at,
+            updated_at=self.updated_at,
+            image_filename=self.filename,
+            result=DiagnosisResponse.model_validate_json(self.result) if self.result else None,
+            error=self.error,
+        )
+
+
+class LeaseLostError(Exception):
+    """Raised by a worker whose lease on a job was taken over by another worker."""
+
+
+class JobStore:
+    """
+    SQLite-backed job table shared by the web process and the workers. Each
+    process opens its own connection; claims run in an IMMEDIATE transaction so
+    two workers never take the same job.
+    """
+
+    def __init__(self, data_dir: str):
+        self.data_dir = data_dir
+        os.makedirs(data_dir, exist_ok=True)
+        self.path = os.path.join(data_dir, "jobs.sqlite3")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, filename TEXT NOT NULL, status TEXT NOT NULL, stage TEXT NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, input_path TEXT NOT NULL, sha256 TEXT NOT NULL, "
+            "result TEXT, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL, "
+            "available_at REAL NOT NULL, lease_expires_at REAL, worker_id TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, available_at)")
+
+    def input_path(self, job_id: str) -> str:
+        return os.path.join(self.data_dir, f"{job_id}.dcm")
+
+    def image_path(self, job_id: str) -> str:
+        return os.path.join(self.data_dir, f"{job_id}.png")
+
+    def enqueue(self, filename: str, upload_path: str, sha256: str) -> JobRecord:
+        """Moves the spooled upload into the data dir and queues a job for it."""
+        job_id = uuid.uuid4().hex
+        input_path = self.input_path(job_id)
+        shutil.move(upload_path, input_path)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, filename, status, stage, input_path, sha256, created_at, updated_at, available_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, filename, QUEUED, QUEUED, input_path, sha256, now, now, now),
+            )
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[JobRecord]:
+        with self._lock:
+            row = self._conn.execute(f"SELECT {_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return JobRecord(*row) if row else None
+
+    def claim(self, worker_id: str, lease_seconds: float, max_attempts: int) -> Optional[JobRecord]:
+        """
+        Takes the oldest runnable job: a queued job whose backoff has elapsed, or
+        a running job whose worker let its lease expire. Jobs that have used up
+        their attempts are failed instead of being claimed again.
+        """
+        while True:
+            now = time.time()
+            with self._lock:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    row = self._conn.execute(
+                        f"SELECT {_COLUMNS} FROM jobs "
+                        "WHERE (status = ? AND available_at <= ?) OR (status = ? AND lease_expires_at < ?) "
+                        "ORDER BY created_at LIMIT 1",
+                        (QUEUED, now, RUNNING, now),
+                    ).fetchone()
+                    if row is None:
+                        self._conn.execute("COMMIT")
+                        return None
+                    job = JobRecord(*row)
+                    if job.attempts >= max_attempts:
+                        self._conn.execute(
+                            "UPDATE jobs SET status = ?, error = ?, updated_at = ?, lease_expires_at = NULL WHERE id = ?",
+                            (FAILED, f"Job did not finish after {job.attempts} attempts.", now, job.id),
+                        )
+                        self._conn.execute("COMMIT")
+                        logger.error(f"Job {job.id} failed: out of attempts after its worker stopped.")
+                        self._remove_files(job, keep_image=False)
+                        continue
+                    self._conn.execute(
+                        "UPDATE jobs SET status = ?, attempts = attempts + 1, worker_id = ?, "
+                        "lease_expires_at = ?, updated_at = ? WHERE id = ?",
+                        (RUNNING, worker_id, now + lease_seconds, now, job.id),
+                    )
+                    self._conn.execute("COMMIT")
+                except BaseException:
+                    self._conn.execute("ROLLBACK")
+                    raise
+            return self.get(job.id)
+
+    def _update_owned(self, job: JobRecord, assignments: str, values: tuple) -> None:
+        """Updates a running job only while this worker still holds its lease."""
+        with self._lock:
+            cursor = self._conn.execute(
+                f"UPDATE jobs SET {assignments}, updated_at = ? "
+                "WHERE id = ? AND status = ? AND worker_id = ? AND attempts = ?",
+                values + (time.time(), job.id, RUNNING, job.worker_id, job.attempts),
+            )
+        if cursor.rowcount == 0:
+            raise LeaseLostError(f"Lost the lease on job {job.id}.")
+
+    def set_stage(self, job: JobRecord, stage: str, lease_seconds: float) -> None:
+        """Records stage progress and renews the lease."""
+        self._update_owned(job, "stage = ?, lease_expires_at = ?", (stage, time.time() + lease_seconds))
+        job.stage = stage
+
+    def complete(self, job: JobRecord, response: DiagnosisResponse) -> None:
+        self._update_owned(
+            job,
+            "status = ?, stage = ?, result = ?, error = NULL, lease_expires_at = NULL",
+            (COMPLETED, "done", response.model_dump_json(by_alias=True)),
+        )
+        self._remove_files(job, keep_image=True)
+
+    def retry_or_fail(self, job: JobRecord, error: str, max_attempts: int, backoff_seconds: float) -> None:
+        """Re-queues the job after an unexpected error, with exponential backoff, or fails it for good."""
+        if job.attempts < max_attempts:
+            delay = backoff_seconds * 2 ** (job.attempts - 1)
+            self._update_owned(
+                job,
+                "status = ?, stage = ?, error = ?, available_at = ?, lease_expires_at = NULL",
+                (QUEUED, QUEUED, error, time.time() + delay),
+            )
+            logger.warning(f"Job {job.id} attempt {job.attempts} failed ({error}); retrying in {delay:g}s.")
+        else:
+            self._update_owned(job, "status = ?, error = ?, lease_expires_at = NULL", (FAILED, error))
+            logger.error(f"Job {job.id} failed after {job.attempts} attempts: {error}")
+            self._remove_files(job, keep_image=False)
+
+    def purge_finished(self, older_than_seconds: float) -> int:
+        """Deletes finished jobs (and their files) last updated more than older_than_seconds ago."""
+        cutoff = time.time() - older_than_seconds
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {_COLUMNS} FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                FINISHED_STATUSES + (cutoff,),
+            ).fetchall()
+            self._conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?", FINISHED_STATUSES + (cutoff,)
+            )
+        for row in rows:
+            self._remove_files(JobRecord(*row), keep_image=False)
+        return len(rows)
+
+    def counts(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: 0 for status in (QUEUED, RUNNING, COMPLETED, FAILED)} | dict(rows)
+
+    def _remove_files(self, job: JobRecord, keep_image: bool) -> None:
+        paths = [job.input_path] if keep_image else [job.input_path, self.image_path(job.id)]
+        for path in paths:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_job_store: Optional[JobStore] = None
+
+
+def get_job_store() -> JobStore:
+    global _job_store
+    if _job_store is None or _job_store.data_dir != settings.JOB_DATA_DIR:
+        _job_store = JobStore(settings.JOB_DATA_DIR)
+    return _job_store
+
+
+def load_job_image(store: JobStore, job_id: str, image_id: str) -> None:
+    """
+    Makes a job's converted image servable from /api/images in this process:
+    the worker that produced it runs in another process with its own image store.
+    """
+    if image_store.get(image_id) is not None:
+        return
+    try:
+        with open(store.image_path(job_id), "rb") as f:
+            image_store.put(f.read())
+    except FileNotFoundError:
+        logger.warning(f"Image for job {job_id} is no longer available.")
+
+
+def _with_stage_retries(job: JobRecord, stage: str, attempt_fn, succeeded) -> tuple:
+    """Calls attempt_fn up to JOB_STAGE_RETRIES + 1 times until succeeded(result), backing off between tries."""
+    result = attempt_fn()
+    for retry in range(settings.JOB_STAGE_RETRIES):
+        if succeeded(result):
+            break
+        delay = settings.JOB_RETRY_BACKOFF_SECONDS * 2 ** retry
+        logger.warning(f"Job {job.id}: stage '{stage}' failed; retry {retry + 1} in {delay:g}s.")
+        time.sleep(delay)
+        result = attempt_fn()
+    return result
+
+
+def process_job(store: JobStore, job: JobRecord) -> None:
+    """Runs one claimed job through decode -> inference -> report and records the outcome."""
+    # Imported here so the web process only loads the pipeline if it runs workers.
+    from .services import (
+        convert_dicom_file_to_pil_and_png,
+        detect_objects_roboflow_sdk,
+        generate_llm_report,
+        generate_llm_report_with_source
+    )
+
+    lease = settings.JOB_LEASE_SECONDS
+    cache_key = make_result_cache_key_for_digest(job.sha256) if result_cache is not None else None
+    if cache_key is not None:
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"Job {job.id}: result cache hit for {job.filename}.")
+            image_id = _save_image(store, job, cached.image_png)
+            store.complete(job, DiagnosisResponse(
+                image_filename=job.filename,
+                image_id=image_id,
+                image_width=cached.image_width,
+                image_height=cached.image_height,
+                annotations=cached.annotations,
+                diagnostic_report=cached.diagnostic_report
+            ))
+            return
+
+    store.set_stage(job, DECODE_STAGE, lease)
+    pil_image, png_bytes, error_dicom = convert_dicom_file_to_pil_and_png(job.input_path)
+    if error_dicom or not pil_image or not png_bytes:
+        # A file that cannot be decoded will not decode on a retry either.
+        logger.error(f"Job {job.id}: DICOM conversion error for {job.filename}: {error_dicom}")
+        record_error(DECODE_STAGE)
+        store.complete(job, DiagnosisResponse(
+            image_filename=job.filename,
+            annotations=[],
+            diagnostic_report="Could not process DICOM file.",
+            error=f"Failed to convert DICOM: {error_dicom}"
+        ))
+        return
+    image_fields = {
+        "image_id": _save_image(store, job, png_bytes),
+        "image_width": pil_image.width,
+        "image_height": pil_image.height,
+    }
+
+    store.set_stage(job, INFERENCE_STAGE, lease)
+    annotations, error_roboflow = _with_stage_retries(
+        job, INFERENCE_STAGE, lambda: detect_objects_roboflow_sdk(pil_image), lambda outcome: outcome[1] is None
+    )
+    if error_roboflow:
+        logger.error(f"Job {job.id}: detection error for {job.filename}: {error_roboflow}")
+        record_error(INFERENCE_STAGE)
+        store.set_stage(job, REPORT_STAGE, lease)
+        store.complete(job, DiagnosisResponse(
+            image_filename=job.filename,
+            **image_fields,
+            annotations=[],
+            diagnostic_report=generate_llm_report([]),
+            error=f"Roboflow detection failed: {error_roboflow}. Report generated based on no detections."
+        ))
+        return
+
+    store.set_stage(job, REPORT_STAGE, lease)
+    # A simulated fallback report is retried, then accepted (but not cached).
+    diagnostic_report, report_is_final = _with_stage_retries(
+        job, REPORT_STAGE, lambda: generate_llm_report_with_source(annotations), lambda outcome: outcome[1]
+    )
+    if cache_key is not None and report_is_final:
+        result_cache.set(cache_key, CachedDiagnosis(
+            image_png=png_bytes,
+            image_width=pil_image.width,
+            image_height=pil_image.height,
+            annotations=annotations,
+            diagnostic_report=diagnostic_report
+        ))
+    store.complete(job, DiagnosisResponse(
+        image_filename=job.filename,
+        **image_fields,
+        annotations=annotations,
+        diagnostic_report=diagnostic_report
+    ))
+
+
+def _save_image(store: JobStore, job: JobRecord, png_bytes: bytes) -> str:
+    """Stores the PNG locally and next to the job, where the web process picks it up."""
+    image_id = image_store.put(png_bytes)
+    tmp_path = store.image_path(job.id) + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(png_bytes)
+    os.replace(tmp_path, store.image_path(job.id))
+    return image_id
+
+
+def run_next_job(store: JobStore, worker_id: str) -> bool:
+    """Claims and runs one job. Returns False if there was nothing to run."""
+    job = store.claim(worker_id, settings.JOB_LEASE_SECONDS, settings.JOB_MAX_ATTEMPTS)
+    if job is None:
+        return False
+    # The job's records carry its ID; the request that queued it logged the same ID.
+    with correlation_scope(job.id):
+        logger.info(f"Worker {worker_id} running job {job.id} ({job.filename}), attempt {job.attempts}.")
+        try:
+            process_job(store, job)
+        except LeaseLostError as e:
+            logger.warning(f"Worker {worker_id}: {e} Abandoning it.")
+        except Exception as e:
+            logger.error(f"Job {job.id} raised an unexpected error: {e}", exc_info=True)
+            try:
+                store.retry_or_fail(job, f"Unexpected error: {e}", settings.JOB_MAX_ATTEMPTS, settings.JOB_RETRY_BACKOFF_SECONDS)
+            except LeaseLostError:
+                pass
+    return True
+
+
+# How often an idle worker deletes finished jobs older than JOB_RETENTION_SECONDS.
+PURGE_INTERVAL_SECONDS = 600
+
+
+def worker_main(worker_id: str, stop_event=None) -> None:
+    """Entry point of a worker process: loads the pipeline once and runs jobs until stopped."""
+    from .services import load_detector, start_service_clients
+
+    if not logging.getLogger().handlers:
+        configure_logging()
+    start_service_clients(load_detector())
+    store = JobStore(settings.JOB_DATA_DIR)
+    logger.info(f"Job worker {worker_id} started (pid {os.getpid()}).")
+    next_purge = 0.0
+    while stop_event is None or not stop_event.is_set():
+        try:
+            if run_next_job(store, worker_id):
+                continue
+            if time.monotonic() >= next_purge:
+                purged = store.purge_finished(settings.JOB_RETENTION_SECONDS)
+                if purged:
+                    logger.info(f"Purged {purged} finished jobs.")
+                next_purge = time.monotonic() + PURGE_INTERVAL_SECONDS
+        except sqlite3.Error as e:
+            logger.error(f"Job worker {worker_id} database error: {e}")
+        if stop_event is not None:
+            stop_event.wait(settings.JOB_POLL_INTERVAL_SECONDS)
+        else:
+            time.sleep(settings.JOB_POLL_INTERVAL_SECONDS)
+    store.close()
+    logger.info(f"Job worker {worker_id} stopped.")
+
+
+_workers: List[multiprocessing.Process] = []
+_stop_event = None
+
+
+def start_job_workers(count: int) -> None:
+    """Starts `count` worker processes alongside the web app."""
+    global _stop_event
+    if count <= 0 or _workers:
+        return
+    context = multiprocessing.get_context("spawn")
+    _stop_event = context.Event()
+    for index in range(count):
+        process = context.Process(
+            target=worker_main, args=(f"{os.getpid()}-{index}", _stop_event), name=f"job-worker-{index}", daemon=True
+        )
+        process.start()
+        _workers.append(process)
+    logger.info(f"Started {count} job worker processes.")
+
+
+def stop_job_workers(timeout: float = 10.0) -> None:
+    """Asks the workers to stop after their current job. Jobs still running are re-claimed after their lease expires."""
+    global _stop_event
+    if _stop_event is not None:
+        _stop_event.set()
+    for process in _workers:
+        process.join(timeout)
+        if process.is_alive():
+            process.terminate()
+    _workers.clear()
+    _stop_event = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run diagnosis job workers without the web server.")
+    parser.add_argument("--workers", type=int, default=max(1, settings.JOB_WORKERS))
+    args = parser.parse_args()
+    configure_logging()
+
+    start_job_workers(args.workers)
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+    try:
+        while not stopped.is_set() and any(process.is_alive() for process in _workers):
+            stopped.wait(1.0)
+    except KeyboardInterrupt:
+        pass
+    stop_job_workers()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+Logging for the web app and the job workers.
+
+Records are put on a queue by the thread that logs them and written by a
+listener thread, so a slow stderr or log collector never blocks a request.
+Every record carries the correlation ID of the request (or job) it belongs to,
+taken from the X-Request-ID header or generated, and LOG_FORMAT=json writes one
+JSON object per line for log collectors.
+
+Hot-path code logs through per-stage loggers (`stage_logger("detection")` is
+"app.stage.detection") whose levels are set with LOG_STAGE_LEVELS, e.g.
+"detection=DEBUG,report=WARNING", so one stage can be made verbose without the
+others. Verbose records that repeat per item (one per prediction) pass
+`extra={"sample_key": ...}`; they are kept with probability LOG_SAMPLE_RATE and
+at most LOG_SAMPLE_MAX_PER_SECOND per key, and the next kept record reports how
+many were dropped. Messages use %-style arguments, so nothing is formatted for
+a record that is filtered out; large objects go through `LazyRepr`, which
+renders a size-bounded repr only if the record is written.
+"""
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import queue
+import random
+import re
+import reprlib
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from .config import settings
+
+STAGE_LOGGER_PREFIX = "app.stage"
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s"
+
+_request_id: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="-")
+
+_listener: Optional[QueueListener] = None
+
+# Attributes every LogRecord has; anything else on a record came from `extra`.
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_bounded_repr = reprlib.Repr()
+_bounded_repr.maxstring = 200
+_bounded_repr.maxother = 200
+_bounded_repr.maxlist = 10
+_bounded_repr.maxdict = 10
+_bounded_repr.maxlevel = 3
+
+
+class LazyRepr:
+    """Defers a size-bounded repr of `value` until a handler formats the record."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any):
+        self.value = value
+
+    def __str__(self) -> str:
+        return _bounded_repr.repr(self.value)
+
+
+def stage_logger(stage: str) -> logging.Logger:
+    return logging.getLogger(f"{STAGE_LOGGER_PREFIX}.{stage}")
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def current_request_id() -> str:
+    return _request_id.get()
+
+
+@contextmanager
+def correlation_scope(request_id: str) -> Iterator[None]:
+    """Tags the records logged in this context (and the threads it is copied to) with request_id."""
+    token = _request_id.set(request_id)
+    try:
+        yield
+    finally:
+        _request_id.reset(token)
+
+
+def run_with_request_id(request_id: str, fn: Callable[..., Any], *args: Any) -> Any:
+    """Runs fn with request_id as the correlation ID, e.g. in a worker process."""
+    with correlation_scope(request_id):
+        return fn(*args)
+
+
+_REQUEST_ID_PATTERN = re.compile(r"[A-Za-z0-9._:-]{1,64}")
+
+
+def request_id_from_header(value: Optional[str]) -> str:
+    """The client's X-Request-ID if it is a plausible ID (it ends up in every log line), else a new one."""
+    if value and _REQUEST_ID_PATTERN.fullmatch(value):
+        return value
+    return new_request_id()
+
+
+class CorrelationFilter(logging.Filter):
+    """Stamps the current correlation ID on the record, in the thread that logged it."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _request_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Thins out records logged with a `sample_key`: each is kept with probability
+    `rate`, and at most `max_per_second` per key (token bucket; 0 = no limit).
+    """
+
+    def __init__(self, rate: float, max_per_second: float, seed: Optional[int] = None):
+        super().__init__()
+        self.rate = rate
+        self.max_per_second = max_per_second
+        self._random = random.Random(seed)
+        self._buckets: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, "sample_key", None)
+        if key is None:
+            return True
+        with self._lock:
+            # [tokens, last refill time, records dropped since the last one kept]
+            bucket = self._buckets.setdefault(key, [self.max_per_second, time.monotonic(), 0])
+            keep = self.rate >= 1.0 or self._random.random() < self.rate
+            if keep and self.max_per_second > 0:
+                now = time.monotonic()
+                bucket[0] = min(self.max_per_second, bucket[0] + (now - bucket[1]) * self.max_per_second)
+                bucket[1] = now
+                keep = bucket[0] >= 1.0
+                if keep:
+                    bucket[0] -= 1.0
+            if not keep:
+                bucket[2] += 1
+                return False
+            record.dropped = bucket[2]
+            bucket[2] = 0
+        return True
+
+
+class _RecordQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The message is rendered here, once the record is known to be written; the
+        # traceback stays apart from it (QueueHandler folds it into the message).
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        dropped = getattr(record, "dropped", 0)
+        return f"{text} [{dropped} similar records dropped]" if dropped else text
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, request_id, message, any `extra` fields and the traceback."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and key not in entry and (key != "dropped" or value):
+                entry[key] = value if isinstance(value, (str, int, float, bool, type(None))) else str(value)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def parse_stage_levels(spec: str) -> Dict[str, int]:
+    """
+    "detection=DEBUG,app.cache=WARNING" -> logger name -> level. Names without a
+    dot are stages; dotted names are used as logger names as they are.
+    """
+    levels = {}
+    for item in spec.split(","):
+        name, _, level = item.strip().partition("=")
+        if not name or not level:
+            continue
+        logger_name = name if "." in name else f"{STAGE_LOGGER_PREFIX}.{name}"
+        numeric = logging.getLevelName(level.strip().upper())
+        if isinstance(numeric, int):
+            levels[logger_name] = numeric
+        else:
+            logging.getLogger(__name__).warning("Ignoring unknown log level %r for %s.", level, name)
+    return levels
+
+
+def configure_logging() -> None:
+    """
+    Installs the root handler (idempotent): a QueueHandler feeding a listener
+    thread that writes to stderr, or the stream handler itself with LOG_QUEUE=false.
+    """
+    global _listener
+    root = logging.getLogger()
+    shutdown_logging()
+
+    stream_handler = logging.StreamHandler()
+    formatter = JsonFormatter() if settings.LOG_FORMAT.lower() == "json" else TextFormatter(TEXT_FORMAT)
+    stream_handler.setFormatter(formatter)
+    if settings.LOG_QUEUE:
+        handler: logging.Handler = _RecordQueueHandler(queue.SimpleQueue())
+        _listener = QueueListener(handler.queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+    else:
+        handler = stream_handler
+    # Filters on the handler run in the logging thread, before the record is queued.
+    handler.addFilter(CorrelationFilter())
+    handler.addFilter(SamplingFilter(settings.LOG_SAMPLE_RATE, settings.LOG_SAMPLE_MAX_PER_SECOND))
+    handler._app_handler = True
+    root.addHandler(handler)
+    root.setLevel(settings.LOG_LEVEL.upper())
+    for name, level in parse_stage_levels(settings.LOG_STAGE_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
+    if _listener is not None:
+        # The listener thread is a daemon; records still queued at exit would be lost.
+        atexit.unregister(shutdown_logging)
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Flushes queued records and removes the handler installed by configure_logging."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if getattr(handler, "_app_handler", False):
+            root.removeHandler(handler)
+            handler.close()
@@ -1,15 +1,80 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional, Tuple
+import base64
+import io
+import json
+import zipfile
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+import asyncio
 import logging
+import time
 
 from .services import (
-    convert_dicom_to_pil_and_base64,
+    convert_dicom_file_to_pil_and_png,
     detect_objects_roboflow_sdk,
-    generate_llm_report
+    generate_llm_report,
+    generate_llm_report_with_source,
+    stream_llm_report,
+    warmup_decoders
 )
-from .models import DiagnosisResponse 
+from .clients import close_clients
+from .resilience import deadline_scope, shutdown_resilience, upstream_snapshot
+from . import warmup
+from .ingest import NotDicomError, SpooledUpload, UploadTooLargeError, spool_upload
+from .jobs import FINISHED_STATUSES, get_job_store, load_job_image, start_job_workers, stop_job_workers
+from .models import CachedDiagnosis, DiagnosisResponse, JobStatus
+from .cache import make_result_cache_key_for_digest, report_cache, result_cache
+from .batch import stream_batch_diagnosis
+from .serialization import MSGPACK_MEDIA_TYPE, encode_diagnosis, negotiate
+from .image_store import PREVIEW_FORMATS, image_size, image_store, pyramid_levels, render_preview, render_tile
 from .config import settings 
-app = FastAPI(title="Dental X-ray Diagnostic Dashboard API")
+from .logs import configure_logging, correlation_scope, request_id_from_header
+from .concurrency import (
+    DECODE_STAGE,
+    INFERENCE_STAGE,
+    REPORT_STAGE,
+    StageSaturatedError,
+    limiter_snapshot,
+    run_cpu_bound,
+    run_io_bound,
+    set_cpu_initializer,
+    shutdown_executors
+)
+from .metrics import (
+    REQUEST_SECONDS,
+    REQUESTS_IN_FLIGHT,
+    STAGE_IN_FLIGHT,
+    STAGE_WAITING,
+    finish_request_timings,
+    observe_size,
+    record_error,
+    record_stage,
+    render_metrics,
+    stage_timer,
+    start_request_timings
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Decode workers import and exercise the DICOM codecs when they start.
+    set_cpu_initializer(warmup_decoders)
+    # Load the detector, clients and decoders before, after or without blocking startup.
+    await warmup.startup()
+    start_job_workers(settings.JOB_WORKERS)
+    yield
+    await warmup.shutdown()
+    await run_in_threadpool(stop_job_workers)
+    close_clients()
+    shutdown_resilience()
+    shutdown_executors()
+
+
+app = FastAPI(title="Dental X-ray Diagnostic Dashboard API", lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -18,23 +83,90 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Request-ID"],
 )
 
-# Setup basic logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.StreamHandler()
-        
-    ]
-)
+# Queue-based logging with per-request correlation IDs (see app/logs.py).
+configure_logging()
 logger = logging.getLogger(__name__)
 
 
-@app.post("/api/diagnose", response_model=DiagnosisResponse)
-async def diagnose_image(file: UploadFile = File(...)):
-    logger.info(f"Received file: {file.filename} of type {file.content_type}")
+@app.exception_handler(StageSaturatedError)
+async def stage_saturated_handler(request: Request, exc: StageSaturatedError):
+    logger.warning(f"Rejecting {request.url.path}: stage '{exc.stage}' is saturated.")
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    if not settings.METRICS_ENABLED:
+        return await call_next(request)
+    timings_token = start_request_timings()
+    REQUESTS_IN_FLIGHT.inc()
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        REQUESTS_IN_FLIGHT.dec()
+        route = request.scope.get("route")
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            request.method,
+            route.path if route is not None else "unmatched",
+            str(status)
+        )
+        server_timing = finish_request_timings(timings_token)
+    if server_timing:
+        response.headers["Server-Timing"] = server_timing
+    return response
+
+
+# Room for the multipart boundaries and part headers around the file itself.
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+@app.middleware("http")
+async def reject_oversized_uploads(request: Request, call_next):
+    # Refuse a single-image upload from its declared length, before the body is
+    # received and spooled by the multipart parser.
+    if request.method == "POST" and request.url.path in ("/api/diagnose", "/api/diagnose/stream", "/api/jobs"):
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > settings.UPLOAD_MAX_BYTES + MULTIPART_OVERHEAD_BYTES:
+            logger.warning(f"Rejecting upload of {content_length} bytes: over UPLOAD_MAX_BYTES.")
+            return JSONResponse(
+                status_code=413,
+                content={"detail": f"File exceeds the maximum upload size of {settings.UPLOAD_MAX_BYTES} bytes."}
+            )
+    return await call_next(request)
+
+
+# Registered last so it wraps the other middleware and their records carry the ID too.
+@app.middleware("http")
+async def correlate_request(request: Request, call_next):
+    request_id = request_id_from_header(request.headers.get("x-request-id"))
+    with correlation_scope(request_id):
+        response = await call_next(request)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+
+def _image_fields(image_id: str, width: int, height: int, png_bytes: bytes, inline_image: bool) -> dict:
+    fields = {"image_id": image_id, "image_width": width, "image_height": height}
+    if inline_image:
+        with stage_timer("base64"):
+            fields["converted_image_base64"] = base64.b64encode(png_bytes).decode('utf-8')
+    return fields
+
+
+async def _spool_dicom_upload(file: UploadFile) -> SpooledUpload:
+    """Validates the filename and streams the upload to a temp file, mapping rejections to HTTP errors."""
+    logger.info("Received file: %s of type %s", file.filename, file.content_type)
 
     if not file.filename:
         logger.warning("File upload attempt with no filename.")
@@ -44,56 +176,487 @@ async def diagnose_image(file: UploadFile = File(...)):
         logger.warning(f"Invalid file type received: {file.filename}")
         raise HTTPException(status_code=400, detail="Invalid file type. Only .dcm or .rvg files are accepted.")
 
-    contents = await file.read()
-    if not contents:
+    try:
+        upload = await spool_upload(file)
+    except UploadTooLargeError as e:
+        logger.warning(f"Upload {file.filename} rejected: {e}")
+        raise HTTPException(status_code=413, detail=str(e))
+    except NotDicomError as e:
+        logger.warning(f"Upload {file.filename} rejected: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+    except ValueError:
         logger.warning(f"Empty file received: {file.filename}")
         raise HTTPException(status_code=400, detail="Empty file received.")
+    return upload
+
+
+@app.post(
+    "/api/diagnose",
+    response_model=DiagnosisResponse,
+    responses={200: {"content": {MSGPACK_MEDIA_TYPE: {}}}}
+)
+async def diagnose_image(
+    request: Request, file: UploadFile = File(...), inline_image: bool = False, columnar_annotations: bool = False
+):
+    """
+    Answers in JSON, or in MessagePack for `Accept: application/msgpack` (the
+    inlined image then comes as raw bytes). ?columnar_annotations=true sends the
+    boxes as parallel arrays; see app.serialization.
+    """
+    media_type = negotiate(request.headers.get("accept"))
+    binary_image = inline_image and media_type == MSGPACK_MEDIA_TYPE
+    upload = await _spool_dicom_upload(file)
+    try:
+        # Roboflow and Gemini calls share one budget, so a slow upstream cannot hold the request indefinitely.
+        with deadline_scope(settings.REQUEST_BUDGET_SECONDS):
+            response = await _diagnose_spooled_upload(file.filename, upload, inline_image and not binary_image)
+    finally:
+        upload.remove()
+
+    image_png = None
+    if binary_image and response.image_id:
+        image_png = await run_in_threadpool(image_store.get, response.image_id)
+    with stage_timer("serialize"):
+        return encode_diagnosis(response, media_type, columnar_annotations, image_png)
+
+
+async def _diagnose_spooled_upload(filename: str, upload: SpooledUpload, inline_image: bool) -> DiagnosisResponse:
+    response, png_bytes = await _detect_spooled_upload(filename, upload, inline_image)
+    if png_bytes is None:
+        return response
+
+    diagnostic_report, report_is_final = await run_io_bound(
+        REPORT_STAGE, generate_llm_report_with_source, response.annotations
+    )
+    logger.info("Diagnostic report generated for %s.", filename)
+    response.diagnostic_report = diagnostic_report
+
+    # A simulated fallback report (e.g. after a transient Gemini error) is not cached,
+    # so the next upload of the same study gets another chance at a real report.
+    if report_is_final:
+        await _cache_diagnosis(upload, response, png_bytes)
+    return response
+
+
+async def _detect_spooled_upload(
+    filename: str, upload: SpooledUpload, inline_image: bool
+) -> Tuple[DiagnosisResponse, Optional[bytes]]:
+    """
+    The pipeline up to the report: result cache lookup, decode, image store and
+    detection. Returns the response and, when its report is still to be
+    generated, the PNG to cache the finished result with. Otherwise (a cache hit
+    or a failed stage) the PNG is None and the response is complete.
+    """
+    observe_size("upload", upload.size)
+    if result_cache is not None:
+        cache_key = make_result_cache_key_for_digest(upload.sha256)
+        with stage_timer("cache_lookup"):
+            cached = await run_in_threadpool(result_cache.get, cache_key)
+        if cached is not None:
+            logger.info("Result cache hit for %s.", filename)
+            image_id = await run_in_threadpool(image_store.put, cached.image_png)
+            return DiagnosisResponse(
+                image_filename=filename,
+                **_image_fields(image_id, cached.image_width, cached.image_height, cached.image_png, inline_image),
+                annotations=cached.annotations,
+                diagnostic_report=cached.diagnostic_report
+            ), None
     
+    try:
+        pil_image, png_bytes, error_dicom = await run_cpu_bound(
+            DECODE_STAGE, convert_dicom_file_to_pil_and_png, upload.path
+        )
+    except BrokenProcessPool:
+        pil_image, png_bytes, error_dicom = None, None, "Decode worker crashed while processing the file."
     
-    pil_image, converted_image_base64, error_dicom = convert_dicom_to_pil_and_base64(contents)
-    
-    if error_dicom or not pil_image or not converted_image_base64:
-        logger.error(f"DICOM conversion error for {file.filename}: {error_dicom}")
+    if error_dicom or not pil_image or not png_bytes:
+        logger.error("DICOM conversion error for %s: %s", filename, error_dicom)
+        record_error(DECODE_STAGE)
         return DiagnosisResponse(
-            image_filename=file.filename,
-            converted_image_base64="", 
+            image_filename=filename,
             annotations=[],
             diagnostic_report="Could not process DICOM file.",
             error=f"Failed to convert DICOM: {error_dicom}"
-        )
-    logger.info(f"DICOM file {file.filename} converted to PNG successfully.")
+        ), None
+    logger.info("DICOM file %s converted to PNG successfully.", filename)
+    observe_size("png", len(png_bytes))
 
+    with stage_timer("image_store"):
+        image_id = await run_in_threadpool(image_store.put, png_bytes)
+    image_fields = _image_fields(image_id, pil_image.width, pil_image.height, png_bytes, inline_image)
     
-    annotations_data, error_roboflow = detect_objects_roboflow_sdk(pil_image)
-    
-    current_report = "" 
+    annotations_data, error_roboflow = await run_io_bound(INFERENCE_STAGE, detect_objects_roboflow_sdk, pil_image)
 
     if error_roboflow:
-        logger.error(f"Roboflow detection error for {file.filename}: {error_roboflow}")
+        logger.error("Roboflow detection error for %s: %s", filename, error_roboflow)
+        record_error(INFERENCE_STAGE)
        
-        current_report = generate_llm_report([])
-        
+        current_report = await run_io_bound(REPORT_STAGE, generate_llm_report, [])
         
         return DiagnosisResponse(
-            image_filename=file.filename,
-            converted_image_base64=converted_image_base64,
+            image_filename=filename,
+            **image_fields,
             annotations=[], 
             diagnostic_report=current_report,
             error=f"Roboflow detection failed: {error_roboflow}. Report generated based on no detections."
-        )
-    logger.info(f"Roboflow detection for {file.filename} successful. Found {len(annotations_data)} annotations.")
-    
-   
-    diagnostic_report = generate_llm_report(annotations_data)
-    logger.info(f"Diagnostic report generated for {file.filename}.")
+        ), None
+    logger.info("Roboflow detection for %s successful. Found %d annotations.", filename, len(annotations_data))
 
     return DiagnosisResponse(
-        image_filename=file.filename,
-        converted_image_base64=converted_image_base64,
+        image_filename=filename,
+        **image_fields,
         annotations=annotations_data,
-        diagnostic_report=diagnostic_report
+        diagnostic_report=""
+    ), png_bytes
+
+
+async def _cache_diagnosis(upload: SpooledUpload, response: DiagnosisResponse, png_bytes: bytes) -> None:
+    if result_cache is None:
+        return
+    await run_in_threadpool(
+        result_cache.set,
+        make_result_cache_key_for_digest(upload.sha256),
+        CachedDiagnosis(
+            image_png=png_bytes,
+            image_width=response.image_width,
+            image_height=response.image_height,
+            annotations=response.annotations,
+            diagnostic_report=response.diagnostic_report
+        )
+    )
+
+
+def _sse(event: str, data: str) -> str:
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+@app.post("/api/diagnose/stream")
+async def diagnose_image_stream(file: UploadFile = File(...), inline_image: bool = False):
+    """
+    /api/diagnose as Server-Sent Events, so the report can be read while it is
+    written: "diagnosis" (the DiagnosisResponse with an empty report) as soon as
+    detection finishes, "report_chunk" events with pieces of the report text, and
+    "report_done" with the whole report, its source and the time to its first
+    piece. "report_reset" drops the text received so far (Gemini failed
+    mid-stream; the simulated report follows), and "error" ends a stream that
+    could not finish.
+    """
+    started = time.perf_counter()
+    upload = await _spool_dicom_upload(file)
+
+    async def stream():
+        try:
+            with deadline_scope(settings.REQUEST_BUDGET_SECONDS):
+                async for event, data in _diagnosis_events(file.filename, upload, inline_image, started):
+                    yield _sse(event, data)
+        except StageSaturatedError as e:
+            # The status line is already sent, so saturation is reported in the stream.
+            logger.warning(f"Stream for {file.filename} stopped: stage '{e.stage}' is saturated.")
+            yield _sse("error", json.dumps({"detail": str(e), "retry_after": e.retry_after}))
+        except Exception as e:
+            logger.error(f"Stream for {file.filename} failed: {e}", exc_info=True)
+            yield _sse("error", json.dumps({"detail": "Diagnosis failed."}))
+        finally:
+            upload.remove()
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def _diagnosis_events(
+    filename: str, upload: SpooledUpload, inline_image: bool, started: float
+) -> AsyncIterator[Tuple[str, str]]:
+    response, png_bytes = await _detect_spooled_upload(filename, upload, inline_image)
+    if png_bytes is None:
+        # Already complete: a result cache hit, or a failed stage with its canned report.
+        report, source = response.diagnostic_report, "static" if response.error else "cache"
+        response.diagnostic_report = ""
+        yield "diagnosis", response.model_dump_json(by_alias=True)
+        yield "report_chunk", json.dumps({"text": report})
+        yield "report_done", json.dumps({"diagnostic_report": report, "source": source, "ttft_ms": _elapsed_ms(started)})
+        return
+    yield "diagnosis", response.model_dump_json(by_alias=True)
+
+    loop = asyncio.get_running_loop()
+    pieces: asyncio.Queue = asyncio.Queue()
+
+    def emit(kind: str, text: str) -> None:
+        # Called on the report thread; the queue belongs to the event loop.
+        loop.call_soon_threadsafe(pieces.put_nowait, (kind, text))
+
+    report_task = asyncio.ensure_future(run_io_bound(REPORT_STAGE, stream_llm_report, response.annotations, emit))
+    # Queued behind every piece emitted before the report function returned.
+    report_task.add_done_callback(lambda _: pieces.put_nowait(None))
+    ttft_ms = None
+    try:
+        while (piece := await pieces.get()) is not None:
+            kind, text = piece
+            if kind == "reset":
+                yield "report_reset", "{}"
+                continue
+            if ttft_ms is None:
+                ttft_ms = _elapsed_ms(started)
+                if settings.METRICS_ENABLED:
+                    record_stage("report_first_token", ttft_ms / 1000)
+            yield "report_chunk", json.dumps({"text": text})
+    finally:
+        if not report_task.done():
+            # The client went away; the report thread finishes on its own.
+            report_task.cancel()
+    diagnostic_report, source = report_task.result()
+    logger.info("Diagnostic report streamed for %s (%s, first piece after %s ms).", filename, source, ttft_ms)
+    response.diagnostic_report = diagnostic_report
+    if source != "simulated":
+        await _cache_diagnosis(upload, response, png_bytes)
+    yield "report_done", json.dumps({"diagnostic_report": diagnostic_report, "source": source, "ttft_ms": ttft_ms})
+
+
+def _elapsed_ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 1)
+
+
+@app.post("/api/jobs", response_model=JobStatus, status_code=202)
+async def create_job(file: UploadFile = File(...)):
+    """Queues a diagnosis and returns immediately; follow it with GET /api/jobs/{job_id}."""
+    upload = await _spool_dicom_upload(file)
+    observe_size("upload", upload.size)
+    try:
+        store = get_job_store()
+        job = await run_in_threadpool(store.enqueue, file.filename, upload.path, upload.sha256)
+    finally:
+        upload.remove()
+    logger.info(f"Queued job {job.id} for {file.filename}.")
+    return job.to_status()
+
+
+async def _job_status(job_id: str) -> JobStatus:
+    store = get_job_store()
+    job = await run_in_threadpool(store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    status = job.to_status()
+    if status.result is not None and status.result.image_id:
+        await run_in_threadpool(load_job_image, store, job_id, status.result.image_id)
+    return status
+
+
+@app.get("/api/jobs/{job_id}", response_model=JobStatus)
+async def get_job(job_id: str):
+    return await _job_status(job_id)
+
+
+# An SSE comment is sent this often while a job makes no progress, so idle
+# proxies keep the stream open.
+JOB_EVENTS_KEEPALIVE_SECONDS = 15
+
+
+@app.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """
+    Server-Sent Events for one job: a "progress" event on every status or stage
+    change and a final "completed" or "failed" event carrying the JobStatus.
+    """
+    status = await _job_status(job_id)
+
+    async def stream():
+        current = status
+        last_state = None
+        last_sent = time.monotonic()
+        while True:
+            state = (current.status, current.stage, current.attempts)
+            if state != last_state:
+                event = current.status if current.status in FINISHED_STATUSES else "progress"
+                yield f"event: {event}\ndata: {current.model_dump_json(by_alias=True)}\n\n"
+                if current.status in FINISHED_STATUSES:
+                    return
+                last_state, last_sent = state, time.monotonic()
+            elif time.monotonic() - last_sent >= JOB_EVENTS_KEEPALIVE_SECONDS:
+                yield ": keep-alive\n\n"
+                last_sent = time.monotonic()
+            await asyncio.sleep(settings.JOB_POLL_INTERVAL_SECONDS)
+            current = await _job_status(job_id)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
 
+
+@app.get("/api/jobs")
+async def job_counts():
+    """Number of jobs in each status, e.g. to size JOB_WORKERS against the backlog."""
+    return await run_in_threadpool(get_job_store().counts)
+
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def _image_response(request: Request, content: Optional[bytes], etag: str, media_type: str) -> Response:
+    if content is None:
+        raise HTTPException(status_code=404, detail="Image not found.")
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE_CACHE_CONTROL}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=content, media_type=media_type, headers=headers)
+
+
+@app.get("/api/images/{image_id}")
+async def get_image(image_id: str, request: Request):
+    png_bytes = await run_in_threadpool(image_store.get, image_id)
+    return _image_response(request, png_bytes, f'"{image_id}"', "image/png")
+
+
+@app.get("/api/images/{image_id}/info")
+async def get_image_info(image_id: str):
+    png_bytes = await run_in_threadpool(image_store.get, image_id)
+    if png_bytes is None:
+        raise HTTPException(status_code=404, detail="Image not found.")
+    width, height = image_size(png_bytes)
+    return {
+        "image_id": image_id,
+        "width": width,
+        "height": height,
+        "tile_size": settings.TILE_SIZE,
+        "levels": pyramid_levels(width, height, settings.TILE_SIZE)
+    }
+
+
+@app.get("/api/images/{image_id}/preview")
+async def get_image_preview(image_id: str, request: Request, size: int = 0, format: str = "webp"):
+    size = size or settings.PREVIEW_SIZE
+    if format not in PREVIEW_FORMATS or not 16 <= size <= 4096:
+        raise HTTPException(status_code=400, detail="Unsupported preview format or size.")
+    variant = f"preview-{size}.{format}"
+    content = await run_in_threadpool(
+        image_store.get_variant, image_id, variant, lambda png: render_preview(png, size, format)
+    )
+    return _image_response(request, content, f'"{image_id}-{variant}"', PREVIEW_FORMATS[format][1])
+
+
+@app.get("/api/images/{image_id}/tiles/{level}/{col}/{row}")
+async def get_image_tile(image_id: str, level: int, col: int, row: int, request: Request, format: str = "png"):
+    """Tile of the image pyramid: level 0 is full resolution, each level halves the previous one."""
+    if format not in PREVIEW_FORMATS:
+        raise HTTPException(status_code=400, detail="Unsupported tile format.")
+    variant = f"tile-{settings.TILE_SIZE}-{level}-{col}-{row}.{format}"
+    content = await run_in_threadpool(
+        image_store.get_variant, image_id, variant,
+        lambda png: render_tile(png, level, col, row, settings.TILE_SIZE, format)
+    )
+    return _image_response(request, content, f'"{image_id}-{variant}"', PREVIEW_FORMATS[format][1])
+
+
+def _is_dicom_filename(filename: str) -> bool:
+    return filename.lower().endswith(".dcm") or filename.lower().endswith(".rvg")
+
+
+def _expand_zip_upload(filename: str, contents: bytes, files_so_far: int, bytes_so_far: int) -> List[Tuple[str, bytes]]:
+    """
+    Extracts the .dcm/.rvg entries of a zip upload. Entry count and declared
+    uncompressed sizes are checked against the batch limits before anything is
+    decompressed, and reads are capped at the declared size.
+    """
+    try:
+        with zipfile.ZipFile(io.BytesIO(contents)) as archive:
+            entries = [
+                info for info in archive.infolist()
+                if not info.is_dir() and _is_dicom_filename(info.filename)
+            ]
+            if files_so_far + len(entries) > settings.BATCH_MAX_FILES:
+                raise HTTPException(status_code=413, detail=f"Too many files. A batch may contain at most {settings.BATCH_MAX_FILES} images.")
+            for info in entries:
+                if info.file_size == 0:
+                    raise HTTPException(status_code=400, detail=f"Empty file received: {info.filename}")
+                if info.file_size > settings.BATCH_MAX_FILE_BYTES:
+                    raise HTTPException(status_code=413, detail=f"File too large: {info.filename}")
+            if bytes_so_far + sum(info.file_size for info in entries) > settings.BATCH_MAX_TOTAL_BYTES:
+                raise HTTPException(status_code=413, detail="Batch upload exceeds the maximum total size.")
+
+            extracted = []
+            for info in entries:
+                with archive.open(info) as member:
+                    data = member.read(info.file_size + 1)
+                if len(data) != info.file_size:
+                    raise HTTPException(status_code=400, detail=f"Corrupt zip entry: {info.filename}")
+                extracted.append((info.filename, data))
+            return extracted
+    except (zipfile.BadZipFile, zipfile.LargeZipFile, NotImplementedError, EOFError):
+        logger.warning(f"Invalid zip archive received: {filename}")
+        raise HTTPException(status_code=400, detail=f"Invalid zip archive: {filename}")
+
+
+@app.post("/api/diagnose/batch")
+async def diagnose_batch(files: List[UploadFile] = File(...)):
+    """
+    Diagnoses a series of .dcm/.rvg files (uploaded individually and/or inside
+    .zip archives). Streams NDJSON: one result per file as it finishes, then one
+    combined series report.
+    """
+    uploads: List[Tuple[str, bytes]] = []
+    total_bytes = 0
+    for file in files:
+        if not file.filename:
+            raise HTTPException(status_code=400, detail="No file name provided.")
+        contents = await file.read()
+        if file.filename.lower().endswith(".zip"):
+            extracted = await run_in_threadpool(_expand_zip_upload, file.filename, contents, len(uploads), total_bytes)
+            uploads.extend(extracted)
+            total_bytes += sum(len(data) for _, data in extracted)
+        elif _is_dicom_filename(file.filename):
+            if not contents:
+                raise HTTPException(status_code=400, detail=f"Empty file received: {file.filename}")
+            if len(contents) > settings.BATCH_MAX_FILE_BYTES:
+                raise HTTPException(status_code=413, detail=f"File too large: {file.filename}")
+            uploads.append((file.filename, contents))
+            total_bytes += len(contents)
+        else:
+            logger.warning(f"Invalid file type received in batch: {file.filename}")
+            raise HTTPException(status_code=400, detail="Invalid file type. Only .dcm, .rvg or .zip files are accepted.")
+        if len(uploads) > settings.BATCH_MAX_FILES:
+            raise HTTPException(status_code=413, detail=f"Too many files. A batch may contain at most {settings.BATCH_MAX_FILES} images.")
+        if total_bytes > settings.BATCH_MAX_TOTAL_BYTES:
+            raise HTTPException(status_code=413, detail="Batch upload exceeds the maximum total size.")
+
+    if not uploads:
+        raise HTTPException(status_code=400, detail="No .dcm or .rvg files found in the upload.")
+
+    logger.info(f"Received batch of {len(uploads)} files.")
+    return StreamingResponse(stream_batch_diagnosis(uploads), media_type="application/x-ndjson")
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus text exposition of request and per-stage metrics."""
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled.")
+    for stage, counts in limiter_snapshot().items():
+        STAGE_IN_FLIGHT.set(counts["in_flight"], stage)
+        STAGE_WAITING.set(counts["waiting"], stage)
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/api/warmup")
+async def warm_up_backends():
+    """Initializes the detector, clients and decoders now; for a readiness probe or a pre-warm hook."""
+    return await warmup.warm_up()
+
+
+@app.get("/api/upstreams")
+def upstreams():
+    """Circuit breaker state and call outcome counts (success, timeout, error, short_circuited, ...) per service."""
+    return upstream_snapshot()
+
+
+@app.get("/api/cache/stats")
+def cache_stats():
+    reports = report_cache.stats() if report_cache is not None else None
+    if result_cache is None:
+        return {"enabled": False, "reports": reports}
+    return {"enabled": True, **result_cache.stats(), "reports": reports}
+
 @app.get("/")
 def read_root():
     return {"message": "Dental X-ray Diagnostic Dashboard Backend is running."}
@@ -0,0 +1,241 @@
+"""
+Lightweight request/stage instrumentation exported in the Prometheus text format.
+
+Stages are timed with `stage_timer(name)`, which records into the stage latency
+histogram, counts errors raised inside it, and, when Server-Timing is enabled,
+appends the duration to the current request's timing list. With METRICS_ENABLED
+off, `stage_timer` returns a shared no-op context manager and nothing is recorded.
+
+Work run on the decode process pool is timed inside the worker with
+`run_with_stage_timings` and the timings are replayed in the parent with
+`record_stage_timings`.
+"""
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from .config import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 5e5, 1e6, 5e6, 1e7, 5e7, 1e8)
+
+_NOOP = nullcontext()
+
+# Per-request list of (stage, seconds, failed) for the Server-Timing header; None when not collecting.
+_request_timings: contextvars.ContextVar[Optional[List[Tuple[str, float, bool]]]] = contextvars.ContextVar(
+    "request_timings", default=None
+)
+# Set while running under run_with_stage_timings: stages are only collected, and
+# the caller records them, so work in a worker process is not lost or double-counted.
+_collect_only: contextvars.ContextVar[bool] = contextvars.ContextVar("collect_only", default=False)
+
+
+def _format_labels(labelnames: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [f"{self.name}{_format_labels(self.labelnames, labels)} {value:g}" for labels, value in items]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> (per-bucket counts with a final +Inf slot, sum, count)
+        self._values: Dict[Tuple[str, ...], List[Any]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, *labels: str) -> int:
+        entry = self._values.get(labels)
+        return entry[2] if entry else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((labels, (list(entry[0]), entry[1], entry[2])) for labels, entry in self._values.items())
+        lines = self._header()
+        for labels, (bucket_counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), bucket_counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                le_label = f'le="{le}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le_label)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total:g}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+STAGE_SECONDS = Histogram("diagnose_stage_seconds", "Latency of each pipeline stage in seconds.", ["stage"])
+STAGE_ERRORS = Counter("diagnose_stage_errors_total", "Exceptions raised inside each pipeline stage.", ["stage"])
+PAYLOAD_BYTES = Histogram("diagnose_payload_bytes", "Size of payloads moving through the pipeline.", ["kind"], buckets=SIZE_BUCKETS)
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "HTTP request latency in seconds.", ["method", "route", "status"])
+REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being served.")
+STAGE_IN_FLIGHT = Gauge("diagnose_stage_in_flight", "Requests currently running each limited stage.", ["stage"])
+STAGE_WAITING = Gauge("diagnose_stage_waiting", "Requests queued for a slot in each limited stage.", ["stage"])
+UPSTREAM_CALLS = Counter("upstream_calls_total", "Calls to external services by outcome.", ["service", "outcome"])
+UPSTREAM_HEDGES = Counter("upstream_hedged_calls_total", "Calls sent a second time after the hedge delay.", ["service"])
+CIRCUIT_STATE = Gauge("upstream_circuit_state", "Circuit breaker state: 0 closed, 1 half-open, 2 open.", ["service"])
+
+REGISTRY = (
+    STAGE_SECONDS, STAGE_ERRORS, PAYLOAD_BYTES, REQUEST_SECONDS,
+    REQUESTS_IN_FLIGHT, STAGE_IN_FLIGHT, STAGE_WAITING,
+    UPSTREAM_CALLS, UPSTREAM_HEDGES, CIRCUIT_STATE,
+)
+
+
+def record_stage(stage: str, seconds: float, failed: bool = False) -> None:
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((stage, seconds, failed))
+    if _collect_only.get():
+        return
+    STAGE_SECONDS.observe(seconds, stage)
+    if failed:
+        STAGE_ERRORS.inc(stage)
+
+
+@contextmanager
+def _timed(stage: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        record_stage(stage, time.perf_counter() - started, failed=True)
+        raise
+    record_stage(stage, time.perf_counter() - started)
+
+
+def stage_timer(stage: str):
+    """Context manager timing one stage; a shared no-op when metrics are disabled."""
+    if not settings.METRICS_ENABLED:
+        return _NOOP
+    return _timed(stage)
+
+
+def observe_size(kind: str, size: int) -> None:
+    if settings.METRICS_ENABLED:
+        PAYLOAD_BYTES.observe(size, kind)
+
+
+def record_error(stage: str) -> None:
+    """Counts a stage failure that was reported as an error value rather than raised."""
+    if settings.METRICS_ENABLED:
+        STAGE_ERRORS.inc(stage)
+
+
+def run_with_stage_timings(fn: Callable[..., Any], *args: Any) -> Tuple[Any, List[Tuple[str, float, bool]]]:
+    """Runs fn in a fresh timing context (e.g. in a worker process) and returns its result and stage timings."""
+    timings: List[Tuple[str, float, bool]] = []
+    timings_token = _request_timings.set(timings)
+    collect_token = _collect_only.set(True)
+    try:
+        return fn(*args), timings
+    finally:
+        _collect_only.reset(collect_token)
+        _request_timings.reset(timings_token)
+
+
+def record_stage_timings(timings: List[Tuple[str, float, bool]]) -> None:
+    for stage, seconds, failed in timings:
+        record_stage(stage, seconds, failed)
+
+
+def start_request_timings() -> Optional[contextvars.Token]:
+    """Begins collecting Server-Timing entries for the current request, if enabled."""
+    if settings.METRICS_ENABLED and settings.SERVER_TIMING_ENABLED:
+        return _request_timings.set([])
+    return None
+
+
+def finish_request_timings(token: Optional[contextvars.Token]) -> Optional[str]:
+    """Returns the Server-Timing header value for the request and stops collecting."""
+    if token is None:
+        return None
+    timings = _request_timings.get() or []
+    _request_timings.reset(token)
+    totals: Dict[str, float] = {}
+    for stage, seconds, _ in timings:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in totals.items()) or None
+
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def reset_metrics() -> None:
+    for metric in REGISTRY:
+        metric.reset()
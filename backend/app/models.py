@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from typing import List, Literal, Optional
 
 class RoboflowPrediction(BaseModel):
     model_config = ConfigDict(populate_by_name=True)
@@ -14,7 +14,48 @@ class RoboflowPrediction(BaseModel):
 class DiagnosisResponse(BaseModel):
     
     image_filename: str
-    converted_image_base64: str
+    # The converted image is fetched from /api/images/{image_id}; the base64 PNG
+    # is only inlined when a client asks for it with ?inline_image=true.
+    image_id: Optional[str] = None
+    image_width: Optional[int] = None
+    image_height: Optional[int] = None
+    converted_image_base64: str = ""
     annotations: List[RoboflowPrediction]
     diagnostic_report: str
-    error: Optional[str] = None
\ No newline at end of file
+    error: Optional[str] = None
+
+class CachedDiagnosis(BaseModel):
+    """The parts of a successful DiagnosisResponse that depend only on the uploaded bytes."""
+    model_config = ConfigDict(ser_json_bytes="base64", val_json_bytes="base64")
+
+    image_png: bytes
+    image_width: int
+    image_height: int
+    annotations: List[RoboflowPrediction]
+    diagnostic_report: str
+
+class BatchItemResult(BaseModel):
+    """One NDJSON line of a batch diagnosis stream, emitted as each file finishes."""
+    event: Literal["result"] = "result"
+    index: int
+    result: DiagnosisResponse
+
+class SeriesReport(BaseModel):
+    """Final NDJSON line of a batch diagnosis stream."""
+    event: Literal["series_report"] = "series_report"
+    files: int
+    failed: int
+    diagnostic_report: str
+
+class JobStatus(BaseModel):
+    """State of an asynchronous diagnosis job from /api/jobs."""
+    job_id: str
+    status: Literal["queued", "running", "completed", "failed"]
+    # Pipeline stage the job is in (or reached): "queued", "decode", "inference", "report" or "done".
+    stage: str
+    attempts: int
+    created_at: float
+    updated_at: float
+    image_filename: str
+    result: Optional[DiagnosisResponse] = None
+    error: Optional[str] = None
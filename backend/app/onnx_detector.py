@@ -0,0 +1,202 @@
+"""
+In-process ONNX Runtime detector. It expects a YOLOv8-style export: one float32
+input of shape (N, 3, S, S) scaled to 0-1, and one output of shape
+(N, 4 + num_classes, anchors) holding centre x, centre y, width, height in input
+pixels followed by per-class scores.
+
+Imported only when DETECTOR_BACKEND is "onnx".
+"""
+import logging
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+from .detector import Detector, parse_class_names
+from .metrics import stage_timer
+from .models import RoboflowPrediction
+
+logger = logging.getLogger(__name__)
+
+LETTERBOX_FILL = 114
+
+# Upper bound on candidates entering NMS, so an untrained or noisy model cannot
+# make suppression quadratic in the number of anchors.
+MAX_NMS_CANDIDATES = 3000
+
+
+def letterbox(pil_image: Image.Image, size: int) -> Tuple[np.ndarray, float, float, float]:
+    """
+    Resizes the image to fit a size x size square without changing its aspect
+    ratio and pads the rest. Returns the (3, size, size) float32 array in 0-1 and
+    the scale and x/y padding needed to map boxes back to the original image.
+    """
+    width, height = pil_image.size
+    scale = min(size / width, size / height)
+    new_width, new_height = max(1, round(width * scale)), max(1, round(height * scale))
+    pad_x, pad_y = (size - new_width) // 2, (size - new_height) // 2
+
+    resized = pil_image.convert("L").resize((new_width, new_height), Image.Resampling.BILINEAR)
+    canvas = np.full((size, size), LETTERBOX_FILL, dtype=np.uint8)
+    canvas[pad_y:pad_y + new_height, pad_x:pad_x + new_width] = np.asarray(resized)
+
+    # Radiographs are grayscale; the model expects three identical channels.
+    chw = np.broadcast_to(canvas, (3, size, size)).astype(np.float32)
+    chw *= np.float32(1.0 / 255.0)
+    return chw, scale, float(pad_x), float(pad_y)
+
+
+def non_max_suppression(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float) -> np.ndarray:
+    """Greedy NMS over (N, 4) xyxy boxes. Returns kept indices in descending score order."""
+    if boxes.shape[0] == 0:
+        return np.empty(0, dtype=np.int64)
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = np.maximum(x2 - x1, 0) * np.maximum(y2 - y1, 0)
+    order = np.argsort(-scores, kind="stable")
+    keep = []
+    while order.size > 0:
+        best, rest = order[0], order[1:]
+        keep.append(best)
+        inter_w = np.maximum(np.minimum(x2[best], x2[rest]) - np.maximum(x1[best], x1[rest]), 0)
+        inter_h = np.maximum(np.minimum(y2[best], y2[rest]) - np.maximum(y1[best], y1[rest]), 0)
+        inter = inter_w * inter_h
+        union = areas[best] + areas[rest] - inter
+        iou = np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+        order = rest[iou <= iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def batched_nms(boxes: np.ndarray, scores: np.ndarray, class_ids: np.ndarray, iou_threshold: float) -> np.ndarray:
+    """Per-class NMS in a single pass by shifting each class's boxes into a disjoint region."""
+    if boxes.shape[0] == 0:
+        return np.empty(0, dtype=np.int64)
+    offsets = class_ids.astype(boxes.dtype) * (float(boxes.max()) + 1.0)
+    return non_max_suppression(boxes + offsets[:, None], scores, iou_threshold)
+
+
+class OnnxDetector(Detector):
+    """
+    In-process ONNX Runtime CPU detector. One InferenceSession is created per
+    process and shared by all request threads; `InferenceSession.run` is
+    thread-safe and releases the GIL.
+    """
+
+    name = "onnx"
+
+    def __init__(
+        self,
+        model_path: str,
+        confidence_threshold: float,
+        iou_threshold: float,
+        class_names: Optional[Sequence[str]] = None,
+        input_size: int = 640,
+        batch_size: int = 8,
+        max_detections: int = 300,
+        intra_op_threads: int = 0,
+    ):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads > 0:
+            options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.confidence_threshold = confidence_threshold
+        self.iou_threshold = iou_threshold
+        self.max_detections = max_detections
+
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        batch_dim, _, height_dim, width_dim = model_input.shape
+        # Static spatial dims in the model take precedence over the configured size.
+        if isinstance(height_dim, int) and isinstance(width_dim, int):
+            if height_dim != width_dim:
+                raise ValueError(f"Only square model inputs are supported, got {height_dim}x{width_dim}.")
+            input_size = height_dim
+        self.input_size = input_size
+        # A model exported with a fixed batch dimension can only take that many images per run.
+        self.batch_size = batch_dim if isinstance(batch_dim, int) and batch_dim > 0 else max(1, batch_size)
+
+        if not class_names:
+            metadata = self.session.get_modelmeta().custom_metadata_map
+            class_names = parse_class_names(metadata.get("names"))
+        self.class_names = list(class_names or [])
+        logger.info(
+            f"Loaded ONNX detector {model_path}: input {self.input_size}x{self.input_size}, "
+            f"batch {self.batch_size}, {len(self.class_names)} class names."
+        )
+
+    def _class_name(self, class_id: int) -> str:
+        return self.class_names[class_id] if class_id < len(self.class_names) else str(class_id)
+
+    def _run(self, batch: np.ndarray) -> np.ndarray:
+        if batch.shape[0] < self.batch_size and self.session.get_inputs()[0].shape[0] == self.batch_size:
+            # Pad a short final chunk up to a static batch dimension.
+            padding = np.zeros((self.batch_size - batch.shape[0],) + batch.shape[1:], dtype=batch.dtype)
+            return self.session.run(None, {self.input_name: np.concatenate([batch, padding])})[0][: batch.shape[0]]
+        return self.session.run(None, {self.input_name: batch})[0]
+
+    def _postprocess(self, output: np.ndarray, scale: float, pad_x: float, pad_y: float, width: int, height: int) -> List[RoboflowPrediction]:
+        """Turns one image's (4 + num_classes, anchors) output into predictions in original pixels."""
+        candidates = output.T
+        class_scores = candidates[:, 4:]
+        if class_scores.shape[1] == 0:
+            return []
+        class_ids = class_scores.argmax(axis=1)
+        scores = class_scores[np.arange(class_scores.shape[0]), class_ids]
+
+        mask = scores >= self.confidence_threshold
+        if not mask.any():
+            return []
+        candidates, scores, class_ids = candidates[mask], scores[mask], class_ids[mask]
+        if scores.shape[0] > MAX_NMS_CANDIDATES:
+            top = np.argpartition(-scores, MAX_NMS_CANDIDATES)[:MAX_NMS_CANDIDATES]
+            candidates, scores, class_ids = candidates[top], scores[top], class_ids[top]
+
+        # Undo the letterbox: centre/size in input pixels -> xyxy in original pixels.
+        centre_x = (candidates[:, 0] - pad_x) / scale
+        centre_y = (candidates[:, 1] - pad_y) / scale
+        half_w = candidates[:, 2] / scale / 2
+        half_h = candidates[:, 3] / scale / 2
+        boxes = np.stack([
+            np.clip(centre_x - half_w, 0, width),
+            np.clip(centre_y - half_h, 0, height),
+            np.clip(centre_x + half_w, 0, width),
+            np.clip(centre_y + half_h, 0, height),
+        ], axis=1)
+
+        keep = batched_nms(boxes, scores, class_ids, self.iou_threshold)[: self.max_detections]
+        predictions = []
+        for i in keep:
+            x1, y1, x2, y2 = boxes[i]
+            predictions.append(RoboflowPrediction(
+                x=float((x1 + x2) / 2),
+                y=float((y1 + y2) / 2),
+                width=float(x2 - x1),
+                height=float(y2 - y1),
+                confidence=float(scores[i]),
+                class_name=self._class_name(int(class_ids[i])),
+            ))
+        return predictions
+
+    def warmup(self) -> None:
+        """Runs one blank batch so ONNX Runtime allocates its buffers before the first request."""
+        self._run(np.zeros((1, 3, self.input_size, self.input_size), dtype=np.float32))
+
+    def detect_batch(self, pil_images: List[Image.Image]) -> List[Tuple[List[RoboflowPrediction], Optional[str]]]:
+        results: List[Tuple[List[RoboflowPrediction], Optional[str]]] = []
+        for start in range(0, len(pil_images), self.batch_size):
+            chunk = pil_images[start:start + self.batch_size]
+            try:
+                with stage_timer("onnx_preprocess"):
+                    letterboxed = [letterbox(image, self.input_size) for image in chunk]
+                    batch = np.stack([item[0] for item in letterboxed])
+                with stage_timer("onnx_inference"):
+                    outputs = self._run(batch)
+                with stage_timer("onnx_postprocess"):
+                    for image, (_, scale, pad_x, pad_y), output in zip(chunk, letterboxed, outputs):
+                        results.append((self._postprocess(output, scale, pad_x, pad_y, *image.size), None))
+            except Exception as e:
+                logger.error(f"ONNX detector error on a batch of {len(chunk)} images: {e}", exc_info=True)
+                results.extend(([], f"ONNX detector error: {e}") for _ in chunk)
+        return results
@@ -0,0 +1,275 @@
+"""
+Deadlines, circuit breakers and hedged calls for the external services.
+
+A request sets its overall budget with `deadline_scope`; `call_upstream` turns
+what is left of it into the timeout of each Roboflow or Gemini call, skips a
+service whose circuit breaker is open, and optionally hedges a slow call with
+a second one. Breaker state and call outcomes are kept per service for
+/api/upstreams and mirrored into the Prometheus metrics.
+"""
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from .config import settings
+from .metrics import CIRCUIT_STATE, UPSTREAM_CALLS, UPSTREAM_HEDGES
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# Monotonic time by which the current request's upstream calls must finish; None without a budget.
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("upstream_deadline", default=None)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a service whose circuit breaker is open."""
+
+    def __init__(self, service: str, retry_in: float):
+        super().__init__(f"{service} is unavailable (circuit open, next probe in {retry_in:.0f}s).")
+        self.service = service
+        self.retry_in = retry_in
+
+
+class DeadlineExceededError(TimeoutError):
+    """Raised when the request budget is spent before an upstream call could start."""
+
+
+@contextmanager
+def deadline_scope(seconds: float) -> Iterator[None]:
+    """Gives the upstream calls made in this context `seconds` in total (no limit if <= 0)."""
+    token = _deadline.set(time.monotonic() + seconds if seconds > 0 else None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_budget() -> Optional[float]:
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def call_timeout(cap: float, reserve: float = 0.0) -> float:
+    """
+    The timeout for the next upstream call: `cap`, shortened to what is left of
+    the request budget after keeping `reserve` seconds back for later stages.
+    """
+    remaining = remaining_budget()
+    if remaining is None:
+        return cap
+    # The reserve is honoured while the budget can afford it; after that the call gets what is left.
+    available = remaining - reserve if remaining > reserve else remaining
+    if available <= 0:
+        raise DeadlineExceededError("The request budget is spent.")
+    return min(cap, available)
+
+
+class CircuitBreaker:
+    """
+    Closed: calls go through and consecutive failures are counted. Open (after
+    `failure_threshold` failures in a row): calls are refused for `reset_seconds`.
+    Half-open: one probe call is let through; success closes the circuit and
+    failure opens it again.
+    """
+
+    def __init__(self, service: str, failure_threshold: int, reset_seconds: float):
+        self.service = service
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _set_state(self, state: str) -> None:
+        if state != self.state:
+            logger.warning(f"Circuit for {self.service} is now {state}.")
+        self.state = state
+        if settings.METRICS_ENABLED:
+            CIRCUIT_STATE.set(_STATE_VALUES[state], self.service)
+
+    def before_call(self) -> None:
+        """Raises CircuitOpenError if the call must not be made."""
+        with self._lock:
+            if self.state == OPEN:
+                waited = time.monotonic() - self.opened_at
+                if waited < self.reset_seconds:
+                    raise CircuitOpenError(self.service, self.reset_seconds - waited)
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self.probe_in_flight:
+                    raise CircuitOpenError(self.service, 0.0)
+                self.probe_in_flight = True
+
+    def record(self, outcome: str, failed: bool) -> None:
+        with self._lock:
+            self.counts[outcome] = self.counts.get(outcome, 0) + 1
+            self.probe_in_flight = False
+            if not failed:
+                self.consecutive_failures = 0
+                self._set_state(CLOSED)
+                return
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+    def count_short_circuit(self) -> None:
+        with self._lock:
+            self.counts["short_circuited"] = self.counts.get("short_circuited", 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "counts": dict(self.counts),
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+_hedge_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_breaker(service: str) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(service)
+        if breaker is None:
+            breaker = CircuitBreaker(service, settings.BREAKER_FAILURE_THRESHOLD, settings.BREAKER_RESET_SECONDS)
+            _breakers[service] = breaker
+        return breaker
+
+
+def upstream_snapshot() -> Dict[str, Dict[str, Any]]:
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.service: breaker.snapshot() for breaker in breakers}
+
+
+def reset_breakers() -> None:
+    with _breakers_lock:
+        _breakers.clear()
+
+
+def _is_timeout(exc: BaseException) -> bool:
+    # requests, urllib3, httpx and google-api-core each have their own timeout classes.
+    return isinstance(exc, TimeoutError) or any(
+        "Timeout" in cls.__name__ or cls.__name__ == "DeadlineExceeded" for cls in type(exc).__mro__
+    )
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None)
+    if status is None:
+        status = getattr(exc, "code", None)
+    return status if isinstance(status, int) else None
+
+
+def _outcome(exc: BaseException) -> str:
+    if _is_timeout(exc):
+        return "timeout"
+    status = _status_code(exc)
+    if status is not None and status < 500 and status != 429:
+        # The service answered; the request itself was rejected.
+        return "rejected"
+    return "error"
+
+
+def _get_hedge_executor() -> ThreadPoolExecutor:
+    global _hedge_executor
+    if _hedge_executor is None:
+        _hedge_executor = ThreadPoolExecutor(
+            max_workers=max(2, settings.IO_THREAD_WORKERS), thread_name_prefix="upstream-hedge"
+        )
+    return _hedge_executor
+
+
+def _hedged(service: str, call: Callable[[float], Any], timeout: float, hedge_after: float) -> Any:
+    """
+    Runs call(timeout); if it has not finished after `hedge_after` seconds, runs a
+    second copy with the time that is left and returns whichever succeeds first.
+    """
+    executor = _get_hedge_executor()
+    started = time.monotonic()
+    pending = {executor.submit(contextvars.copy_context().run, call, timeout)}
+    done, pending = wait(pending, timeout=hedge_after)
+    if not done:
+        hedge_timeout = timeout - (time.monotonic() - started)
+        if hedge_timeout > 0:
+            if settings.METRICS_ENABLED:
+                UPSTREAM_HEDGES.inc(service)
+            pending.add(executor.submit(contextvars.copy_context().run, call, hedge_timeout))
+    first_error: Optional[BaseException] = None
+    while True:
+        for future in done:
+            if future.exception() is None:
+                # The slower copy is left to finish (or time out) on its own.
+                return future.result()
+            first_error = first_error or future.exception()
+        if not pending:
+            raise first_error
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+
+def call_upstream(
+    service: str,
+    call: Callable[[float], Any],
+    cap: float,
+    reserve: float = 0.0,
+    hedge_after: float = 0.0,
+) -> Any:
+    """
+    Calls `call(timeout)` for an external service through its circuit breaker,
+    with the timeout derived from `cap` and the request budget. Raises
+    CircuitOpenError without calling when the service is considered down, and
+    DeadlineExceededError when no budget is left.
+    """
+    breaker = get_breaker(service)
+    try:
+        # A spent budget says nothing about the service, so it does not touch the breaker.
+        timeout = call_timeout(cap, reserve)
+    except DeadlineExceededError:
+        if settings.METRICS_ENABLED:
+            UPSTREAM_CALLS.inc(service, "deadline_exceeded")
+        raise
+    try:
+        breaker.before_call()
+    except CircuitOpenError:
+        breaker.count_short_circuit()
+        if settings.METRICS_ENABLED:
+            UPSTREAM_CALLS.inc(service, "short_circuited")
+        raise
+    try:
+        if hedge_after > 0 and hedge_after < timeout:
+            result = _hedged(service, call, timeout, hedge_after)
+        else:
+            result = call(timeout)
+    except Exception as e:
+        outcome = _outcome(e)
+        breaker.record(outcome, failed=outcome != "rejected")
+        if settings.METRICS_ENABLED:
+            UPSTREAM_CALLS.inc(service, outcome)
+        raise
+    breaker.record("success", failed=False)
+    if settings.METRICS_ENABLED:
+        UPSTREAM_CALLS.inc(service, "success")
+    return result
+
+
+def shutdown_resilience() -> None:
+    global _hedge_executor
+    if _hedge_executor is not None:
+        _hedge_executor.shutdown(wait=False, cancel_futures=True)
+        _hedge_executor = None
@@ -0,0 +1,99 @@
+"""
+Response encoding for /api/diagnose.
+
+FastAPI validates a returned model against the response_model again and then
+either dumps it with Pydantic (recent versions) or runs it through
+jsonable_encoder and the stdlib json module (older versions, or any custom
+response class), which walks every annotation in Python. Here the response is
+not re-validated: it is dumped once by Pydantic's compiled serializer and
+encoded by orjson, or by msgpack when the client sends
+`Accept: application/msgpack`. MessagePack carries the inlined image as raw PNG
+bytes (`converted_image`) instead of base64, a quarter smaller and without the
+encoding step on either side; see benchmarks/bench_serialization.py.
+
+With columnar annotations the boxes are sent as parallel arrays, one entry per
+box, with class names stored once in `classes` and referenced by `class_id`:
+{"classes": ["caries"], "x": [...], "y": [...], "width": [...], "height": [...],
+"confidence": [...], "class_id": [...]}. For detectors that return hundreds of
+boxes this drops the repeated keys and class strings of the row layout.
+"""
+from typing import Any, Dict, List, Optional
+
+import msgpack
+import orjson
+from fastapi import Response
+
+from .models import DiagnosisResponse, RoboflowPrediction
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+# Older clients and libraries still use the unregistered name.
+MSGPACK_MEDIA_TYPES = (MSGPACK_MEDIA_TYPE, "application/x-msgpack")
+
+
+def negotiate(accept: Optional[str]) -> str:
+    """The media type to answer with: MessagePack if the client prefers it, JSON otherwise."""
+    best, best_q = JSON_MEDIA_TYPE, 0.0
+    for entry in (accept or "").split(","):
+        media_type, *params = (part.strip() for part in entry.split(";"))
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        media_type = media_type.lower()
+        if media_type in MSGPACK_MEDIA_TYPES and q > best_q:
+            best, best_q = MSGPACK_MEDIA_TYPE, q
+        elif media_type in (JSON_MEDIA_TYPE, "*/*", "application/*") and q > best_q:
+            best, best_q = JSON_MEDIA_TYPE, q
+    return best
+
+
+def columnar_annotations(annotations: List[RoboflowPrediction]) -> Dict[str, list]:
+    class_ids: Dict[str, int] = {}
+    # setdefault numbers the classes in order of first appearance.
+    column_class_id = [class_ids.setdefault(a.class_name, len(class_ids)) for a in annotations]
+    return {
+        "classes": list(class_ids),
+        "x": [a.x for a in annotations],
+        "y": [a.y for a in annotations],
+        "width": [a.width for a in annotations],
+        "height": [a.height for a in annotations],
+        "confidence": [a.confidence for a in annotations],
+        "class_id": column_class_id,
+    }
+
+
+def diagnosis_content(
+    response: DiagnosisResponse, columnar: bool = False, image_png: Optional[bytes] = None
+) -> Dict[str, Any]:
+    """
+    The response as plain data. With image_png (MessagePack only), the image is
+    carried as bytes in `converted_image` and `converted_image_base64` is left out.
+    """
+    exclude = {"annotations"} if columnar else set()
+    if image_png is not None:
+        exclude.add("converted_image_base64")
+    content = response.model_dump(by_alias=True, exclude=exclude)
+    if columnar:
+        content["annotations"] = columnar_annotations(response.annotations)
+    if image_png is not None:
+        content["converted_image"] = image_png
+    return content
+
+
+def encode_diagnosis(
+    response: DiagnosisResponse,
+    media_type: str = JSON_MEDIA_TYPE,
+    columnar: bool = False,
+    image_png: Optional[bytes] = None,
+) -> Response:
+    """Encodes the response as JSON or MessagePack; returning it skips FastAPI's own encoding."""
+    if media_type == MSGPACK_MEDIA_TYPE:
+        body = msgpack.packb(diagnosis_content(response, columnar, image_png), use_bin_type=True)
+    else:
+        body = orjson.dumps(diagnosis_content(response, columnar))
+    return Response(content=body, media_type=media_type, headers={"Vary": "Accept"})
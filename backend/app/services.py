@@ -1,243 +1,730 @@
-import pydicom
 from PIL import Image
-import numpy as np
 import base64
+import importlib
 import io
-import google.generativeai as genai
-from inference_sdk import InferenceHTTPClient, InferenceConfiguration
-from typing import List, Tuple, Optional
+import math
+import mmap
+import re
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Tuple, Optional
 
+from .cache import report_cache, report_singleflight
+from .clients import get_gemini_client, get_roboflow_client, start_clients
 from .config import settings
+from .metrics import record_stage, stage_timer
+from .resilience import CircuitOpenError, DeadlineExceededError, call_upstream
+from .prompts import LLM_PROMPT_INSTRUCTIONS, REPORT_PROMPT_VERSION, SERIES_PROMPT_INSTRUCTIONS
+from .detector import Detector, parse_class_names
 from .models import RoboflowPrediction 
+from .logs import LazyRepr, stage_logger
 import logging
 
+# pydicom, numpy (via windowing) and the ONNX backend are imported where they are
+# used, so a web process that hands decoding to worker processes and uses the
+# hosted detector never loads them.
+if TYPE_CHECKING:
+    import pydicom
+
 logger = logging.getLogger(__name__)
+decode_log = stage_logger("decode")
+detection_log = stage_logger("detection")
+report_log = stage_logger("report")
 
 def convert_dicom_to_pil_and_base64(dicom_file_bytes: bytes) -> Tuple[Optional[Image.Image], Optional[str], Optional[str]]:
     """
     Converts DICOM file bytes to a PIL Image object and a base64 encoded PNG string.
     Returns: (PIL.Image, base64_png_string, error_message)
     """
+    pil_image, png_bytes, error = convert_dicom_to_pil_and_png(dicom_file_bytes)
+    with stage_timer("base64"):
+        img_base64 = base64.b64encode(png_bytes).decode('utf-8') if png_bytes else None
+    return pil_image, img_base64, error
+
+
+def convert_dicom_to_pil_and_png(dicom_file_bytes: bytes) -> Tuple[Optional[Image.Image], Optional[bytes], Optional[str]]:
+    """
+    Converts DICOM file bytes to a PIL Image object and PNG bytes.
+    Returns: (PIL.Image, png_bytes, error_message)
+    """
+    import pydicom
+
     try:
-        ds = pydicom.dcmread(io.BytesIO(dicom_file_bytes))
-        pixel_array = ds.pixel_array
-        
-        if pixel_array.ndim > 2: 
-            if 'NumberOfFrames' in ds and ds.NumberOfFrames > 1:
-                 pixel_array = pixel_array[0] 
+        with stage_timer("dcmread"):
+            ds = pydicom.dcmread(io.BytesIO(dicom_file_bytes))
+        return _dataset_to_pil_and_png(ds)
+    except Exception as e:
+        decode_log.error("DICOM Conversion Error: %s", e, exc_info=True)
+        return None, None, f"DICOM Conversion Error: {str(e)}"
 
-        window_center = None
-        window_width = None
 
-        if 'WindowCenter' in ds:
-            wc_val = ds.WindowCenter
-            window_center = float(wc_val[0]) if isinstance(wc_val, pydicom.multival.MultiValue) else float(wc_val)
-        
-        if 'WindowWidth' in ds:
-            ww_val = ds.WindowWidth
-            window_width = float(ww_val[0]) if isinstance(ww_val, pydicom.multival.MultiValue) else float(ww_val)
+def validate_dicom_metadata(ds: "pydicom.Dataset") -> Optional[str]:
+    """Checks the image attributes read without pixel data. Returns an error message or None."""
+    for keyword in ("Rows", "Columns", "BitsAllocated"):
+        if keyword not in ds:
+            return f"DICOM file has no {keyword} attribute; it does not contain an image."
+    # Only the first frame is decoded (see decoding.decode_frame).
+    samples = int(ds.get("SamplesPerPixel", 1) or 1)
+    decoded_bytes = int(ds.Rows) * int(ds.Columns) * samples * max(1, int(ds.BitsAllocated) // 8)
+    if decoded_bytes > settings.DECODE_MAX_PIXEL_BYTES:
+        return (
+            f"Decoded image would need {decoded_bytes} bytes, more than the limit of "
+            f"{settings.DECODE_MAX_PIXEL_BYTES} bytes."
+        )
+    return None
 
-        if window_center is not None and window_width is not None:
-            lower_bound = window_center - window_width / 2
-            upper_bound = window_center + window_width / 2
-            
-            if window_width == 0:
-                normalized_array = np.clip(pixel_array, lower_bound, upper_bound)
-                min_val_clipped = np.min(normalized_array)
-                max_val_clipped = np.max(normalized_array)
-                if max_val_clipped == min_val_clipped:
-                    normalized_array = np.zeros_like(normalized_array, dtype=np.uint8)
-                else:
-                    normalized_array = ((normalized_array - min_val_clipped) / (max_val_clipped - min_val_clipped)) * 255.0
-            else:
-                pixel_array_processed = np.clip(pixel_array, lower_bound, upper_bound)
-                normalized_array = ((pixel_array_processed - lower_bound) / window_width) * 255.0
-        else:
-            min_val = np.min(pixel_array)
-            max_val = np.max(pixel_array)
-            if max_val == min_val: 
-                normalized_array = np.zeros_like(pixel_array, dtype=np.uint8)
-            else:
-                normalized_array = ((pixel_array - min_val) / (max_val - min_val)) * 255.0
-        
-        if normalized_array.size == 0 or not np.all(np.isfinite(normalized_array)):
-             logger.error("Normalized array is empty or contains non-finite values after W/L or min-max.")
-             min_val = np.min(pixel_array)
-             max_val = np.max(pixel_array)
-             if max_val == min_val: normalized_array = np.zeros_like(pixel_array, dtype=np.uint8)
-             else: normalized_array = ((pixel_array - min_val) / (max_val - min_val)) * 255.0
-
-        image_array_8bit = normalized_array.astype(np.uint8)
+
+def convert_dicom_file_to_pil_and_png(path: str) -> Tuple[Optional[Image.Image], Optional[bytes], Optional[str]]:
+    """
+    Converts a DICOM file on disk to a PIL Image object and PNG bytes. The header
+    is validated first with stop_before_pixels; pixel data is then read through
+    a read-only memory map, with large elements deferred until they are used.
+    Returns: (PIL.Image, png_bytes, error_message)
+    """
+    import pydicom
+
+    try:
+        with stage_timer("dcmread_header"):
+            metadata_error = validate_dicom_metadata(pydicom.dcmread(path, stop_before_pixels=True))
+        if metadata_error:
+            return None, None, metadata_error
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            with stage_timer("dcmread"):
+                ds = pydicom.dcmread(mapped, defer_size=settings.DICOM_DEFER_SIZE)
+            return _dataset_to_pil_and_png(ds)
+    except Exception as e:
+        decode_log.error("DICOM Conversion Error: %s", e, exc_info=True)
+        return None, None, f"DICOM Conversion Error: {str(e)}"
+
+
+def _dataset_to_pil_and_png(ds: "pydicom.Dataset") -> Tuple[Image.Image, bytes, None]:
+    from pydicom.multival import MultiValue
+
+    from .decoding import decode_frame
+    from .windowing import window_to_uint8
+
+    # Only the first frame of a multi-frame study is shown and analysed, so only it is decoded.
+    with stage_timer("pixel_decode"):
+        pixel_array = decode_frame(ds, 0, max_side=settings.DECODE_MAX_SIDE)
+
+    window_center = None
+    window_width = None
+
+    if 'WindowCenter' in ds:
+        wc_val = ds.WindowCenter
+        window_center = float(wc_val[0]) if isinstance(wc_val, MultiValue) else float(wc_val)
+    
+    if 'WindowWidth' in ds:
+        ww_val = ds.WindowWidth
+        window_width = float(ww_val[0]) if isinstance(ww_val, MultiValue) else float(ww_val)
+
+    slope = float(ds.RescaleSlope) if 'RescaleSlope' in ds and ds.RescaleSlope is not None else 1.0
+    intercept = float(ds.RescaleIntercept) if 'RescaleIntercept' in ds and ds.RescaleIntercept is not None else 0.0
+
+    with stage_timer("windowing"):
+        image_array_8bit = window_to_uint8(
+            pixel_array,
+            window_center=window_center,
+            window_width=window_width,
+            slope=slope,
+            intercept=intercept,
+            photometric_interpretation=str(ds.get('PhotometricInterpretation', '')),
+        )
         pil_image = Image.fromarray(image_array_8bit)
         
-        if 'PhotometricInterpretation' in ds and ds.PhotometricInterpretation == "MONOCHROME1":
-            pil_image = Image.eval(pil_image, lambda x: 255 - x)
-        
         if pil_image.mode != 'L': 
             pil_image = pil_image.convert('L')
 
+        # Syntaxes that cannot be decoded at reduced resolution are scaled down here.
+        if settings.DECODE_MAX_SIDE > 0 and max(pil_image.size) > settings.DECODE_MAX_SIDE:
+            pil_image.thumbnail((settings.DECODE_MAX_SIDE, settings.DECODE_MAX_SIDE), Image.Resampling.BILINEAR)
+
+    with stage_timer("png_encode"):
         buffered = io.BytesIO()
-        pil_image.save(buffered, format="PNG")
-        img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-        
-        return pil_image, img_base64, None
-    except Exception as e:
-        logger.error(f"DICOM Conversion Error: {str(e)}", exc_info=True)
-        return None, None, f"DICOM Conversion Error: {str(e)}"
+        pil_image.save(buffered, format="PNG", compress_level=settings.PNG_COMPRESS_LEVEL)
+    
+    return pil_image, buffered.getvalue(), None
 
 
-def detect_objects_roboflow_sdk(pil_image: Image.Image) -> Tuple[List[RoboflowPrediction], Optional[str]]:
-    """Sends PIL image to Roboflow using inference-sdk and parses predictions."""
+# Optional pixel-data plugins that pydicom imports on first use of a compressed transfer syntax.
+DECODER_PLUGIN_MODULES = ("pylibjpeg", "openjpeg", "libjpeg", "rle")
+
+
+def warmup_decoders() -> None:
+    """
+    Imports pydicom, numpy and the installed decoder plugins and converts a tiny
+    image, so the first real upload does not pay for them. Runs in each decode
+    worker process as it starts, or in-process when there are no workers.
+    """
+    import numpy as np
+    from pydicom.dataset import Dataset, FileMetaDataset
+    from pydicom.uid import ExplicitVRLittleEndian
+
+    for module in DECODER_PLUGIN_MODULES:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+
+    ds = Dataset()
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds.Rows, ds.Columns = 8, 8
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.BitsAllocated, ds.BitsStored, ds.HighBit = 16, 12, 11
+    ds.PixelRepresentation = 0
+    ds.PixelData = np.arange(64, dtype=np.uint16).tobytes()
+    _dataset_to_pil_and_png(ds)
+
+
+def _roboflow_config_error() -> Optional[str]:
     if not settings.ROBOFLOW_API_KEY or settings.ROBOFLOW_API_KEY == "YOUR_ROBOFLOW_API_KEY_PLACEHOLDER":
         logger.warning("Roboflow API key not configured. Skipping detection.")
-        return [], "Roboflow API Key not configured."
+        return "Roboflow API Key not configured."
     if not settings.ROBOFLOW_MODEL_ID or settings.ROBOFLOW_MODEL_ID == "your_model_project/version":
         logger.warning("Roboflow Model ID not configured. Skipping detection.")
-        return [], "Roboflow Model ID not configured."
+        return "Roboflow Model ID not configured."
+    return None
 
-    try:
-        client = InferenceHTTPClient(
-            api_url="https://detect.roboflow.com", 
-            api_key=settings.ROBOFLOW_API_KEY
-        )
 
-        custom_configuration = InferenceConfiguration(
-            confidence_threshold=0.30, 
-            iou_threshold=0.50         
+def _parse_roboflow_result(result) -> Tuple[List[RoboflowPrediction], Optional[str]]:
+    """Extracts and validates the predictions of a single-image Roboflow result."""
+    # Everything below DEBUG is lazy: with the detection stage at INFO, a result
+    # with hundreds of predictions costs no formatting at all.
+    detection_log.debug("Raw result from Roboflow client.infer(): type %s: %s", type(result).__name__, LazyRepr(result))
+
+    predictions_data = []
+    if isinstance(result, dict) and "predictions" in result:
+        predictions_data = result["predictions"]
+    elif isinstance(result, list) and len(result) > 0 and isinstance(result[0], dict) and "predictions" in result[0]:
+        predictions_data = result[0]["predictions"]
+    elif isinstance(result, list) and len(result) > 0 and "x" in result[0] and "class" in result[0]: 
+        predictions_data = result
+    else:
+        detection_log.error(
+            "Roboflow response format not recognized or 'predictions' key missing. Type: %s, Content: %s",
+            type(result).__name__, LazyRepr(result)
         )
-        client.configure(custom_configuration)
-        
-        result = client.infer(
-            inference_input=pil_image, 
-            model_id=settings.ROBOFLOW_MODEL_ID
+        return [], "Roboflow response format not recognized."
+    
+    parsed_predictions = []
+    if not predictions_data or not isinstance(predictions_data, list):
+        detection_log.debug("No predictions in the Roboflow result: %s", LazyRepr(predictions_data))
+    else:
+        verbose = detection_log.isEnabledFor(logging.DEBUG)
+        for i, pred_dict in enumerate(predictions_data):
+            if not isinstance(pred_dict, dict):
+                detection_log.warning("Item #%d in predictions_data is not a dict: %s", i, LazyRepr(pred_dict))
+                continue 
+            try:
+                pydantic_pred = RoboflowPrediction(**pred_dict)
+                parsed_predictions.append(pydantic_pred)
+                if verbose:
+                    detection_log.debug(
+                        "Prediction #%d: %s", i, LazyRepr(pred_dict), extra={"sample_key": "roboflow_prediction"}
+                    )
+            except Exception as e_parse:
+                detection_log.error(
+                    "Error parsing prediction dict #%d (%s): %s", i, LazyRepr(pred_dict), e_parse,
+                    extra={"sample_key": "roboflow_prediction_error"}
+                )
+    
+    if not parsed_predictions and predictions_data:
+        detection_log.warning("predictions_data was present but no prediction could be parsed.")
+    detection_log.debug("Parsed %d of %d Roboflow predictions.", len(parsed_predictions), len(predictions_data or []))
+    
+    return parsed_predictions, None
+
+
+class RoboflowDetector(Detector):
+    """Hosted Roboflow inference over HTTP via inference-sdk."""
+
+    name = "roboflow"
+
+    @staticmethod
+    def _infer(client, pil_image: Image.Image):
+        # Leaves part of the request budget for the report, which still has to run after detection.
+        return call_upstream(
+            "roboflow",
+            lambda timeout: client.infer(pil_image, read_timeout=timeout),
+            cap=settings.ROBOFLOW_TIMEOUT_SECONDS,
+            reserve=settings.REPORT_RESERVE_SECONDS,
+            hedge_after=settings.ROBOFLOW_HEDGE_AFTER_SECONDS,
         )
+
+    def detect(self, pil_image: Image.Image) -> Tuple[List[RoboflowPrediction], Optional[str]]:
+        config_error = _roboflow_config_error()
+        if config_error:
+            return [], config_error
+
+        try:
+            result = self._infer(get_roboflow_client(), pil_image)
+            return _parse_roboflow_result(result)
+            
+        except (CircuitOpenError, DeadlineExceededError) as e:
+            detection_log.warning("Skipping Roboflow detection: %s", e)
+            return [], f"Detection skipped: {e}"
+        except Exception as e:
+            detection_log.error("Roboflow SDK General Error: %s", e, exc_info=True)
+            return [], f"Roboflow SDK GeneralError: {str(e)}"
+
+    def detect_batch(self, pil_images: List[Image.Image]) -> List[Tuple[List[RoboflowPrediction], Optional[str]]]:
+        """Sends the images concurrently over the shared connection pool."""
+        config_error = _roboflow_config_error()
+        if config_error:
+            return [([], config_error) for _ in pil_images]
+
+        client = get_roboflow_client()
+        outcomes = []
+        for result, error in client.infer_many(list(pil_images), lambda image: self._infer(client, image)):
+            if isinstance(error, (CircuitOpenError, DeadlineExceededError)):
+                outcomes.append(([], f"Detection skipped: {error}"))
+            elif error is not None:
+                detection_log.error("Roboflow SDK General Error during batch of %d: %s", len(pil_images), error)
+                outcomes.append(([], f"Roboflow SDK GeneralError: {str(error)}"))
+            else:
+                outcomes.append(_parse_roboflow_result(result))
+        return outcomes
+
+
+class UnavailableDetector(Detector):
+    """Stands in for a detector that failed to load, so requests report the cause instead of crashing."""
+
+    name = "unavailable"
+
+    def __init__(self, error: str):
+        self.error = error
+
+    def detect_batch(self, pil_images: List[Image.Image]) -> List[Tuple[List[RoboflowPrediction], Optional[str]]]:
+        return [([], self.error) for _ in pil_images]
+
+
+_detector: Optional[Detector] = None
+_detector_lock = threading.Lock()
+
+
+def create_detector() -> Detector:
+    """Builds the detector selected by DETECTOR_BACKEND."""
+    backend = settings.DETECTOR_BACKEND.lower()
+    if backend == "roboflow":
+        return RoboflowDetector()
+    if backend == "onnx":
+        from .onnx_detector import OnnxDetector
+
+        if not settings.ONNX_MODEL_PATH:
+            logger.error("DETECTOR_BACKEND is 'onnx' but ONNX_MODEL_PATH is not set.")
+            return UnavailableDetector("ONNX model path not configured.")
+        try:
+            return OnnxDetector(
+                settings.ONNX_MODEL_PATH,
+                confidence_threshold=settings.ROBOFLOW_CONFIDENCE,
+                iou_threshold=settings.ROBOFLOW_OVERLAP,
+                class_names=parse_class_names(settings.ONNX_CLASS_NAMES),
+                input_size=settings.ONNX_INPUT_SIZE,
+                batch_size=settings.INFERENCE_BATCH_SIZE,
+                max_detections=settings.ONNX_MAX_DETECTIONS,
+                intra_op_threads=settings.ONNX_INTRA_OP_THREADS,
+            )
+        except Exception as e:
+            logger.error(f"Failed to load ONNX model {settings.ONNX_MODEL_PATH}: {e}", exc_info=True)
+            return UnavailableDetector(f"ONNX model could not be loaded: {e}")
+    logger.error(f"Unknown DETECTOR_BACKEND '{settings.DETECTOR_BACKEND}'.")
+    return UnavailableDetector(f"Unknown detector backend '{settings.DETECTOR_BACKEND}'.")
+
+
+def load_detector() -> Detector:
+    """Creates the process-wide detector. Called once at startup; later calls replace it."""
+    global _detector
+    with _detector_lock:
+        _detector = create_detector()
+    logger.info(f"Using '{_detector.name}' detector backend.")
+    return _detector
+
+
+def get_detector() -> Detector:
+    """The process-wide detector, created on first use if startup did not load it."""
+    global _detector
+    if _detector is None:
+        with _detector_lock:
+            if _detector is None:
+                _detector = create_detector()
+                logger.info(f"Using '{_detector.name}' detector backend.")
+    return _detector
+
+
+def start_service_clients(detector: Detector) -> None:
+    """Creates (and warms up) the long-lived clients for the external services that are configured."""
+    start_clients(
+        roboflow=detector.name == RoboflowDetector.name and _roboflow_config_error() is None,
+        gemini=_gemini_configured(),
+    )
+
+
+def _tiling_needed(pil_images: List[Image.Image]) -> bool:
+    threshold = settings.TILING_THRESHOLD_PIXELS
+    return threshold > 0 and any(max(pil_image.size) > threshold for pil_image in pil_images)
+
+
+def detect_objects_roboflow_sdk(pil_image: Image.Image) -> Tuple[List[RoboflowPrediction], Optional[str]]:
+    """Runs detection on one PIL image with the configured detector backend (tiled if it is large)."""
+    if _tiling_needed([pil_image]):
+        # Imported on first use: tiling needs numpy, which small-image deployments may never load.
+        from .tiling import detect_tiled
+
+        return detect_tiled(get_detector(), [pil_image])[0]
+    return get_detector().detect(pil_image)
+
+
+def detect_objects_roboflow_sdk_batch(pil_images: List[Image.Image]) -> List[Tuple[List[RoboflowPrediction], Optional[str]]]:
+    """
+    Runs detection on several PIL images with the configured detector backend.
+    Returns one (predictions, error) per image.
+    """
+    if not pil_images:
+        return []
+    if _tiling_needed(pil_images):
+        from .tiling import detect_tiled
+
+        return detect_tiled(get_detector(), pil_images)
+    return get_detector().detect_batch(pil_images)
+
+
+def _class_label(ann: RoboflowPrediction) -> str:
+    return ann.class_name if ann.class_name else "unidentified finding"
+
+
+def _format_annotations_for_prompt(annotations: List[RoboflowPrediction]) -> str:
+    return "\n".join(
+        f"- Detected Pathology: {_class_label(ann)} (Confidence: {ann.confidence:.2f})" for ann in annotations
+    )
+
+
+def _confidence_bucket(confidence: float) -> float:
+    bucket = settings.REPORT_CONFIDENCE_BUCKET
+    if bucket <= 0:
+        return round(confidence, 4)
+    return round(math.floor(confidence / bucket + 1e-9) * bucket, 4)
+
+
+def _grouped_findings(annotations: List[RoboflowPrediction]) -> List[Tuple[str, List[float]]]:
+    """Findings as (normalized class label, sorted confidence buckets), in a canonical order."""
+    groups: Dict[str, List[float]] = {}
+    for ann in annotations:
+        groups.setdefault(_class_label(ann).strip().lower(), []).append(_confidence_bucket(ann.confidence))
+    return [(label, sorted(groups[label], reverse=True)) for label in sorted(groups)]
+
+
+def findings_signature(annotations: List[RoboflowPrediction]) -> str:
+    """
+    Key for the report cache: the model and prompt version plus each class with
+    its count and confidence buckets, e.g. "...:caries x2@0.9,0.8;periapical lesion x1@0.6".
+    """
+    findings = ";".join(
+        f"{label} x{len(buckets)}@" + ",".join(f"{bucket:g}" for bucket in buckets)
+        for label, buckets in _grouped_findings(annotations)
+    )
+    return f"{settings.GEMINI_MODEL}:p{REPORT_PROMPT_VERSION}:b{settings.REPORT_CONFIDENCE_BUCKET:g}:{findings}"
+
+
+def _format_findings_for_prompt(annotations: List[RoboflowPrediction]) -> str:
+    """Prompt lines built only from the findings signature, so every study sharing it gets the same prompt."""
+    bucket = settings.REPORT_CONFIDENCE_BUCKET
+    lines = []
+    for label, buckets in _grouped_findings(annotations):
+        for low in buckets:
+            confidence = f"{low:.2f}-{min(low + bucket, 1.0):.2f}" if bucket > 0 else f"{low:.2f}"
+            lines.append(f"- Detected Pathology: {label} (Confidence: {confidence})")
+    return "\n".join(lines)
+
+
+def _gemini_configured() -> bool:
+    return bool(settings.GEMINI_API_KEY) and settings.GEMINI_API_KEY != "YOUR_GEMINI_API_KEY_OR_LEAVE_BLANK_TO_SIMULATE"
+
+
+GEMINI_SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
+]
+
+
+def _gemini_request_kwargs(client) -> dict:
+    return {
+        "generation_config": client.genai.types.GenerationConfig(temperature=0.5),
+        "safety_settings": GEMINI_SAFETY_SETTINGS,
+    }
+
+
+def _generate_gemini_text(full_prompt: str) -> Optional[str]:
+    """Runs the prompt through Gemini. Returns None if the call fails or yields no text."""
+    try:
+        client = get_gemini_client()
+        request_kwargs = _gemini_request_kwargs(client)
+
+        with stage_timer("gemini"):
+            response = call_upstream(
+                "gemini",
+                lambda timeout: client.generate_content(full_prompt, timeout=timeout, **request_kwargs),
+                cap=settings.GEMINI_TIMEOUT_SECONDS,
+                hedge_after=settings.GEMINI_HEDGE_AFTER_SECONDS,
+            )
         
-        logger.info(f"Raw result from Roboflow client.infer(): Type: {type(result)}, Content: {str(result)[:500]}")
-
-        predictions_data = []
-        if isinstance(result, dict) and "predictions" in result:
-            predictions_data = result["predictions"]
-            logger.info(f"Extracted predictions_data (from dict): {str(predictions_data)[:500]}")
-        elif isinstance(result, list) and len(result) > 0 and isinstance(result[0], dict) and "predictions" in result[0]:
-            predictions_data = result[0]["predictions"]
-            logger.info(f"Extracted predictions_data (from list of dicts with 'predictions' key): {str(predictions_data)[:500]}")
-        elif isinstance(result, list) and len(result) > 0 and "x" in result[0] and "class" in result[0]: 
-            predictions_data = result
-            logger.info(f"Using result directly as predictions_data (list of prediction dicts): {str(predictions_data)[:500]}")
-        else:
-            logger.error(f"Roboflow response format not recognized or 'predictions' key missing. Type: {type(result)}, Content: {str(result)[:500]}")
-            return [], "Roboflow response format not recognized."
-        
-        parsed_predictions = []
-        if not predictions_data or not isinstance(predictions_data, list):
-            logger.warning(f"predictions_data is empty or not a list after extraction: {predictions_data}")
-        else:
-            for i, pred_dict in enumerate(predictions_data):
-                logger.info(f"Raw prediction dict #{i} before Pydantic: {pred_dict}")
-                if not isinstance(pred_dict, dict):
-                    logger.warning(f"Item #{i} in predictions_data is not a dict: {pred_dict}")
-                    continue 
-                try:
-                    pydantic_pred = RoboflowPrediction(**pred_dict)
-                    parsed_predictions.append(pydantic_pred)
-                    logger.info(f"Successfully parsed prediction #{i} into Pydantic model: {pydantic_pred.model_dump_json()}")
-                except Exception as e_parse:
-                    logger.error(f"Error parsing prediction dict #{i} ({pred_dict}) with Pydantic: {e_parse}", exc_info=True)
-        
-        if not parsed_predictions and predictions_data:
-             logger.warning("predictions_data was present but parsed_predictions is empty. Check Pydantic parsing logs.")
-        
-        return parsed_predictions, None
+        report_text = ""
+        if hasattr(response, 'text') and response.text:
+             report_text = response.text
+        elif hasattr(response, 'parts') and response.parts:
+             report_text = "".join(part.text for part in response.parts if hasattr(part, 'text'))
+        elif hasattr(response, 'candidates') and response.candidates and \
+             hasattr(response.candidates[0], 'content') and \
+             hasattr(response.candidates[0].content, 'parts') and \
+             response.candidates[0].content.parts:
+             report_text = "".join(part.text for part in response.candidates[0].content.parts if hasattr(part, 'text'))
         
+        if report_text:
+            report_log.info("Successfully generated concise report using Gemini API.")
+            return report_text.strip() 
+        report_log.warning("Gemini response for concise prompt was empty or structure not as expected. Full response: %s", LazyRepr(response))
+        report_log.info("Falling back to concise simulated report after Gemini issue.")
+
+    except (CircuitOpenError, DeadlineExceededError) as e:
+        report_log.warning("Skipping Gemini: %s Using the simulated report.", e)
     except Exception as e:
-        logger.error(f"Roboflow SDK General Error: {str(e)}", exc_info=True)
-        return [], f"Roboflow SDK GeneralError: {str(e)}"
+        report_log.error("Error generating concise report with Gemini: %s", e, exc_info=True)
+        report_log.info("Falling back to concise simulated report after Gemini error.")
+    return None
+
+
+def _streamed_chunk_text(chunk) -> str:
+    try:
+        return chunk.text
+    except ValueError:
+        # A chunk without text parts, e.g. the last one carrying only the finish reason.
+        return ""
+
+
+def _stream_gemini_text(full_prompt: str, emit: Callable[[str, str], None]) -> Optional[str]:
+    """
+    Like _generate_gemini_text, but with Gemini's streaming generation: each piece
+    of text is passed to emit("chunk", text) as it arrives. Returns the whole
+    text, or None if the call fails or yields no text; if pieces were already
+    emitted by then, emit("reset", "") tells the consumer to discard them.
+    """
+    emitted = []
+
+    def consume(timeout: float) -> str:
+        client = get_gemini_client()
+        started = time.perf_counter()
+        response = client.generate_content(full_prompt, timeout=timeout, stream=True, **_gemini_request_kwargs(client))
+        for chunk in response:
+            text = _streamed_chunk_text(chunk)
+            if not text:
+                continue
+            if not emitted and settings.METRICS_ENABLED:
+                record_stage("gemini_first_token", time.perf_counter() - started)
+            emitted.append(text)
+            emit("chunk", text)
+        return "".join(emitted)
+
+    try:
+        with stage_timer("gemini"):
+            # Never hedged: a second stream would interleave its text with the first.
+            report_text = call_upstream("gemini", consume, cap=settings.GEMINI_TIMEOUT_SECONDS)
+        if report_text.strip():
+            report_log.info("Successfully streamed concise report from Gemini API.")
+            return report_text.strip()
+        report_log.warning("Gemini stream for concise prompt yielded no text.")
+    except (CircuitOpenError, DeadlineExceededError) as e:
+        report_log.warning("Skipping Gemini: %s Using the simulated report.", e)
+    except Exception as e:
+        report_log.error("Error streaming concise report from Gemini: %s", e, exc_info=True)
+    if emitted:
+        emit("reset", "")
+    report_log.info("Falling back to concise simulated report after Gemini issue.")
+    return None
 
 
 def generate_llm_report(annotations: List[RoboflowPrediction]) -> str:
     """Generates a diagnostic report using Gemini or simulates it."""
+    return generate_llm_report_with_source(annotations)[0]
+
+
+def generate_llm_report_with_source(annotations: List[RoboflowPrediction]) -> Tuple[str, bool]:
+    """
+    Like generate_llm_report, but also says whether the report is final: True when
+    it came from Gemini or needs no LLM (no findings), False when it is the
+    simulated fallback, which callers should not cache.
+    """
     if not annotations:
-        return "No pathologies detected by the model, or an error occurred during detection. Clinical correlation is advised."
+        return "No pathologies detected by the model, or an error occurred during detection. Clinical correlation is advised.", True
 
-    annotation_summary = []
-    for ann in annotations:
-        class_name_to_report = ann.class_name if ann.class_name else "unidentified finding"
-        annotation_summary.append(
-            f"- Detected Pathology: {class_name_to_report} (Confidence: {ann.confidence:.2f})"
-        )
-    prompt_data = "\n".join(annotation_summary)
+    if report_cache is None:
+        return _generate_llm_report(annotations, _format_annotations_for_prompt(annotations))
+
+    # Reports are shared by every study with the same findings signature, and
+    # concurrent requests for one signature wait on a single LLM call.
+    key = findings_signature(annotations)
+    cached_report = report_cache.get(key)
+    if cached_report is not None:
+        report_log.info("Serving diagnostic report from the report cache.")
+        return cached_report, True
 
+    def generate() -> Tuple[str, bool]:
+        report, is_final = _generate_llm_report(annotations, _format_findings_for_prompt(annotations))
+        if is_final:
+            report_cache.set(key, report)
+        return report, is_final
 
-    llm_prompt_instructions = """You are a dental radiologist. Based on the image annotations provided below, write a concise diagnostic report in clinical language.
-The report should be a brief paragraph.
-Please highlight the following:
-1. Detected pathologies.
-2. Location: You may state that specific tooth location cannot be determined from the provided annotations alone.
-3. Clinical advice (optional, general advice related to findings is acceptable)."""
+    (report, is_final), shared = report_singleflight.do(key, generate)
+    if shared:
+        report_cache.count_coalesced()
+        if not is_final:
+            # The leader's fallback names its own confidences; build ours.
+            return _simulated_llm_report(annotations), False
+    return report, is_final
 
-    full_prompt = f"""{llm_prompt_instructions}
+
+def _report_prompt(findings_text: str) -> str:
+    return f"""{LLM_PROMPT_INSTRUCTIONS}
 
 Image Annotations:
-{prompt_data}
+{findings_text}
 
 Concise Diagnostic Report (brief paragraph):
 """
 
-    if settings.GEMINI_API_KEY and settings.GEMINI_API_KEY != "YOUR_GEMINI_API_KEY_OR_LEAVE_BLANK_TO_SIMULATE":
-        logger.info("Attempting to generate report with Gemini API using concise prompt...")
-        try:
-            genai.configure(api_key=settings.GEMINI_API_KEY)
-            model = genai.GenerativeModel('gemini-1.5-flash-latest') 
-            
-            safety_settings = [
-                {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
-                {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
-                {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
-                {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
-            ]
-            generation_config = genai.types.GenerationConfig(
-                temperature=0.5,  
-            )
-
-            response = model.generate_content(
-                full_prompt,
-                generation_config=generation_config,
-                safety_settings=safety_settings
-                )
-            
-            report_text = ""
-            if hasattr(response, 'text') and response.text:
-                 report_text = response.text
-            elif hasattr(response, 'parts') and response.parts:
-                 report_text = "".join(part.text for part in response.parts if hasattr(part, 'text'))
-            elif hasattr(response, 'candidates') and response.candidates and \
-                 hasattr(response.candidates[0], 'content') and \
-                 hasattr(response.candidates[0].content, 'parts') and \
-                 response.candidates[0].content.parts:
-                 report_text = "".join(part.text for part in response.candidates[0].content.parts if hasattr(part, 'text'))
-            
-            if report_text:
-                logger.info("Successfully generated concise report using Gemini API.")
-                return report_text.strip() 
-            else:
-                logger.warning(f"Gemini response for concise prompt was empty or structure not as expected. Full response: {response}")
-                logger.info("Falling back to concise simulated report after Gemini issue.")
 
+def _generate_llm_report(annotations: List[RoboflowPrediction], findings_text: str) -> Tuple[str, bool]:
+    full_prompt = _report_prompt(findings_text)
 
-        except Exception as e:
-            logger.error(f"Error generating concise report with Gemini: {str(e)}", exc_info=True)
-            logger.info("Falling back to concise simulated report after Gemini error.")
-           
+    if _gemini_configured():
+        report_log.info("Attempting to generate report with Gemini API using concise prompt...")
+        report_text = _generate_gemini_text(full_prompt)
+        if report_text:
+            return report_text, True
     else: 
-        logger.info("Gemini API key not configured or is placeholder. Using concise simulated report.")
-    
+        report_log.info("Gemini API key not configured or is placeholder. Using concise simulated report.")
     
+    return _simulated_llm_report(annotations), False
+
+
+# Reports that are not generated token by token are still streamed in pieces of about this size.
+REPORT_CHUNK_CHARS = 24
+
+
+def text_chunks(text: str, size: int = REPORT_CHUNK_CHARS) -> Iterator[str]:
+    """Splits text after whitespace into pieces of about `size` characters that join back into it."""
+    chunk = ""
+    for word in re.split(r"(?<=\s)(?=\S)", text):
+        chunk += word
+        if len(chunk) >= size:
+            yield chunk
+            chunk = ""
+    if chunk:
+        yield chunk
+
+
+def stream_llm_report(annotations: List[RoboflowPrediction], emit: Callable[[str, str], None]) -> Tuple[str, str]:
+    """
+    Streaming counterpart of generate_llm_report_with_source for /api/diagnose/stream.
+    The report text is passed to emit("chunk", text) piece by piece: as Gemini
+    generates it, or in REPORT_CHUNK_CHARS pieces when it is already known (no
+    findings, report cache) or simulated. emit("reset", "") discards the pieces
+    sent so far when Gemini fails mid-stream and the simulated report follows.
+
+    Returns (report, source) with source "gemini", "cache", "static" (no LLM
+    needed) or "simulated"; only the simulated fallback is not final. Streams
+    are not coalesced like generate_llm_report_with_source's calls, but a final
+    report is stored in the report cache for both.
+    """
+    def emit_all(text: str) -> None:
+        for chunk in text_chunks(text):
+            emit("chunk", chunk)
+
+    if not annotations:
+        report = generate_llm_report([])
+        emit_all(report)
+        return report, "static"
+
+    key = None
+    findings_text = _format_annotations_for_prompt(annotations)
+    if report_cache is not None:
+        key = findings_signature(annotations)
+        cached_report = report_cache.get(key)
+        if cached_report is not None:
+            report_log.info("Serving diagnostic report from the report cache.")
+            emit_all(cached_report)
+            return cached_report, "cache"
+        findings_text = _format_findings_for_prompt(annotations)
+
+    if _gemini_configured():
+        report_log.info("Attempting to stream report from Gemini API using concise prompt...")
+        report_text = _stream_gemini_text(_report_prompt(findings_text), emit)
+        if report_text:
+            if key is not None:
+                report_cache.set(key, report_text)
+            return report_text, "gemini"
+    else:
+        report_log.info("Gemini API key not configured or is placeholder. Using concise simulated report.")
+
+    report = _simulated_llm_report(annotations)
+    emit_all(report)
+    return report, "simulated"
+
+
+def _simulated_llm_report(annotations: List[RoboflowPrediction]) -> str:
     pathologies_summary = ", ".join(
-        f"{ann.class_name if ann.class_name else 'unidentified finding'} (Confidence: {ann.confidence:.0%})" for ann in annotations
-    ) if annotations else "No specific pathologies were clearly identified by the automated system."
+        f"{_class_label(ann)} (Confidence: {ann.confidence:.0%})" for ann in annotations
+    )
 
     simulated_report = f"""--- SIMULATED DIAGNOSTIC REPORT ---
 Automated analysis of the radiographic image suggests the presence of {pathologies_summary}. Specific tooth location cannot be determined from these annotations alone. Clinical correlation is strongly recommended to confirm these automated findings and determine appropriate patient management. This automated report serves as an initial guide and is not a substitute for a comprehensive evaluation by a dental professional.
 """
     
-    return simulated_report.strip()
\ No newline at end of file
+    return simulated_report.strip()
+
+
+def summarize_annotations(annotations: List[RoboflowPrediction]) -> str:
+    """Short per-image findings line used when the narrative report covers a whole series."""
+    if not annotations:
+        return "No pathologies detected by the model in this image. See the series report."
+    findings = ", ".join(f"{_class_label(ann)} (Confidence: {ann.confidence:.0%})" for ann in annotations)
+    return f"Detected: {findings}. See the series report."
+
+
+def generate_series_report(series: List[Tuple[str, List[RoboflowPrediction]]]) -> str:
+    """Generates one diagnostic report for a series of images with a single Gemini call, or simulates it."""
+    images_with_findings = [(filename, annotations) for filename, annotations in series if annotations]
+    if not images_with_findings:
+        return "No pathologies detected by the model in any image of this series, or an error occurred during detection. Clinical correlation is advised."
+
+    prompt_sections = "\n\n".join(
+        f"Image {filename}:\n{_format_annotations_for_prompt(annotations)}"
+        for filename, annotations in images_with_findings
+    )
+    full_prompt = f"""{SERIES_PROMPT_INSTRUCTIONS}
+
+Series Annotations ({len(series)} images, {len(images_with_findings)} with findings):
+{prompt_sections}
+
+Concise Series Diagnostic Report (brief paragraph):
+"""
+
+    if _gemini_configured():
+        report_log.info("Attempting to generate series report for %d images with Gemini API...", len(series))
+        report_text = _generate_gemini_text(full_prompt)
+        if report_text:
+            return report_text
+    else:
+        report_log.info("Gemini API key not configured or is placeholder. Using simulated series report.")
+
+    per_image_summary = "; ".join(
+        f"{filename}: " + ", ".join(f"{_class_label(ann)} ({ann.confidence:.0%})" for ann in annotations)
+        for filename, annotations in images_with_findings
+    )
+    simulated_report = f"""--- SIMULATED SERIES DIAGNOSTIC REPORT ---
+Automated analysis of {len(series)} radiographic images found findings in {len(images_with_findings)} of them: {per_image_summary}. Specific tooth location cannot be determined from these annotations alone. Clinical correlation is strongly recommended to confirm these automated findings and determine appropriate patient management. This automated report serves as an initial guide and is not a substitute for a comprehensive evaluation by a dental professional.
+"""
+
+    return simulated_report.strip()
@@ -0,0 +1,194 @@
+"""
+Tiled detection for large images (panoramics, CBCT slices). Detectors resize
+their input to the model size, which shrinks small lesions on a 3000-pixel
+panoramic to a few pixels. Above TILING_THRESHOLD_PIXELS the image is cut into
+overlapping TILING_TILE_SIZE tiles, which go to the detector in one detect_batch call
+(batched by the ONNX backend, sent concurrently by the Roboflow one), together
+with the whole image for findings larger than a tile. Detections are moved
+back to image coordinates and duplicates across tiles are merged per class.
+
+Tiles overlap, so a finding on a tile edge is seen whole by one tile and cut
+off by its neighbour. Duplicates are matched by intersection over the smaller
+box (a cut-off box lies inside the whole one) rather than IoU.
+"""
+import logging
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from .config import settings
+from .detector import Detector
+from .metrics import stage_timer
+from .models import RoboflowPrediction
+from .onnx_detector import MAX_NMS_CANDIDATES
+
+logger = logging.getLogger(__name__)
+
+MERGE_METHODS = ("nms", "wbf")
+
+Box = Tuple[int, int, int, int]
+
+
+def needs_tiling(pil_image: Image.Image) -> bool:
+    threshold = settings.TILING_THRESHOLD_PIXELS
+    return threshold > 0 and max(pil_image.size) > threshold
+
+
+def _axis_starts(length: int, tile: int, stride: int) -> List[int]:
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile, stride))
+    # The last tile is aligned to the far edge instead of running past it.
+    starts.append(length - tile)
+    return starts
+
+
+def tile_boxes(width: int, height: int, tile_size: int, overlap: float) -> List[Box]:
+    """(left, top, right, bottom) of overlapping tiles covering a width x height image."""
+    stride = max(1, round(tile_size * (1.0 - overlap)))
+    return [
+        (left, top, min(left + tile_size, width), min(top + tile_size, height))
+        for top in _axis_starts(height, tile_size, stride)
+        for left in _axis_starts(width, tile_size, stride)
+    ]
+
+
+def pairwise_ios(boxes: np.ndarray) -> np.ndarray:
+    """(N, N) intersection over the smaller area of (N, 4) xyxy boxes."""
+    x1, y1, x2, y2 = (boxes[:, i] for i in range(4))
+    areas = np.maximum(x2 - x1, 0) * np.maximum(y2 - y1, 0)
+    inter_w = np.maximum(np.minimum(x2[:, None], x2[None, :]) - np.maximum(x1[:, None], x1[None, :]), 0)
+    inter_h = np.maximum(np.minimum(y2[:, None], y2[None, :]) - np.maximum(y1[:, None], y1[None, :]), 0)
+    inter = inter_w * inter_h
+    smaller = np.minimum(areas[:, None], areas[None, :])
+    return np.divide(inter, smaller, out=np.zeros_like(inter), where=smaller > 0)
+
+
+def _clusters(boxes: np.ndarray, scores: np.ndarray, class_ids: np.ndarray, threshold: float) -> List[np.ndarray]:
+    """
+    Greedy grouping in descending score order: each remaining box takes every
+    unassigned box of its class that overlaps it by more than `threshold`.
+    Returns index arrays, the highest-scoring member first.
+    """
+    overlap = pairwise_ios(boxes)
+    overlap[class_ids[:, None] != class_ids[None, :]] = 0.0
+    order = np.argsort(-scores, kind="stable")
+    assigned = np.zeros(len(scores), dtype=bool)
+    clusters = []
+    for index in order:
+        if assigned[index]:
+            continue
+        members = order[~assigned[order] & (overlap[index, order] > threshold)]
+        # A box always belongs to its own cluster, even if it has zero area.
+        members = np.concatenate([[index], members[members != index]])
+        assigned[members] = True
+        clusters.append(members)
+    return clusters
+
+
+def merge_detections(
+    boxes: np.ndarray, scores: np.ndarray, class_ids: np.ndarray, method: str, threshold: float
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Merges duplicate detections of one finding. "nms" keeps the best box of each
+    group; "wbf" replaces the group by its score-weighted mean box and mean score.
+    """
+    if boxes.shape[0] == 0:
+        return boxes, scores, class_ids
+    clusters = _clusters(boxes, scores, class_ids, threshold)
+    if method == "nms":
+        keep = np.array([members[0] for members in clusters], dtype=np.int64)
+        return boxes[keep], scores[keep], class_ids[keep]
+    fused_boxes = np.stack([
+        (boxes[members] * scores[members, None]).sum(axis=0) / scores[members].sum() for members in clusters
+    ])
+    fused_scores = np.array([scores[members].mean() for members in clusters], dtype=scores.dtype)
+    fused_classes = np.array([class_ids[members[0]] for members in clusters])
+    return fused_boxes, fused_scores, fused_classes
+
+
+def _to_arrays(predictions: List[Tuple[RoboflowPrediction, float, float]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[str]]:
+    """xyxy boxes (shifted by each prediction's tile origin), scores and class indices."""
+    class_names = sorted({prediction.class_name for prediction, _, _ in predictions})
+    class_index = {name: i for i, name in enumerate(class_names)}
+    boxes = np.array([
+        (p.x - p.width / 2 + dx, p.y - p.height / 2 + dy, p.x + p.width / 2 + dx, p.y + p.height / 2 + dy)
+        for p, dx, dy in predictions
+    ], dtype=np.float64).reshape(-1, 4)
+    scores = np.array([p.confidence for p, _, _ in predictions], dtype=np.float64)
+    class_ids = np.array([class_index[p.class_name] for p, _, _ in predictions], dtype=np.int64)
+    return boxes, scores, class_ids, class_names
+
+
+def _merge_image(
+    predictions: List[Tuple[RoboflowPrediction, float, float]], width: int, height: int
+) -> List[RoboflowPrediction]:
+    if not predictions:
+        return []
+    boxes, scores, class_ids, class_names = _to_arrays(predictions)
+    if scores.shape[0] > MAX_NMS_CANDIDATES:
+        top = np.argpartition(-scores, MAX_NMS_CANDIDATES)[:MAX_NMS_CANDIDATES]
+        boxes, scores, class_ids = boxes[top], scores[top], class_ids[top]
+    boxes[:, [0, 2]] = np.clip(boxes[:, [0, 2]], 0, width)
+    boxes[:, [1, 3]] = np.clip(boxes[:, [1, 3]], 0, height)
+    method = settings.TILING_MERGE.lower()
+    if method not in MERGE_METHODS:
+        logger.warning(f"Unknown TILING_MERGE '{settings.TILING_MERGE}'; using nms.")
+        method = "nms"
+    boxes, scores, class_ids = merge_detections(boxes, scores, class_ids, method, settings.TILING_MATCH_THRESHOLD)
+    order = np.argsort(-scores, kind="stable")
+    return [
+        RoboflowPrediction(
+            x=float((boxes[i, 0] + boxes[i, 2]) / 2),
+            y=float((boxes[i, 1] + boxes[i, 3]) / 2),
+            width=float(boxes[i, 2] - boxes[i, 0]),
+            height=float(boxes[i, 3] - boxes[i, 1]),
+            confidence=float(scores[i]),
+            class_name=class_names[int(class_ids[i])],
+        )
+        for i in order
+    ]
+
+
+def detect_tiled(detector: Detector, pil_images: List[Image.Image]) -> List[Tuple[List[RoboflowPrediction], Optional[str]]]:
+    """
+    Like detector.detect_batch, but images above the tiling threshold are split
+    into tiles. All tiles and untiled images go to the detector in one call.
+    An image is reported as failed if any of its tiles failed.
+    """
+    inputs: List[Image.Image] = []
+    # Per input image: [(index into inputs, x offset, y offset)].
+    plans: List[List[Tuple[int, int, int]]] = []
+    with stage_timer("tiling_split"):
+        for pil_image in pil_images:
+            if not needs_tiling(pil_image):
+                plans.append([(len(inputs), 0, 0)])
+                inputs.append(pil_image)
+                continue
+            plan = []
+            boxes = tile_boxes(*pil_image.size, settings.TILING_TILE_SIZE, settings.TILING_OVERLAP)
+            for left, top, right, bottom in boxes:
+                plan.append((len(inputs), left, top))
+                inputs.append(pil_image.crop((left, top, right, bottom)))
+            if settings.TILING_INCLUDE_FULL_IMAGE:
+                plan.append((len(inputs), 0, 0))
+                inputs.append(pil_image)
+            logger.info(f"Tiling {pil_image.width}x{pil_image.height} image into {len(boxes)} tiles.")
+            plans.append(plan)
+
+    outcomes = detector.detect_batch(inputs)
+
+    results: List[Tuple[List[RoboflowPrediction], Optional[str]]] = []
+    with stage_timer("tiling_merge"):
+        for pil_image, plan in zip(pil_images, plans):
+            if len(plan) == 1:
+                results.append(outcomes[plan[0][0]])
+                continue
+            errors = [outcomes[index][1] for index, _, _ in plan if outcomes[index][1]]
+            if errors:
+                results.append(([], f"Tiled detection failed on {len(errors)} of {len(plan)} tiles: {errors[0]}"))
+                continue
+            shifted = [(prediction, dx, dy) for index, dx, dy in plan for prediction in outcomes[index][0]]
+            results.append((_merge_image(shifted, *pil_image.size), None))
+    return results
@@ -0,0 +1,91 @@
+"""
+Initialization of the backends a request needs: the detector (and its model),
+the long-lived service clients and the DICOM decoders. Run from the lifespan
+according to STARTUP_WARMUP, or on demand from POST /api/warmup; anything not
+warmed is initialized by the first request that needs it.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+from .concurrency import start_cpu_workers
+from .config import settings
+from .services import load_detector, start_service_clients, warmup_decoders
+
+logger = logging.getLogger(__name__)
+
+_lock = asyncio.Lock()
+_result: Optional[Dict[str, Any]] = None
+_background_task: Optional[asyncio.Task] = None
+
+
+async def _timed(timings: Dict[str, float], name: str, step: Callable[[], Awaitable[Any]]) -> None:
+    started = time.perf_counter()
+    try:
+        await step()
+    except Exception as e:
+        # A failed step leaves that backend to initialize on first use.
+        logger.error(f"Warmup step '{name}' failed: {e}", exc_info=True)
+    timings[name] = round((time.perf_counter() - started) * 1000, 1)
+
+
+async def warm_up() -> Dict[str, Any]:
+    """
+    Loads the detector, creates (and, with CLIENT_WARMUP, connects) the service
+    clients and warms the decoders. Runs once per process; later calls return
+    the first run's step timings in milliseconds.
+    """
+    global _result
+    async with _lock:
+        if _result is not None:
+            return {**_result, "already_warm": True}
+        timings: Dict[str, float] = {}
+        started = time.perf_counter()
+        detector = None
+
+        async def load_detector_step():
+            nonlocal detector
+            detector = await run_in_threadpool(load_detector)
+            await run_in_threadpool(detector.warmup)
+
+        async def decoders_step():
+            if settings.DECODE_PROCESS_WORKERS > 0:
+                # Each worker runs warmup_decoders as its initializer.
+                await start_cpu_workers()
+            else:
+                await run_in_threadpool(warmup_decoders)
+
+        # The detector and the decoders are independent; the clients need the detector.
+        await asyncio.gather(
+            _timed(timings, "detector", load_detector_step),
+            _timed(timings, "decoders", decoders_step),
+        )
+        if detector is not None:
+            await _timed(timings, "clients", lambda: run_in_threadpool(start_service_clients, detector))
+        timings["total"] = round((time.perf_counter() - started) * 1000, 1)
+        logger.info(f"Warmup finished: {timings}")
+        _result = {"mode": settings.STARTUP_WARMUP, "timings_ms": timings}
+        return {**_result, "already_warm": False}
+
+
+async def startup() -> None:
+    """Lifespan hook: warms up now, in the background, or not at all, per STARTUP_WARMUP."""
+    global _background_task
+    mode = settings.STARTUP_WARMUP.lower()
+    if mode == "blocking":
+        await warm_up()
+    elif mode == "background":
+        _background_task = asyncio.create_task(warm_up())
+    elif mode != "off":
+        logger.warning(f"Unknown STARTUP_WARMUP '{settings.STARTUP_WARMUP}'; not warming up at startup.")
+
+
+async def shutdown() -> None:
+    global _background_task, _result
+    if _background_task is not None and not _background_task.done():
+        _background_task.cancel()
+    _background_task = None
+    _result = None
@@ -0,0 +1,128 @@
+"""
+Windowing of DICOM pixel data to 8-bit grayscale.
+
+Integer data of up to 16 bits is mapped through a precomputed uint8 lookup table
+(one entry per representable stored value), so the full-size work is a single
+gather with no float temporaries. LUTs are cached across requests, keyed by
+everything that affects the mapping. Other data goes through an in-place float32
+path.
+"""
+import functools
+from typing import Optional
+
+import numpy as np
+
+MONOCHROME1 = "MONOCHROME1"
+
+# Integer dtypes small enough for a full lookup table, and the unsigned dtype
+# with the same itemsize used to index it.
+_LUT_INDEX_DTYPES = {
+    np.dtype(np.uint8): np.dtype(np.uint8),
+    np.dtype(np.int8): np.dtype(np.uint8),
+    np.dtype(np.uint16): np.dtype(np.uint16),
+    np.dtype(np.int16): np.dtype(np.uint16),
+}
+
+
+def _scale_to_uint8(values: np.ndarray, lower: float, width: float) -> np.ndarray:
+    """Float64 reference mapping used to build LUTs: clip to the window, scale to 0-255, truncate."""
+    if width <= 0:
+        return np.zeros(values.shape, dtype=np.uint8)
+    scaled = (np.clip(values, lower, lower + width) - lower) / width * 255.0
+    if not np.all(np.isfinite(scaled)):
+        return np.zeros(values.shape, dtype=np.uint8)
+    return scaled.astype(np.uint8)
+
+
+@functools.lru_cache(maxsize=64)
+def get_window_lut(
+    dtype_str: str,
+    lower: float,
+    width: float,
+    slope: float,
+    intercept: float,
+    invert: bool,
+) -> np.ndarray:
+    """
+    Returns a read-only uint8 LUT indexed by the stored pixel value reinterpreted
+    as the unsigned dtype of the same size. `lower`/`width` are in modality units
+    (after RescaleSlope/Intercept).
+    """
+    dtype = np.dtype(dtype_str)
+    index_dtype = _LUT_INDEX_DTYPES[dtype]
+    stored_values = np.arange(2 ** (8 * dtype.itemsize), dtype=np.uint64).astype(index_dtype).view(dtype)
+    modality_values = stored_values.astype(np.float64) * slope + intercept
+    lut = _scale_to_uint8(modality_values, lower, width)
+    if invert:
+        lut = 255 - lut
+    lut.flags.writeable = False
+    return lut
+
+
+def _window_bounds(
+    pixel_array: np.ndarray,
+    window_center: Optional[float],
+    window_width: Optional[float],
+    slope: float,
+    intercept: float,
+):
+    """Window lower bound and width in modality units; falls back to the data's min/max."""
+    if window_center is not None and window_width is not None:
+        return window_center - window_width / 2, window_width
+    min_val = float(np.min(pixel_array)) * slope + intercept
+    max_val = float(np.max(pixel_array)) * slope + intercept
+    low, high = min(min_val, max_val), max(min_val, max_val)
+    return low, high - low
+
+
+def window_to_uint8(
+    pixel_array: np.ndarray,
+    window_center: Optional[float] = None,
+    window_width: Optional[float] = None,
+    slope: float = 1.0,
+    intercept: float = 0.0,
+    photometric_interpretation: str = "MONOCHROME2",
+) -> np.ndarray:
+    """
+    Maps stored pixel values to an 8-bit display image using the DICOM window
+    (or min/max of the data when no window is given), inverting MONOCHROME1.
+    """
+    if pixel_array.size == 0:
+        return np.zeros(pixel_array.shape, dtype=np.uint8)
+
+    lower, width = _window_bounds(pixel_array, window_center, window_width, slope, intercept)
+    invert = photometric_interpretation == MONOCHROME1
+
+    index_dtype = _LUT_INDEX_DTYPES.get(pixel_array.dtype)
+    if index_dtype is not None:
+        lut = get_window_lut(pixel_array.dtype.str, lower, width, slope, intercept, invert)
+        return lut[pixel_array.view(index_dtype)]
+
+    return _window_float32(pixel_array, lower, width, slope, intercept, invert)
+
+
+def _window_float32(
+    pixel_array: np.ndarray,
+    lower: float,
+    width: float,
+    slope: float,
+    intercept: float,
+    invert: bool,
+) -> np.ndarray:
+    """Fallback for float or wide integer data: one float32 working copy, modified in place."""
+    if width <= 0:
+        out = np.zeros(pixel_array.shape, dtype=np.uint8)
+    else:
+        work = pixel_array.astype(np.float32)
+        if slope != 1.0:
+            work *= np.float32(slope)
+        if intercept != 0.0:
+            work += np.float32(intercept)
+        np.clip(work, lower, lower + width, out=work)
+        work -= np.float32(lower)
+        work *= np.float32(255.0 / width)
+        np.nan_to_num(work, copy=False, nan=0.0, posinf=255.0, neginf=0.0)
+        out = work.astype(np.uint8)
+    if invert:
+        np.subtract(255, out, out=out)
+    return out
@@ -0,0 +1,70 @@
+"""
+Benchmark: per-request latency of a fresh HTTP client per call (the old
+behaviour) vs. the pooled keep-alive RoboflowClient, against a local stub whose
+per-connection delay models the TCP+TLS handshake to a remote API.
+
+Run from the backend directory:
+    python -m benchmarks.bench_client_pool [--requests 50] [--handshake-ms 60] [--json out.json]
+"""
+import argparse
+import time
+
+from PIL import Image
+
+from app.clients import RoboflowClient
+from benchmarks.results import write_results
+from benchmarks.stub_servers import StubRoboflowServer
+
+
+def _client(url: str) -> RoboflowClient:
+    return RoboflowClient(api_url=url, api_key="bench", model_id="bench/1", confidence=0.3, overlap=0.5, pool_size=4)
+
+
+def _measure(server: StubRoboflowServer, image: Image.Image, count: int, pooled: bool):
+    timings = []
+    shared = _client(server.url) if pooled else None
+    connections_before = server.connections
+    for _ in range(count):
+        client = shared or _client(server.url)
+        start = time.perf_counter()
+        client.infer(image)
+        timings.append(time.perf_counter() - start)
+        if not pooled:
+            client.close()
+    if shared is not None:
+        shared.close()
+    timings.sort()
+    return {
+        "mode": "pooled" if pooled else "fresh_client",
+        "requests": count,
+        "connections": server.connections - connections_before,
+        "median_ms": timings[len(timings) // 2] * 1000,
+        "p95_ms": timings[int(len(timings) * 0.95) - 1] * 1000,
+    }
+
+
+def run(count: int, handshake_ms: float):
+    image = Image.new("L", (1024, 768), color=128)
+    with StubRoboflowServer(handshake_delay=handshake_ms / 1000) as server:
+        return [_measure(server, image, count, pooled=False), _measure(server, image, count, pooled=True)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--handshake-ms", type=float, default=60.0)
+    parser.add_argument("--json", help="Write results to this file as JSON.")
+    args = parser.parse_args()
+
+    results = run(args.requests, args.handshake_ms)
+    print(f"{'mode':<14}{'requests':>10}{'connections':>13}{'median ms':>12}{'p95 ms':>10}")
+    for row in results:
+        print(f"{row['mode']:<14}{row['requests']:>10}{row['connections']:>13}{row['median_ms']:>12.1f}{row['p95_ms']:>10.1f}")
+    saved = results[0]["median_ms"] - results[1]["median_ms"]
+    print(f"Median latency saved per request by connection reuse: {saved:.1f} ms")
+    if args.json:
+        write_results(args.json, "client_pool", {"requests": args.requests, "handshake_ms": args.handshake_ms}, results)
+
+
+if __name__ == "__main__":
+    main()
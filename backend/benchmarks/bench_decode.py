@@ -0,0 +1,141 @@
+"""
+Micro-benchmark of the DICOM conversion path, convert_dicom_to_pil_and_base64,
+broken down by stage (dcmread, pixel_decode, windowing, png_encode, base64)
+over synthetic studies that vary size, bit depth, photometric interpretation,
+frame count and transfer syntax (see benchmarks.dicom_synth).
+
+Stage durations come from the same stage timers that feed /metrics.
+
+With --decoders it instead times app.decoding per compressed transfer syntax:
+every installed pydicom plugin on one frame, reduced-resolution decoding at
+--max-side, and a 4-frame study decoded serially and on --workers threads.
+
+Run from the backend directory:
+    python -m benchmarks.bench_decode [--sizes 1024x768,3000x2400] [--repeat 5] [--json out.json]
+    python -m benchmarks.bench_decode --decoders [--max-side 1024] [--workers 0] [--json out.json]
+"""
+import argparse
+import io
+import statistics
+import time
+from dataclasses import replace
+
+import pydicom
+
+from app.decoding import available_decoders, decode_frame, decode_frames, select_decoder
+from app.metrics import run_with_stage_timings
+from app.services import convert_dicom_to_pil_and_base64
+from benchmarks.dicom_synth import DicomSpec, make_dicom, parse_size, spec_matrix
+from benchmarks.results import write_results
+
+STAGES = ("dcmread", "pixel_decode", "windowing", "png_encode", "base64")
+
+
+def measure(dicom_bytes: bytes, repeat: int) -> dict:
+    per_stage = {stage: [] for stage in STAGES}
+    totals = []
+    convert_dicom_to_pil_and_base64(dicom_bytes)
+    for _ in range(repeat):
+        (_, _, error), timings = run_with_stage_timings(convert_dicom_to_pil_and_base64, dicom_bytes)
+        if error:
+            raise RuntimeError(error)
+        for stage, seconds, _ in timings:
+            if stage in per_stage:
+                per_stage[stage].append(seconds)
+        totals.append(sum(seconds for _, seconds, _ in timings))
+    row = {f"{stage}_ms": statistics.median(values) * 1000 for stage, values in per_stage.items() if values}
+    row["total_ms"] = statistics.median(totals) * 1000
+    return row
+
+
+def run(sizes, repeat: int):
+    results = []
+    for spec in spec_matrix(sizes):
+        data = make_dicom(spec)
+        results.append({"case": spec.name, "file_bytes": len(data), **measure(data, repeat)})
+    return results
+
+
+def _median_ms(fn, repeat: int) -> float:
+    fn()
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - started)
+    return statistics.median(durations) * 1000
+
+
+def run_decoders(sizes, repeat: int, max_side: int, workers: int):
+    """One row per (compressed case, plugin), plus reduced-resolution and multi-frame rows."""
+    results = []
+    for width, height in sizes:
+        for syntax, bits in (("rle", 12), ("jpeg2000", 12), ("jpeg_baseline", 8)):
+            spec = DicomSpec(width=width, height=height, bits_stored=bits, transfer_syntax=syntax)
+            ds = pydicom.dcmread(io.BytesIO(make_dicom(spec)))
+            transfer_syntax = ds.file_meta.TransferSyntaxUID
+            selected = select_decoder(transfer_syntax)
+            for plugin in available_decoders(transfer_syntax):
+                results.append({
+                    "case": f"{spec.name}:{plugin}",
+                    "selected": plugin == selected,
+                    "decode_ms": _median_ms(lambda: decode_frame(ds, decoding_plugin=plugin), repeat),
+                })
+            if max_side:
+                results.append({
+                    "case": f"{spec.name}:max_side_{max_side}",
+                    "shape": list(decode_frame(ds, max_side=max_side).shape),
+                    "decode_ms": _median_ms(lambda: decode_frame(ds, max_side=max_side), repeat),
+                })
+
+            frames = pydicom.dcmread(io.BytesIO(make_dicom(replace(spec, frames=4))))
+            serial_ms = _median_ms(lambda: decode_frames(frames, max_workers=1), repeat)
+            parallel_ms = _median_ms(lambda: decode_frames(frames, max_workers=workers), repeat)
+            results.append({
+                "case": f"{replace(spec, frames=4).name}:frames",
+                "serial_ms": serial_ms,
+                "parallel_ms": parallel_ms,
+                "parallel_speedup": serial_ms / parallel_ms,
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1024x768,3000x2400", help="Comma-separated WIDTHxHEIGHT list.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="Write results to this file as JSON.")
+    parser.add_argument("--decoders", action="store_true", help="Compare decoders instead of conversion stages.")
+    parser.add_argument("--max-side", type=int, default=1024, help="Reduced-resolution target (--decoders).")
+    parser.add_argument("--workers", type=int, default=0, help="Threads for multi-frame decode, 0 = CPUs (--decoders).")
+    args = parser.parse_args()
+
+    sizes = [parse_size(size) for size in args.sizes.split(",")]
+    if args.decoders:
+        results = run_decoders(sizes, args.repeat, args.max_side, args.workers)
+        for row in results:
+            if "parallel_ms" in row:
+                print(
+                    f"{row['case']:<56} serial {row['serial_ms']:9.1f} ms  parallel {row['parallel_ms']:9.1f} ms"
+                    f"  ({row['parallel_speedup']:.2f}x)"
+                )
+            else:
+                marker = " (selected)" if row.get("selected") else ""
+                print(f"{row['case']:<56} {row['decode_ms']:9.1f} ms{marker}")
+        if args.json:
+            config = {"sizes": args.sizes, "repeat": args.repeat, "max_side": args.max_side, "workers": args.workers}
+            write_results(args.json, "decoders", config, results)
+        return
+
+    results = run(sizes, args.repeat)
+    header = "".join(f"{stage:>14}" for stage in STAGES)
+    print(f"{'case':<48}{'bytes':>12}{header}{'total':>10}   (median ms)")
+    for row in results:
+        stages = "".join(f"{row.get(f'{stage}_ms', 0.0):>14.1f}" for stage in STAGES)
+        print(f"{row['case']:<48}{row['file_bytes']:>12,}{stages}{row['total_ms']:>10.1f}")
+    if args.json:
+        write_results(args.json, "decode", {"sizes": args.sizes, "repeat": args.repeat}, results)
+
+
+if __name__ == "__main__":
+    main()
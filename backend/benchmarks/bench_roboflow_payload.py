@@ -0,0 +1,99 @@
+"""
+Benchmark: bytes on the wire and end-to-end latency of one Roboflow request
+when uploading the full-resolution radiograph (the previous behaviour:
+RGB JPEG at quality 75) vs. downscaling to the model input size first.
+
+Latency is measured against the local Roboflow stub with a simulated uplink,
+so upload time scales with the payload as it would to the hosted API.
+
+Run from the backend directory:
+    python -m benchmarks.bench_roboflow_payload [--dicom ../sample_data/IM-0002-0000.dcm]
+        [--uplink-mbps 20] [--repeat 5] [--json out.json]
+"""
+import argparse
+import base64
+import io
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+from app.clients import RoboflowClient
+from app.services import convert_dicom_to_pil_and_png
+from benchmarks.results import write_results
+from benchmarks.stub_servers import StubRoboflowServer
+
+DEFAULT_DICOM = os.path.join(os.path.dirname(__file__), "..", "..", "sample_data", "IM-0002-0000.dcm")
+
+
+class LegacyPayloadClient(RoboflowClient):
+    """Encodes like inference-sdk did: full resolution, RGB, JPEG quality 75."""
+
+    def prepare_image(self, pil_image):
+        buffered = io.BytesIO()
+        pil_image.convert("RGB").save(buffered, format="JPEG")
+        return base64.b64encode(buffered.getvalue()).decode("ascii"), 1.0
+
+
+def load_image(dicom_path: str) -> Image.Image:
+    if dicom_path and os.path.exists(dicom_path):
+        with open(dicom_path, "rb") as f:
+            pil_image, _, error = convert_dicom_to_pil_and_png(f.read())
+        if pil_image is not None:
+            return pil_image
+        print(f"Could not decode {dicom_path} ({error}); using a synthetic radiograph.")
+    rng = np.random.default_rng(0)
+    gradient = np.linspace(40, 200, 3000, dtype=np.float32)[None, :] + rng.normal(0, 12, (2400, 3000))
+    return Image.fromarray(np.clip(gradient, 0, 255).astype(np.uint8))
+
+
+def run(image: Image.Image, uplink_mbps: float, repeat: int):
+    configurations = [
+        ("full_res_jpeg75 (before)", LegacyPayloadClient, {}),
+        ("640_jpeg90", RoboflowClient, {"input_size": 640, "image_format": "jpeg", "jpeg_quality": 90}),
+        ("640_png", RoboflowClient, {"input_size": 640, "image_format": "png"}),
+    ]
+    results = []
+    with StubRoboflowServer(uplink_bps=uplink_mbps * 1_000_000) as server:
+        for name, client_class, options in configurations:
+            client = client_class(
+                api_url=server.url, api_key="bench", model_id="bench/1", confidence=0.3, overlap=0.5, **options
+            )
+            client.infer(image)
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                client.infer(image)
+                timings.append(time.perf_counter() - start)
+            client.close()
+            timings.sort()
+            results.append({
+                "configuration": name,
+                "bytes_on_wire": server.requests[-1]["body_bytes"],
+                "median_ms": timings[len(timings) // 2] * 1000,
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dicom", default=DEFAULT_DICOM)
+    parser.add_argument("--uplink-mbps", type=float, default=20.0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="Write results to this file as JSON.")
+    args = parser.parse_args()
+
+    image = load_image(args.dicom)
+    print(f"Image {image.width}x{image.height}, simulated uplink {args.uplink_mbps:g} Mbit/s")
+    results = run(image, args.uplink_mbps, args.repeat)
+    print(f"{'configuration':<28}{'bytes on wire':>15}{'median ms':>12}")
+    for row in results:
+        print(f"{row['configuration']:<28}{row['bytes_on_wire']:>15,}{row['median_ms']:>12.1f}")
+    if args.json:
+        config = {"image_size": list(image.size), "uplink_mbps": args.uplink_mbps, "repeat": args.repeat}
+        write_results(args.json, "roboflow_payload", config, results)
+
+
+if __name__ == "__main__":
+    main()
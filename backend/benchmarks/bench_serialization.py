@@ -0,0 +1,128 @@
+"""
+Micro-benchmark of encoding a DiagnosisResponse, by number of boxes and with
+or without an inlined image, for each way the API can produce the body:
+
+    jsonable_encoder  FastAPI's encoder plus json.dumps (FastAPI before the
+                      dump_json fast path, or with a custom response class)
+    fastapi           what FastAPI does for a response_model now: validate the
+                      returned model, then dump it to JSON with Pydantic
+    orjson            app.serialization, JSON
+    msgpack           app.serialization, MessagePack with the image as raw bytes
+and the last two again with columnar annotations. Each row gives the median
+encode time and the body size; "decode_ms" is the time a Python client needs
+to parse the body back (json.loads / msgpack.unpackb).
+
+Run from the backend directory:
+    python -m benchmarks.bench_serialization [--boxes 10,100,1000] [--image-bytes 2000000] [--repeat 50] [--json out.json]
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import statistics
+import time
+
+import msgpack
+from fastapi.encoders import jsonable_encoder
+from fastapi.routing import serialize_response
+
+from app.main import app
+from app.models import DiagnosisResponse, RoboflowPrediction
+from app.serialization import JSON_MEDIA_TYPE, MSGPACK_MEDIA_TYPE, encode_diagnosis
+from benchmarks.results import write_results
+
+CLASSES = ("caries", "calculus", "periapical lesion", "impacted tooth", "filling")
+
+
+def make_response(boxes: int, image_png: bytes) -> DiagnosisResponse:
+    annotations = [
+        RoboflowPrediction(
+            x=100.5 + i, y=200.25 + i, width=40.0 + i % 7, height=30.0 + i % 5,
+            confidence=0.5 + (i % 50) / 100, **{"class": CLASSES[i % len(CLASSES)]}
+        )
+        for i in range(boxes)
+    ]
+    return DiagnosisResponse(
+        image_filename="study.dcm",
+        image_id="0123456789abcdef",
+        image_width=3000,
+        image_height=2400,
+        converted_image_base64=base64.b64encode(image_png).decode("ascii") if image_png else "",
+        annotations=annotations,
+        diagnostic_report="Findings: radiolucent lesions consistent with caries. " * 10,
+    )
+
+
+def _median_ms(fn, repeat: int) -> float:
+    fn()
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times) * 1000
+
+
+def encoders(response: DiagnosisResponse, image_png: bytes):
+    """(name, encode function, decode function) for each path."""
+    field = next(route for route in app.routes if getattr(route, "path", "") == "/api/diagnose").response_field
+    loop = asyncio.new_event_loop()
+    # MessagePack sends the image as bytes, so its response is built without the base64 copy.
+    binary_response = response.model_copy(update={"converted_image_base64": ""})
+    binary_image = image_png or None
+
+    def fastapi_dump_json() -> bytes:
+        return loop.run_until_complete(
+            serialize_response(field=field, response_content=response, dump_json=True)
+        )
+
+    return [
+        ("jsonable_encoder", lambda: json.dumps(jsonable_encoder(response)).encode("utf-8"), json.loads),
+        ("fastapi", fastapi_dump_json, json.loads),
+        ("orjson", lambda: encode_diagnosis(response, JSON_MEDIA_TYPE).body, json.loads),
+        ("orjson_columnar", lambda: encode_diagnosis(response, JSON_MEDIA_TYPE, True).body, json.loads),
+        ("msgpack", lambda: encode_diagnosis(binary_response, MSGPACK_MEDIA_TYPE, False, binary_image).body,
+         msgpack.unpackb),
+        ("msgpack_columnar", lambda: encode_diagnosis(binary_response, MSGPACK_MEDIA_TYPE, True, binary_image).body,
+         msgpack.unpackb),
+    ]
+
+
+def run(box_counts, image_bytes: int, repeat: int):
+    results = []
+    for image_size in sorted({0, image_bytes}):
+        # Random bytes stand in for a PNG: compressed image data does not compress further.
+        image_png = os.urandom(image_size)
+        for boxes in box_counts:
+            response = make_response(boxes, image_png)
+            for name, encode, decode in encoders(response, image_png):
+                body = encode()
+                results.append({
+                    "case": f"{boxes}boxes_{'image' if image_size else 'noimage'}_{name}",
+                    "encode_ms": _median_ms(encode, repeat),
+                    "decode_ms": _median_ms(lambda: decode(body), repeat),
+                    "body_bytes": len(body),
+                })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--boxes", default="10,100,1000", help="Comma-separated box counts.")
+    parser.add_argument("--image-bytes", type=int, default=2_000_000, help="Size of the inlined PNG (0 = none).")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--json", help="Write results to this file as JSON.")
+    args = parser.parse_args()
+
+    box_counts = [int(count) for count in args.boxes.split(",")]
+    results = run(box_counts, args.image_bytes, args.repeat)
+    print(f"{'case':<45} {'encode ms':>10} {'decode ms':>10} {'bytes':>10}")
+    for row in results:
+        print(f"{row['case']:<45} {row['encode_ms']:>10.3f} {row['decode_ms']:>10.3f} {row['body_bytes']:>10}")
+    if args.json:
+        write_results(args.json, "bench_serialization", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Cold-start benchmark: what importing the app costs, and how long a fresh
+process takes to answer.
+
+Part 1 runs `python -X importtime -c "import app.main"` in a fresh interpreter
+and reports the total import time and the heaviest top-level packages.
+
+Part 2 starts the app under uvicorn against the stub services once per
+STARTUP_WARMUP mode and measures, from process launch, the time until it
+accepts connections (GET /) and the time until the first POST /api/diagnose
+succeeds. "blocking" pays for the detector, clients and decoders before
+accepting connections; "background" accepts at once and warms up alongside;
+"off" leaves it all to the first request.
+
+Run from the backend directory:
+    python -m benchmarks.bench_startup [--runs 3] [--modes blocking,background,off] [--json out.json]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+import requests
+
+from benchmarks.dicom_synth import make_dicom
+from benchmarks.load_test import BACKEND_DIR, start_app
+from benchmarks.results import write_results
+from benchmarks.stub_servers import StubGeminiServer, StubRoboflowServer
+
+
+def import_breakdown(module: str = "app.main", top: int = 10) -> Tuple[float, List[Tuple[str, float]]]:
+    """(total ms, [(top-level package, cumulative ms)]) for importing `module` in a fresh interpreter."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+    )
+    own_package = module.split(".")[0]
+    packages: Dict[str, float] = {}
+    total_us = 0.0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        if not cumulative.isdigit():
+            continue
+        root = name.split(".")[0]
+        if name == module:
+            total_us = int(cumulative)
+        elif root != own_package:
+            # A package's own top-level entry is the largest and includes its submodules.
+            packages[root] = max(packages.get(root, 0.0), int(cumulative) / 1000)
+    heaviest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+    return total_us / 1000, heaviest
+
+
+def time_to_first_request(mode: str, roboflow_url: str, gemini_url: str, payload: bytes, timeout: float) -> Dict[str, float]:
+    launched = time.perf_counter()
+    process, url = start_app(roboflow_url, gemini_url, 1, False, extra_env={"STARTUP_WARMUP": mode})
+    ready = time.perf_counter()
+    try:
+        with requests.Session() as session:
+            while True:
+                files = {"file": ("startup.dcm", payload, "application/octet-stream")}
+                response = session.post(url + "/api/diagnose", files=files, timeout=timeout)
+                if response.ok and not response.json().get("error"):
+                    break
+                if time.perf_counter() - launched > timeout:
+                    raise RuntimeError(f"No successful diagnosis within {timeout}s (last status {response.status_code}).")
+                time.sleep(0.05)
+        first = time.perf_counter()
+    finally:
+        process.terminate()
+        process.wait(10)
+    return {"ready_ms": (ready - launched) * 1000, "first_diagnosis_ms": (first - launched) * 1000}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="App launches per mode (median reported).")
+    parser.add_argument("--modes", default="blocking,background,off")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--json", help="Write results to this file as JSON.")
+    args = parser.parse_args()
+
+    total_ms, heaviest = import_breakdown()
+    print(f"import app.main: {total_ms:.0f} ms")
+    for package, ms in heaviest:
+        print(f"  {package:<28} {ms:8.1f} ms")
+
+    payload = make_dicom(width=640, height=480)
+    modes = []
+    with StubRoboflowServer() as roboflow, StubGeminiServer() as gemini:
+        for mode in args.modes.split(","):
+            runs = [
+                time_to_first_request(mode, roboflow.url, gemini.url, payload, args.timeout) for _ in range(args.runs)
+            ]
+            row = {
+                "mode": mode,
+                "ready_ms": statistics.median(run["ready_ms"] for run in runs),
+                "first_diagnosis_ms": statistics.median(run["first_diagnosis_ms"] for run in runs),
+            }
+            modes.append(row)
+            print(
+                f"STARTUP_WARMUP={mode:<10} ready {row['ready_ms']:7.0f} ms, "
+                f"first diagnosis {row['first_diagnosis_ms']:7.0f} ms"
+            )
+
+    if args.json:
+        results = {
+            "import_ms": total_ms,
+            "import_packages_ms": dict(heaviest),
+            "modes": modes,
+        }
+        write_results(args.json, "startup", {"runs": args.runs, "modes": args.modes}, results)
+
+
+if __name__ == "__main__":
+    main()
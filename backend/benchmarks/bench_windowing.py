@@ -0,0 +1,103 @@
+"""
+Micro-benchmark: LUT windowing engine vs. the previous float64 implementation.
+
+Run from the backend directory:
+    python -m benchmarks.bench_windowing [--sizes 1024 3000 4000] [--repeat 10] [--json out.json]
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+from app.windowing import get_window_lut, window_to_uint8
+from benchmarks.results import write_results
+
+
+def legacy_window(pixel_array, window_center, window_width, photometric):
+    """The float64 windowing path that used to live in convert_dicom_to_pil_and_base64."""
+    if window_center is not None and window_width is not None:
+        lower_bound = window_center - window_width / 2
+        upper_bound = window_center + window_width / 2
+        pixel_array_processed = np.clip(pixel_array, lower_bound, upper_bound)
+        normalized_array = ((pixel_array_processed - lower_bound) / window_width) * 255.0
+    else:
+        min_val = np.min(pixel_array)
+        max_val = np.max(pixel_array)
+        normalized_array = ((pixel_array - min_val) / (max_val - min_val)) * 255.0
+    np.all(np.isfinite(normalized_array))
+    pil_image = Image.fromarray(normalized_array.astype(np.uint8))
+    if photometric == "MONOCHROME1":
+        pil_image = Image.eval(pil_image, lambda x: 255 - x)
+    return np.asarray(pil_image)
+
+
+def _measure(fn, repeat):
+    fn()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "median_ms": sorted(timings)[len(timings) // 2] * 1000,
+        "min_ms": min(timings) * 1000,
+        "peak_mb": peak / (1024 * 1024),
+    }
+
+
+def run(sizes, repeat):
+    rng = np.random.default_rng(0)
+    results = []
+    for size in sizes:
+        for dtype, bits in ((np.uint16, 12), (np.int16, 12), (np.float32, None)):
+            if bits is not None:
+                high = 2 ** bits
+                array = rng.integers(0, high, size=(size, size)).astype(dtype)
+            else:
+                array = rng.random((size, size), dtype=np.float32) * 4095
+            for photometric in ("MONOCHROME2", "MONOCHROME1"):
+                get_window_lut.cache_clear()
+                legacy = _measure(lambda: legacy_window(array, 2048.0, 4096.0, photometric), repeat)
+                current = _measure(
+                    lambda: window_to_uint8(array, 2048.0, 4096.0, photometric_interpretation=photometric),
+                    repeat,
+                )
+                results.append({
+                    "case": f"{size}/{np.dtype(dtype).name}/{photometric}",
+                    "size": size,
+                    "dtype": np.dtype(dtype).name,
+                    "photometric": photometric,
+                    "legacy": legacy,
+                    "lut": current,
+                    "speedup": legacy["median_ms"] / current["median_ms"],
+                })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1024, 3000])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--json", dest="json_path")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.repeat)
+    print(f"{'size':>6} {'dtype':>8} {'photometric':>12} {'legacy ms':>10} {'lut ms':>8} {'speedup':>8} {'legacy MB':>10} {'lut MB':>8}")
+    for r in results:
+        print(
+            f"{r['size']:>6} {r['dtype']:>8} {r['photometric']:>12} "
+            f"{r['legacy']['median_ms']:>10.1f} {r['lut']['median_ms']:>8.1f} {r['speedup']:>7.1f}x "
+            f"{r['legacy']['peak_mb']:>10.1f} {r['lut']['peak_mb']:>8.1f}"
+        )
+    if args.json_path:
+        write_results(args.json_path, "windowing", {"sizes": args.sizes, "repeat": args.repeat}, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+Synthetic intraoral radiographs as DICOM, for tests and benchmarks.
+
+Covers the axes that change decode cost: image size, bit depth, MONOCHROME1
+vs. MONOCHROME2, multi-frame and the transfer syntax (uncompressed, deflated,
+RLE, JPEG 2000, 8-bit JPEG baseline). Pixel content is a smooth exposure
+gradient with bright "teeth", a few dark lesions and sensor noise, so
+compressed sizes resemble real studies rather than flat test patterns. Output
+is deterministic per seed.
+
+Write a corpus from the backend directory:
+    python -m benchmarks.dicom_synth --out /tmp/dicom-corpus [--sizes 1024x768,3000x2400]
+"""
+import argparse
+import io
+import os
+from dataclasses import dataclass, replace
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+import pydicom
+from pydicom.dataset import Dataset, FileMetaDataset
+from PIL import Image
+from pydicom.encaps import encapsulate
+from pydicom.uid import (
+    DeflatedExplicitVRLittleEndian,
+    ExplicitVRLittleEndian,
+    JPEG2000Lossless,
+    JPEGBaseline8Bit,
+    RLELossless,
+    generate_uid,
+)
+
+TRANSFER_SYNTAXES = {
+    "explicit_le": ExplicitVRLittleEndian,
+    "deflate": DeflatedExplicitVRLittleEndian,
+    "rle": RLELossless,
+    "jpeg2000": JPEG2000Lossless,
+    # 8-bit only; pydicom has no JPEG encoder, so frames are encoded with Pillow.
+    "jpeg_baseline": JPEGBaseline8Bit,
+}
+JPEG_QUALITY = 90
+# Digital X-ray Image Storage - For Presentation.
+DX_SOP_CLASS = "1.2.840.10008.5.1.4.1.1.1.1"
+
+
+@dataclass(frozen=True)
+class DicomSpec:
+    width: int = 1024
+    height: int = 768
+    bits_stored: int = 12
+    photometric: str = "MONOCHROME2"
+    frames: int = 1
+    transfer_syntax: str = "explicit_le"
+    window: bool = True
+    seed: int = 0
+
+    @property
+    def bits_allocated(self) -> int:
+        return 8 if self.bits_stored <= 8 else 16
+
+    @property
+    def name(self) -> str:
+        return (
+            f"{self.width}x{self.height}_{self.bits_stored}bit_{self.photometric.lower()}"
+            f"_{self.frames}f_{self.transfer_syntax}"
+        )
+
+
+def synthetic_radiograph(width: int, height: int, bits_stored: int, seed: int = 0) -> np.ndarray:
+    """A (height, width) array of stored values in [0, 2**bits_stored) where higher means more attenuation."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    image = 0.15 + 0.25 * (x / max(width - 1, 1)) + 0.1 * (y / max(height - 1, 1))
+
+    # A row of teeth: bright vertical ellipses with darker pulp canals.
+    teeth = 5
+    for index in range(teeth):
+        cx = width * (index + 0.5) / teeth + rng.normal(0, width * 0.01)
+        cy = height * 0.5
+        rx, ry = width / teeth * 0.38, height * 0.4
+        inside = ((x - cx) / rx) ** 2 + ((y - cy) / ry) ** 2 <= 1
+        image[inside] += 0.45
+        canal = ((x - cx) / (rx * 0.15)) ** 2 + ((y - cy) / (ry * 0.8)) ** 2 <= 1
+        image[canal] -= 0.2
+
+    # Dark, lesion-like spots.
+    for _ in range(3):
+        cx, cy = rng.uniform(0.1, 0.9) * width, rng.uniform(0.2, 0.8) * height
+        radius = rng.uniform(0.01, 0.03) * min(width, height)
+        image[(x - cx) ** 2 + (y - cy) ** 2 <= radius ** 2] -= 0.25
+
+    image += rng.normal(0, 0.02, image.shape).astype(np.float32)
+    max_value = 2 ** bits_stored - 1
+    return np.clip(image, 0, 1) * max_value
+
+
+def make_dataset(spec: DicomSpec) -> Dataset:
+    dtype = np.uint8 if spec.bits_allocated == 8 else np.uint16
+    frames = [synthetic_radiograph(spec.width, spec.height, spec.bits_stored, spec.seed + i) for i in range(spec.frames)]
+    pixels = np.stack(frames) if spec.frames > 1 else frames[0]
+    if spec.photometric == "MONOCHROME1":
+        # MONOCHROME1 stores inverted values: low means bright.
+        pixels = (2 ** spec.bits_stored - 1) - pixels
+    pixels = pixels.astype(dtype)
+
+    file_meta = FileMetaDataset()
+    file_meta.MediaStorageSOPClassUID = DX_SOP_CLASS
+    file_meta.MediaStorageSOPInstanceUID = generate_uid(entropy_srcs=[spec.name, str(spec.seed)])
+    file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+    ds = Dataset()
+    ds.file_meta = file_meta
+    ds.SOPClassUID = DX_SOP_CLASS
+    ds.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
+    ds.StudyInstanceUID = generate_uid(entropy_srcs=["study", str(spec.seed)])
+    ds.SeriesInstanceUID = generate_uid(entropy_srcs=["series", str(spec.seed)])
+    ds.Modality = "IO"
+    ds.PatientName = "Synthetic^Patient"
+    ds.PatientID = f"SYNTH{spec.seed:04d}"
+    ds.Rows = spec.height
+    ds.Columns = spec.width
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = spec.photometric
+    ds.BitsAllocated = spec.bits_allocated
+    ds.BitsStored = spec.bits_stored
+    ds.HighBit = spec.bits_stored - 1
+    ds.PixelRepresentation = 0
+    if spec.frames > 1:
+        ds.NumberOfFrames = spec.frames
+    if spec.window:
+        max_value = 2 ** spec.bits_stored - 1
+        center = round(max_value * 0.55)
+        # The window applies to stored values, which MONOCHROME1 inverts.
+        ds.WindowCenter = max_value - center if spec.photometric == "MONOCHROME1" else center
+        ds.WindowWidth = round(max_value * 0.8)
+    ds.RescaleSlope = 1
+    ds.RescaleIntercept = 0
+    ds.PixelData = pixels.tobytes()
+
+    transfer_syntax = TRANSFER_SYNTAXES[spec.transfer_syntax]
+    if transfer_syntax == JPEGBaseline8Bit:
+        if spec.bits_allocated != 8:
+            raise ValueError("JPEG baseline needs 8-bit pixels.")
+        encoded = []
+        for frame in pixels.reshape(spec.frames, spec.height, spec.width):
+            buffer = io.BytesIO()
+            Image.fromarray(frame).save(buffer, format="JPEG", quality=JPEG_QUALITY)
+            encoded.append(buffer.getvalue())
+        ds.PixelData = encapsulate(encoded)
+        ds["PixelData"].VR = "OB"
+        ds.LossyImageCompression = "01"
+        ds.file_meta.TransferSyntaxUID = transfer_syntax
+    elif transfer_syntax.is_compressed:
+        ds.compress(transfer_syntax, pixels)
+    else:
+        ds.file_meta.TransferSyntaxUID = transfer_syntax
+    return ds
+
+
+def make_dicom(spec: Optional[DicomSpec] = None, **kwargs) -> bytes:
+    """Encodes a synthetic radiograph as DICOM file bytes; keyword arguments override DicomSpec fields."""
+    spec = replace(spec or DicomSpec(), **kwargs)
+    buffer = io.BytesIO()
+    pydicom.dcmwrite(buffer, make_dataset(spec), enforce_file_format=True)
+    return buffer.getvalue()
+
+
+def parse_size(text: str) -> Tuple[int, int]:
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def spec_matrix(sizes: List[Tuple[int, int]]) -> Iterator[DicomSpec]:
+    """The variants the decode benchmark covers, varying one axis at a time from a 12-bit baseline."""
+    for width, height in sizes:
+        base = DicomSpec(width=width, height=height)
+        yield base
+        yield replace(base, bits_stored=8)
+        yield replace(base, bits_stored=16)
+        yield replace(base, photometric="MONOCHROME1")
+        yield replace(base, frames=4)
+        for syntax in ("deflate", "rle", "jpeg2000"):
+            yield replace(base, transfer_syntax=syntax)
+        yield replace(base, bits_stored=8, transfer_syntax="jpeg_baseline")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", required=True, help="Directory to write the .dcm files to.")
+    parser.add_argument("--sizes", default="1024x768,3000x2400", help="Comma-separated WIDTHxHEIGHT list.")
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    for spec in spec_matrix([parse_size(size) for size in args.sizes.split(",")]):
+        path = os.path.join(args.out, f"{spec.name}.dcm")
+        data = make_dicom(spec)
+        with open(path, "wb") as f:
+            f.write(data)
+        print(f"{path}: {len(data):,} bytes")
+
+
+if __name__ == "__main__":
+    main()
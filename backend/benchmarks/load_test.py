@@ -0,0 +1,244 @@
+"""
+Load generator for POST /api/diagnose. Reports throughput, latency
+percentiles, errors by status and the server's per-stage Server-Timing
+breakdown. With --stream it drives POST /api/diagnose/stream instead and also
+reports the time to the first piece of report text, which is what a user
+watching the report appear waits for.
+
+By default it starts everything locally: stub Roboflow and Gemini servers with
+the given latency and error rate, and the app under uvicorn pointed at them,
+with the result and report caches off so every request runs the whole
+pipeline. Requests cycle through a few distinct synthetic studies. Pass --url
+to drive an already running server instead; it then uses whatever services
+and caches that server is configured with.
+
+Run from the backend directory:
+    python -m benchmarks.load_test [--concurrency 8] [--requests 200] [--size 1024x768]
+        [--roboflow-ms 150] [--gemini-ms 800] [--gemini-chunk-ms 0] [--error-rate 0.0] [--server-workers 1]
+        [--url http://host:8000] [--stream] [--server-logs] [--json out.json]
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+import requests
+
+from benchmarks.dicom_synth import make_dicom, parse_size
+from benchmarks.results import latency_summary, write_results
+from benchmarks.stub_servers import StubGeminiServer, StubRoboflowServer
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_app(
+    roboflow_url: str,
+    gemini_url: str,
+    workers: int,
+    show_logs: bool,
+    extra_env: Optional[Dict[str, str]] = None,
+) -> "tuple[subprocess.Popen, str]":
+    port = _free_port()
+    env = {
+        **os.environ,
+        "ROBOFLOW_API_URL": roboflow_url,
+        "ROBOFLOW_API_KEY": "bench",
+        "ROBOFLOW_MODEL_ID": "bench/1",
+        "DETECTOR_BACKEND": "roboflow",
+        "GEMINI_API_KEY": "bench",
+        "GEMINI_API_ENDPOINT": gemini_url,
+        "RESULT_CACHE_ENABLED": "false",
+        "REPORT_CACHE_ENABLED": "false",
+        "SERVER_TIMING_ENABLED": "true",
+        "JOB_WORKERS": "0",
+        **(extra_env or {}),
+    }
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=env,
+        stdout=None if show_logs else subprocess.DEVNULL,
+        stderr=None if show_logs else subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with code {process.returncode}; rerun with --server-logs to see why.")
+        try:
+            requests.get(url + "/", timeout=1)
+            return process, url
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("The app did not start within 60 seconds.")
+
+
+def parse_server_timing(header: Optional[str]) -> Dict[str, float]:
+    timings = {}
+    for entry in (header or "").split(","):
+        name, _, params = entry.strip().partition(";")
+        if params.startswith("dur="):
+            timings[name] = float(params[4:])
+    return timings
+
+
+def _post_stream(session: requests.Session, url: str, files: dict, timeout: float, start: float) -> "tuple[str, Optional[float]]":
+    """Reads a /api/diagnose/stream response; returns its status and the seconds to the first report_chunk."""
+    with session.post(url + "/api/diagnose/stream", files=files, timeout=timeout, stream=True) as response:
+        if not response.ok:
+            return str(response.status_code), None
+        status, first_chunk, event = "200", None, ""
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event: "):
+                event = line[7:]
+                if event == "report_chunk" and first_chunk is None:
+                    first_chunk = time.perf_counter() - start
+                elif event == "error":
+                    status = "200_with_error"
+            elif line.startswith("data: ") and event == "diagnosis" and '"error":null' not in line:
+                status = "200_with_error"
+        return status, first_chunk
+
+
+def drive(url: str, payloads: List[bytes], concurrency: int, total: int, timeout: float, stream: bool = False) -> dict:
+    """Closed-loop load: `concurrency` clients each send their next request as soon as the previous one returns."""
+    latencies: List[float] = []
+    first_chunks: List[float] = []
+    statuses: Counter = Counter()
+    stage_ms: Dict[str, List[float]] = {}
+    lock = threading.Lock()
+    issued = iter(range(total))
+
+    def client():
+        session = requests.Session()
+        while True:
+            with lock:
+                index = next(issued, None)
+            if index is None:
+                break
+            files = {"file": (f"load-{index}.dcm", payloads[index % len(payloads)], "application/octet-stream")}
+            start = time.perf_counter()
+            first_chunk = None
+            try:
+                if stream:
+                    status, first_chunk = _post_stream(session, url, files, timeout, start)
+                    timings = {}
+                else:
+                    response = session.post(url + "/api/diagnose", files=files, timeout=timeout)
+                    status = str(response.status_code)
+                    if response.ok and response.json().get("error"):
+                        status = "200_with_error"
+                    timings = parse_server_timing(response.headers.get("Server-Timing"))
+            except requests.RequestException as e:
+                status, timings = type(e).__name__, {}
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] += 1
+                if first_chunk is not None:
+                    first_chunks.append(first_chunk)
+                for stage, ms in timings.items():
+                    stage_ms.setdefault(stage, []).append(ms)
+        session.close()
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    ok = statuses.get("200", 0)
+    results = {
+        "requests": len(latencies),
+        "wall_seconds": wall,
+        "throughput_rps": len(latencies) / wall,
+        "ok_throughput_rps": ok / wall,
+        "errors": len(latencies) - ok,
+        "statuses": dict(statuses),
+        "latency": latency_summary(latencies),
+        "server_stages_p50_ms": {stage: statistics.median(values) for stage, values in sorted(stage_ms.items())},
+    }
+    if stream:
+        results["time_to_first_token"] = latency_summary(first_chunks)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Drive this server instead of starting one with stub services.")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=5, help="Requests sent before measuring.")
+    parser.add_argument("--size", default="1024x768", help="WIDTHxHEIGHT of the synthetic studies.")
+    parser.add_argument("--studies", type=int, default=4, help="Distinct synthetic studies to cycle through.")
+    parser.add_argument("--roboflow-ms", type=float, default=150.0)
+    parser.add_argument("--gemini-ms", type=float, default=800.0)
+    parser.add_argument("--gemini-chunk-ms", type=float, default=0.0, help="Delay between streamed report chunks.")
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of stub responses that fail with 503.")
+    parser.add_argument("--server-workers", type=int, default=1)
+    parser.add_argument("--stream", action="store_true", help="Use /api/diagnose/stream and measure time to first token.")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--server-logs", action="store_true", help="Show the local server's log output.")
+    parser.add_argument("--json", help="Write results to this file as JSON.")
+    args = parser.parse_args()
+
+    width, height = parse_size(args.size)
+    payloads = [make_dicom(width=width, height=height, seed=seed) for seed in range(args.studies)]
+    config = {key: value for key, value in vars(args).items() if key not in ("json", "server_logs")}
+
+    if args.url:
+        drive(args.url, payloads, args.concurrency, args.warmup, args.timeout, args.stream)
+        results = drive(args.url, payloads, args.concurrency, args.requests, args.timeout, args.stream)
+    else:
+        stub_options = {"jitter": args.jitter_ms / 1000, "error_rate": args.error_rate}
+        with StubRoboflowServer(response_delay=args.roboflow_ms / 1000, **stub_options) as roboflow, \
+                StubGeminiServer(
+                    response_delay=args.gemini_ms / 1000, stream_chunk_delay=args.gemini_chunk_ms / 1000, **stub_options
+                ) as gemini:
+            process, url = start_app(roboflow.url, gemini.url, args.server_workers, args.server_logs)
+            try:
+                drive(url, payloads, args.concurrency, args.warmup, args.timeout, args.stream)
+                results = drive(url, payloads, args.concurrency, args.requests, args.timeout, args.stream)
+            finally:
+                process.terminate()
+                process.wait(10)
+
+    latency = results["latency"]
+    print(
+        f"{results['requests']} requests in {results['wall_seconds']:.1f}s at concurrency {args.concurrency}: "
+        f"{results['throughput_rps']:.1f} req/s, errors {results['errors']} {results['statuses']}"
+    )
+    print(
+        f"latency p50 {latency['p50_ms']:.0f} ms, p95 {latency['p95_ms']:.0f} ms, "
+        f"p99 {latency['p99_ms']:.0f} ms, max {latency['max_ms']:.0f} ms"
+    )
+    if results.get("time_to_first_token"):
+        ttft = results["time_to_first_token"]
+        print(f"time to first token p50 {ttft['p50_ms']:.0f} ms, p95 {ttft['p95_ms']:.0f} ms, p99 {ttft['p99_ms']:.0f} ms")
+    if results["server_stages_p50_ms"]:
+        print("server stages (p50 ms): " + ", ".join(
+            f"{stage} {ms:.1f}" for stage, ms in results["server_stages_p50_ms"].items()
+        ))
+    if args.json:
+        write_results(args.json, "load_test", config, results)
+
+
+if __name__ == "__main__":
+    main()
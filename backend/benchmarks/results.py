@@ -0,0 +1,152 @@
+"""
+Common JSON format for benchmark results, and a comparison between two runs.
+
+Every benchmark's --json output records the benchmark name, its configuration,
+the results and the environment (git commit, Python, platform), so files from
+different commits can be compared:
+    python -m benchmarks.results before.json after.json [--threshold 0.1]
+
+The comparison walks the numeric fields the two files have in common and
+flags those that changed by more than the threshold. Fields whose name says
+lower is better (latency, bytes, seconds) and higher is better (throughput)
+are labelled as a regression or an improvement; anything else is just listed.
+The exit status is 1 if anything regressed, so it can gate a CI job.
+"""
+import argparse
+import json
+import math
+import platform
+import subprocess
+import sys
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+LOWER_IS_BETTER = ("_ms", "_seconds", "bytes", "latency", "errors", "connections")
+HIGHER_IS_BETTER = ("throughput", "_per_second", "rps", "speedup")
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def environment() -> Dict[str, Any]:
+    return {
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+
+def write_results(path: str, benchmark: str, config: Dict[str, Any], results: Any) -> None:
+    with open(path, "w") as f:
+        json.dump(
+            {"benchmark": benchmark, "environment": environment(), "config": config, "results": results},
+            f,
+            indent=2,
+        )
+
+
+def latency_summary(seconds: List[float]) -> Dict[str, float]:
+    """Nearest-rank p50/p95/p99 and max of a list of durations, in milliseconds."""
+    if not seconds:
+        return {}
+    ordered = sorted(seconds)
+
+    def rank(q: float) -> float:
+        return ordered[max(0, math.ceil(q * len(ordered)) - 1)] * 1000
+
+    return {"p50_ms": rank(0.50), "p95_ms": rank(0.95), "p99_ms": rank(0.99), "max_ms": ordered[-1] * 1000}
+
+
+ROW_KEYS = ("case", "configuration", "mode")
+
+
+def _row_key(row: Dict[str, Any]) -> Optional[str]:
+    # Rows in a result list are matched between files by their name field.
+    for key in ROW_KEYS:
+        if isinstance(row.get(key), str):
+            return row[key]
+    return None
+
+
+def flatten(value: Any, prefix: str = "") -> Iterator[Tuple[str, float]]:
+    """Yields (path, number) for every numeric leaf; list rows are keyed by their name field or index."""
+    if isinstance(value, bool):
+        return
+    if isinstance(value, (int, float)):
+        yield prefix, float(value)
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            yield from flatten(item, f"{prefix}.{key}" if prefix else str(key))
+    elif isinstance(value, list):
+        for index, item in enumerate(value):
+            key = _row_key(item) if isinstance(item, dict) else None
+            yield from flatten(item, f"{prefix}[{key if key is not None else index}]")
+
+
+def _direction(path: str) -> int:
+    """1 if higher is better, -1 if lower is better, 0 if unknown. Units may sit on a parent ("stages_ms.decode")."""
+    path = path.lower()
+    if any(marker in path for marker in HIGHER_IS_BETTER):
+        return 1
+    if any(marker in path for marker in LOWER_IS_BETTER):
+        return -1
+    return 0
+
+
+def compare(before: Dict[str, Any], after: Dict[str, Any], threshold: float) -> Tuple[list, int]:
+    """Returns (rows of (path, before, after, relative change, verdict), number of regressions)."""
+    old = dict(flatten(before.get("results")))
+    new = dict(flatten(after.get("results")))
+    rows, regressions = [], 0
+    for path in sorted(old.keys() & new.keys()):
+        if old[path] == 0:
+            continue
+        change = (new[path] - old[path]) / abs(old[path])
+        if abs(change) < threshold:
+            continue
+        direction = _direction(path)
+        if direction == 0:
+            verdict = "changed"
+        elif change * direction > 0:
+            verdict = "improved"
+        else:
+            verdict = "REGRESSED"
+            regressions += 1
+        rows.append((path, old[path], new[path], change, verdict))
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change to report (default 10%%).")
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    if before.get("benchmark") != after.get("benchmark"):
+        print(f"Warning: comparing '{before.get('benchmark')}' with '{after.get('benchmark')}'.")
+    print(
+        f"{before.get('benchmark')}: {before['environment'].get('git_commit')} -> {after['environment'].get('git_commit')}"
+    )
+
+    rows, regressions = compare(before, after, args.threshold)
+    if not rows:
+        print(f"No metric changed by more than {args.threshold:.0%}.")
+    for path, old, new, change, verdict in rows:
+        print(f"{verdict:<10} {path:<60} {old:>12.4g} -> {new:<12.4g} ({change:+.1%})")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""
+Local stand-ins for the external services, for tests and benchmarks.
+
+StubRoboflowServer answers the hosted detect API (POST /<project>/<version>)
+with a fixed prediction list over HTTP/1.1 keep-alive. StubGeminiServer answers
+the Gemini REST API (models/<model>:generateContent, :streamGenerateContent,
+which sends the report a few words at a time, and the model lookup used for
+warmup); point the app at it with GEMINI_API_ENDPOINT.
+
+Both record every request and the number of TCP connections they accepted and
+can simulate the network and the service: a per-connection delay that models
+the TCP+TLS handshake, a response delay with optional random jitter (or a
+list of delays for the first requests, e.g. one slow call to hedge), a
+fraction of requests that fail with `error_status`, and (Roboflow) an uplink
+bandwidth that makes upload time proportional to the request size. Random
+choices come from a seeded generator, so a run is reproducible.
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+DEFAULT_PREDICTIONS = [
+    {"x": 100.0, "y": 120.0, "width": 40.0, "height": 30.0, "confidence": 0.87, "class": "caries"},
+]
+DEFAULT_REPORT = (
+    "Findings: a radiolucent lesion consistent with dental caries is noted. "
+    "Recommendation: clinical examination and restorative evaluation are advised."
+)
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Send headers and body in one segment so Nagle + delayed ACK do not add latency.
+    disable_nagle_algorithm = True
+    wbufsize = 64 * 1024
+    server: "_Server"
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+        if self.server.handshake_delay:
+            time.sleep(self.server.handshake_delay)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: Any) -> None:
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _record(self, body: bytes) -> None:
+        url = urlparse(self.path)
+        with self.server.lock:
+            self.server.requests.append({
+                "method": self.command,
+                "path": url.path,
+                "params": {key: values[0] for key, values in parse_qs(url.query).items()},
+                "body_bytes": len(body),
+            })
+
+    def _simulate(self, body: bytes) -> bool:
+        """Applies uplink, latency and error settings. Returns False if an error response was sent."""
+        server = self.server
+        if server.uplink_bps:
+            time.sleep(len(body) * 8 / server.uplink_bps)
+        with server.lock:
+            delay = server.response_delays.pop(0) if server.response_delays else server.response_delay
+            jitter = server.random.uniform(0, server.jitter) if server.jitter else 0.0
+            failed = server.error_rate > 0 and server.random.random() < server.error_rate
+        if delay or jitter:
+            time.sleep(delay + jitter)
+        if failed or server.status != 200:
+            with server.lock:
+                server.errors += 1
+            self._send_json(server.error_status if failed else server.status, {"message": "stub error"})
+            return False
+        return True
+
+    def _read_body(self) -> bytes:
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self._record(body)
+        return body
+
+
+class _RoboflowHandler(_StubHandler):
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        body = self._read_body()
+        if self._simulate(body):
+            self._send_json(200, {"predictions": self.server.predictions, "image": {"width": 0, "height": 0}})
+
+
+class _GeminiHandler(_StubHandler):
+    def do_GET(self):
+        # Model lookup (genai.get_model), used by the client warmup.
+        self._record(b"")
+        name = urlparse(self.path).path.split("/v1beta/", 1)[-1]
+        self._send_json(200, {
+            "name": name,
+            "baseModelId": name.rsplit("/", 1)[-1],
+            "version": "stub",
+            "displayName": "Stub model",
+            "inputTokenLimit": 1048576,
+            "outputTokenLimit": 8192,
+            "supportedGenerationMethods": ["generateContent"],
+        })
+
+    @staticmethod
+    def _candidate(text: str, finished: bool) -> Dict[str, Any]:
+        candidate = {"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}
+        if finished:
+            candidate["finishReason"] = "STOP"
+        return {"candidates": [candidate]}
+
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _stream_report(self) -> None:
+        """streamGenerateContent over REST: a JSON array sent one element per chunk, stream_chunk_delay apart."""
+        words = self.server.report_text.split(" ")
+        size = max(1, self.server.stream_chunk_words)
+        pieces = [" ".join(words[i:i + size]) + (" " if i + size < len(words) else "") for i in range(0, len(words), size)]
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for index, piece in enumerate(pieces):
+            if index and self.server.stream_chunk_delay:
+                time.sleep(self.server.stream_chunk_delay)
+            if index == self.server.stream_fail_after:
+                # Drop the connection mid-stream, as a failing upstream would.
+                self.close_connection = True
+                return
+            last = index == len(pieces) - 1
+            element = json.dumps(self._candidate(piece, last))
+            self._write_chunk((("[" if index == 0 else "") + element + ("]" if last else ",\r\n")).encode("utf-8"))
+        self._write_chunk(b"")
+
+    def do_POST(self):
+        body = self._read_body()
+        path = urlparse(self.path).path
+        if not path.endswith((":generateContent", ":streamGenerateContent")):
+            self._send_json(404, {"error": {"code": 404, "message": "Unknown method."}})
+            return
+        if not self._simulate(body):
+            return
+        if path.endswith(":streamGenerateContent"):
+            self._stream_report()
+        else:
+            self._send_json(200, self._candidate(self.server.report_text, True))
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class _StubServer:
+    handler_class = _StubHandler
+
+    def __init__(
+        self,
+        handshake_delay: float = 0.0,
+        response_delay: float = 0.0,
+        jitter: float = 0.0,
+        status: int = 200,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        uplink_bps: float = 0.0,
+        seed: int = 0,
+        response_delays: Optional[List[float]] = None,
+    ):
+        self._server = _Server(("127.0.0.1", 0), self.handler_class)
+        self._server.lock = threading.Lock()
+        self._server.connections = 0
+        self._server.errors = 0
+        self._server.requests = []
+        self._server.handshake_delay = handshake_delay
+        self._server.response_delay = response_delay
+        self._server.response_delays = list(response_delays or [])
+        self._server.jitter = jitter
+        self._server.status = status
+        self._server.error_rate = error_rate
+        self._server.error_status = error_status
+        self._server.uplink_bps = uplink_bps
+        self._server.random = random.Random(seed)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def connections(self) -> int:
+        return self._server.connections
+
+    @property
+    def errors(self) -> int:
+        return self._server.errors
+
+    @property
+    def requests(self) -> List[Dict[str, Any]]:
+        return list(self._server.requests)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class StubRoboflowServer(_StubServer):
+    handler_class = _RoboflowHandler
+
+    def __init__(self, predictions: Optional[List[Dict[str, Any]]] = None, **kwargs):
+        super().__init__(**kwargs)
+        self._server.predictions = DEFAULT_PREDICTIONS if predictions is None else predictions
+
+
+class StubGeminiServer(_StubServer):
+    handler_class = _GeminiHandler
+
+    def __init__(
+        self,
+        report_text: str = DEFAULT_REPORT,
+        stream_chunk_words: int = 4,
+        stream_chunk_delay: float = 0.0,
+        stream_fail_after: Optional[int] = None,
+        **kwargs
+    ):
+        super().__init__(**kwargs)
+        self._server.report_text = report_text
+        self._server.stream_chunk_words = stream_chunk_words
+        self._server.stream_chunk_delay = stream_chunk_delay
+        self._server.stream_fail_after = stream_fail_after
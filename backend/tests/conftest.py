@@ -0,0 +1,24 @@
+import os
+
+import pytest
+
+# Mocked pipeline functions cannot be pickled into a decode process pool, so the
+# test suite runs the decode stage on the I/O thread pool instead.
+os.environ.setdefault("DECODE_PROCESS_WORKERS", "0")
+# Keep app startup from reaching out to real APIs when a .env holds live keys.
+os.environ.setdefault("CLIENT_WARMUP", "false")
+# Job tests run workers in-process with run_next_job; the app should not spawn any.
+os.environ.setdefault("JOB_WORKERS", "0")
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    from app.cache import report_cache, result_cache
+    from app.resilience import reset_breakers
+
+    if result_cache is not None:
+        result_cache.clear()
+    if report_cache is not None:
+        report_cache.clear()
+    reset_breakers()
+    yield
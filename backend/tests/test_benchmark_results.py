@@ -0,0 +1,28 @@
+from benchmarks.results import compare, latency_summary
+
+
+def test_latency_summary_uses_nearest_rank():
+    summary = latency_summary([i / 1000 for i in range(1, 101)])
+    assert summary == {"p50_ms": 50.0, "p95_ms": 95.0, "p99_ms": 99.0, "max_ms": 100.0}
+
+
+def test_compare_flags_regressions_by_metric_direction():
+    before = {"results": [
+        {"case": "a", "total_ms": 100.0, "file_bytes": 1000},
+        {"case": "b", "total_ms": 100.0},
+    ]}
+    after = {"results": [
+        {"case": "b", "total_ms": 50.0},
+        {"case": "a", "total_ms": 130.0, "file_bytes": 1000},
+    ]}
+    rows, regressions = compare(before, after, threshold=0.1)
+    assert regressions == 1
+    assert {(path, verdict) for path, _, _, _, verdict in rows} == {
+        ("[a].total_ms", "REGRESSED"),
+        ("[b].total_ms", "improved"),
+    }
+
+    throughput_rows, throughput_regressions = compare(
+        {"results": {"throughput_rps": 10.0}}, {"results": {"throughput_rps": 8.0}}, threshold=0.1
+    )
+    assert throughput_regressions == 1 and throughput_rows[0][4] == "REGRESSED"
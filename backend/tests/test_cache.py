@@ -0,0 +1,121 @@
+import time
+
+import pytest
+
+from app.cache import LRUCache, ResultCache, SQLiteCache, make_result_cache_key
+from app.models import CachedDiagnosis, RoboflowPrediction
+
+
+def make_cached_diagnosis(report="report") -> CachedDiagnosis:
+    return CachedDiagnosis(
+        image_png=b"\x89PNG\x00binary",
+        image_width=2,
+        image_height=1,
+        annotations=[RoboflowPrediction(x=1, y=2, width=3, height=4, confidence=0.9, **{"class": "caries"})],
+        diagnostic_report=report,
+    )
+
+
+def test_lru_cache_evicts_least_recently_used_entry():
+    cache = LRUCache(max_entries=2, max_bytes=1000, ttl_seconds=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_lru_cache_evicts_by_size_and_ttl():
+    cache = LRUCache(max_entries=10, max_bytes=10, ttl_seconds=60, size_of=len)
+    cache.set("a", "12345")
+    cache.set("b", "123456")
+    assert cache.get("a") is None
+    assert cache.total_bytes == 6
+
+    expiring = LRUCache(max_entries=10, max_bytes=10, ttl_seconds=0.01)
+    expiring.set("a", 1)
+    time.sleep(0.02)
+    assert expiring.get("a") is None
+
+
+def test_result_cache_disk_tier_survives_new_memory_tier(tmp_path):
+    db_path = str(tmp_path / "results.sqlite3")
+    first = ResultCache(LRUCache(10, 10_000, 60), SQLiteCache(db_path, 60))
+    first.set("key", make_cached_diagnosis())
+
+    restarted = ResultCache(LRUCache(10, 10_000, 60), SQLiteCache(db_path, 60))
+    cached = restarted.get("key")
+    assert cached is not None
+    assert cached.annotations[0].class_name == "caries"
+    assert cached.image_png == b"\x89PNG\x00binary"
+    assert restarted.get("key") is not None
+    assert restarted.stats()["disk_hits"] == 1
+    assert restarted.stats()["memory_hits"] == 1
+    assert restarted.get("missing") is None
+    assert restarted.stats()["misses"] == 1
+
+
+def test_result_cache_key_depends_on_content_and_thresholds(mocker):
+    key = make_result_cache_key(b"study")
+    assert key == make_result_cache_key(b"study")
+    assert key != make_result_cache_key(b"other study")
+
+    mocker.patch("app.cache.settings.ROBOFLOW_CONFIDENCE", 0.55)
+    assert key != make_result_cache_key(b"study")
+
+
+def test_result_cache_key_depends_on_detector_backend(mocker):
+    key = make_result_cache_key(b"study")
+    mocker.patch("app.cache.settings.DETECTOR_BACKEND", "onnx")
+    mocker.patch("app.cache.settings.ONNX_MODEL_PATH", "/models/a.onnx")
+    onnx_key = make_result_cache_key(b"study")
+    assert onnx_key != key
+
+    mocker.patch("app.cache.settings.ONNX_MODEL_PATH", "/models/b.onnx")
+    assert make_result_cache_key(b"study") != onnx_key
+
+
+def test_single_flight_shares_result_and_errors():
+    import threading
+
+    from app.cache import SingleFlight
+
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    results = []
+
+    def leader_fn():
+        started.set()
+        release.wait(5)
+        return "value"
+
+    leader = threading.Thread(target=lambda: results.append(flight.do("k", leader_fn)))
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=lambda: results.append(flight.do("k", lambda: "unused")))
+    follower.start()
+    time.sleep(0.1)
+    release.set()
+    leader.join()
+    follower.join()
+    assert sorted(results) == [("value", False), ("value", True)]
+
+    with pytest.raises(ValueError):
+        flight.do("k", lambda: (_ for _ in ()).throw(ValueError("boom")))
+    assert flight.do("k", lambda: "again") == ("again", False)
+
+
+def test_report_cache_persists_to_sqlite(tmp_path):
+    from app.cache import ReportCache
+
+    path = str(tmp_path / "reports.sqlite3")
+    cache = ReportCache(LRUCache(8, 1024, 60, size_of=len), SQLiteCache(path, 60, table="llm_reports"))
+    cache.set("sig", "Report text.")
+
+    reopened = ReportCache(LRUCache(8, 1024, 60, size_of=len), SQLiteCache(path, 60, table="llm_reports"))
+    assert reopened.get("sig") == "Report text."
+    assert reopened.get("other") is None
+    assert reopened.stats()["hits"] == 1 and reopened.stats()["misses"] == 1
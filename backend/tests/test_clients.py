@@ -0,0 +1,149 @@
+import base64
+import io
+
+import pytest
+from PIL import Image
+
+from app.clients import RoboflowClient
+from benchmarks.stub_servers import StubRoboflowServer
+
+
+def make_client(url: str, **kwargs) -> RoboflowClient:
+    return RoboflowClient(
+        api_url=url, api_key="test-key", model_id="adr/6", confidence=0.3, overlap=0.5, **kwargs
+    )
+
+
+def test_roboflow_client_reuses_one_connection():
+    image = Image.new("L", (32, 32))
+    with StubRoboflowServer() as server:
+        client = make_client(server.url)
+        client.warmup()
+        for _ in range(3):
+            result = client.infer(image)
+        client.close()
+
+    assert result["predictions"][0]["class"] == "caries"
+    assert server.connections == 1
+    assert len(server.requests) == 3
+    request = server.requests[0]
+    assert request["path"] == "/adr/6"
+    assert request["params"] == {"api_key": "test-key", "confidence": "0.3", "overlap": "0.5"}
+    assert client.stats()["requests"] == 3
+
+
+def test_roboflow_client_infer_many_reports_errors_per_image():
+    with StubRoboflowServer(status=500) as server:
+        client = make_client(server.url)
+        outcomes = client.infer_many([Image.new("L", (8, 8)), Image.new("L", (8, 8))])
+        client.close()
+    assert len(outcomes) == 2
+    assert all(result is None and error is not None for result, error in outcomes)
+
+
+def test_roboflow_client_times_out():
+    import requests
+
+    with StubRoboflowServer(response_delay=0.5) as server:
+        client = make_client(server.url, read_timeout=0.05)
+        with pytest.raises(requests.Timeout):
+            client.infer(Image.new("L", (8, 8)))
+        client.close()
+
+
+def test_roboflow_detector_uses_pooled_client(mocker):
+    from app import clients, services
+
+    with StubRoboflowServer() as server:
+        mocker.patch("app.services.settings.ROBOFLOW_API_KEY", "test-key")
+        mocker.patch("app.services.settings.ROBOFLOW_MODEL_ID", "adr/6")
+        mocker.patch("app.clients.settings.ROBOFLOW_API_URL", server.url)
+        mocker.patch("app.services._detector", services.RoboflowDetector())
+        clients.close_clients()
+        try:
+            results = services.detect_objects_roboflow_sdk_batch([Image.new("L", (16, 16)) for _ in range(4)])
+            single, error = services.detect_objects_roboflow_sdk(Image.new("L", (16, 16)))
+        finally:
+            clients.close_clients()
+
+    assert [len(predictions) for predictions, _ in results] == [1, 1, 1, 1]
+    assert error is None and single[0].class_name == "caries"
+    assert len(server.requests) == 5
+    # Four concurrent requests may each need a connection; the fifth reuses one.
+    assert server.connections <= 4
+
+
+def test_lifespan_creates_and_warms_clients(mocker):
+    from fastapi.testclient import TestClient
+
+    from app import clients
+    from app.main import app
+
+    with StubRoboflowServer() as server:
+        mocker.patch("app.services.settings.ROBOFLOW_API_KEY", "test-key")
+        mocker.patch("app.services.settings.ROBOFLOW_MODEL_ID", "adr/6")
+        mocker.patch("app.services.settings.GEMINI_API_KEY", None)
+        mocker.patch("app.clients.settings.ROBOFLOW_API_URL", server.url)
+        mocker.patch("app.clients.settings.CLIENT_WARMUP", True)
+        with TestClient(app):
+            assert server.connections == 1
+            assert clients._roboflow_client is not None
+        assert clients._roboflow_client is None
+
+
+def test_roboflow_client_downscales_and_back_projects_predictions():
+    predictions = [{"x": 10.0, "y": 20.0, "width": 4.0, "height": 8.0, "confidence": 0.9, "class": "caries"}]
+    image = Image.effect_noise((1024, 512), 64).convert("L")
+    with StubRoboflowServer(predictions=predictions) as server:
+        full = make_client(server.url)
+        full.infer(image)
+        full.close()
+        downscaled = make_client(server.url, input_size=256)
+        result = downscaled.infer(image)
+        downscaled.close()
+
+    # The model saw a 256x128 image, so boxes scale back up by 4.
+    assert result["predictions"][0] == {**predictions[0], "x": 40.0, "y": 80.0, "width": 16.0, "height": 32.0}
+    full_bytes, downscaled_bytes = (request["body_bytes"] for request in server.requests)
+    assert downscaled_bytes * 4 < full_bytes
+
+
+def test_roboflow_client_keeps_images_within_input_size():
+    client = make_client("http://127.0.0.1:1", input_size=640)
+    payload, scale = client.prepare_image(Image.new("L", (320, 200)))
+    client.close()
+    assert scale == 1.0
+    assert Image.open(io.BytesIO(base64.b64decode(payload))).size == (320, 200)
+
+
+def test_gemini_client_talks_to_configured_endpoint(mocker):
+    from app import clients, services
+    from app.models import RoboflowPrediction
+    from benchmarks.stub_servers import StubGeminiServer
+
+    with StubGeminiServer(report_text="Stub report.") as server:
+        mocker.patch("app.services.settings.GEMINI_API_KEY", "test-key")
+        mocker.patch("app.clients.settings.GEMINI_API_ENDPOINT", server.url)
+        clients.close_clients()
+        try:
+            report, is_final = services.generate_llm_report_with_source([
+                RoboflowPrediction(x=1, y=1, width=1, height=1, confidence=0.9, class_name="caries")
+            ])
+        finally:
+            clients.close_clients()
+
+    assert (report, is_final) == ("Stub report.", True)
+    assert server.requests[-1]["path"].endswith(":generateContent")
+
+
+def test_stub_error_rate_is_reproducible():
+    import requests
+
+    def statuses():
+        with StubRoboflowServer(error_rate=0.5, seed=7) as server:
+            with requests.Session() as session:
+                return [session.post(f"{server.url}/adr/6", data=b"x").status_code for _ in range(20)]
+
+    first = statuses()
+    assert first == statuses()
+    assert set(first) == {200, 503}
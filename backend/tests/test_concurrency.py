@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from app.concurrency import StageLimiter, StageSaturatedError, run_io_bound
+
+
+def test_stage_limiter_rejects_when_queue_is_full():
+    async def scenario():
+        limiter = StageLimiter("inference", concurrency=1, max_waiting=1)
+        release = asyncio.Event()
+
+        async def hold_slot():
+            async with limiter:
+                await release.wait()
+
+        holder = asyncio.create_task(hold_slot())
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(hold_slot())
+        await asyncio.sleep(0)
+        assert limiter.in_flight == 1
+        assert limiter.waiting == 1
+
+        with pytest.raises(StageSaturatedError) as exc_info:
+            async with limiter:
+                pass
+        assert exc_info.value.stage == "inference"
+
+        release.set()
+        await asyncio.gather(holder, waiter)
+        assert limiter.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_run_io_bound_runs_off_the_event_loop_thread():
+    import threading
+
+    async def scenario():
+        loop_thread = threading.get_ident()
+        worker_thread = await run_io_bound("report", threading.get_ident)
+        return loop_thread, worker_thread
+
+    loop_thread, worker_thread = asyncio.run(scenario())
+    assert loop_thread != worker_thread
+
+
+def test_broken_process_pool_is_shut_down_and_replaced(mocker):
+    from concurrent.futures.process import BrokenProcessPool
+
+    import app.concurrency as concurrency
+
+    broken_pool = mocker.MagicMock()
+    mocker.patch.object(concurrency, "_process_pool", broken_pool)
+    mocker.patch.object(concurrency, "get_cpu_executor", return_value=broken_pool)
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        future.set_exception(BrokenProcessPool("worker died"))
+        mocker.patch.object(loop, "run_in_executor", return_value=future)
+        await concurrency.run_cpu_bound("decode", int)
+
+    with pytest.raises(BrokenProcessPool):
+        asyncio.run(scenario())
+    broken_pool.shutdown.assert_called_once_with(wait=False, cancel_futures=True)
+    assert concurrency._process_pool is None
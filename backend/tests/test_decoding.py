@@ -0,0 +1,73 @@
+import io
+
+import numpy as np
+import pydicom
+import pytest
+from pydicom.uid import JPEG2000Lossless, JPEGBaseline8Bit
+
+from app.decoding import decode_frame, decode_frames, reduce_level, select_decoder
+from app.services import convert_dicom_to_pil_and_png
+from benchmarks.dicom_synth import make_dicom
+
+
+def read(**spec) -> pydicom.Dataset:
+    return pydicom.dcmread(io.BytesIO(make_dicom(**spec)))
+
+
+@pytest.mark.parametrize("transfer_syntax", ["explicit_le", "rle", "jpeg2000"])
+def test_decode_frame_decodes_only_the_requested_frame(transfer_syntax):
+    ds = read(width=96, height=64, frames=3, transfer_syntax=transfer_syntax)
+    full = ds.pixel_array
+    for index in (0, 2):
+        assert np.array_equal(decode_frame(ds, index), full[index])
+
+
+def test_reduce_level_keeps_the_longer_side_above_max_side():
+    assert reduce_level(3000, 2400, 0) == 0
+    assert reduce_level(3000, 2400, 700) == 2
+    assert reduce_level(3000, 2400, 750) == 2
+    assert reduce_level(3000, 2400, 751) == 1
+    assert reduce_level(500, 400, 1024) == 0
+
+
+def test_jpeg2000_decodes_at_reduced_resolution():
+    ds = read(width=512, height=384, transfer_syntax="jpeg2000")
+    full = decode_frame(ds)
+    reduced = decode_frame(ds, max_side=128)
+    assert reduced.shape == (96, 128)
+    # Same stored-value range as the full decode, not Pillow's 16-bit scaling.
+    assert reduced.max() <= 4095
+    downsampled = full.reshape(96, 4, 128, 4).mean(axis=(1, 3))
+    assert abs(reduced.mean() - downsampled.mean()) < 20
+    assert np.corrcoef(reduced.ravel(), downsampled.ravel())[0, 1] > 0.95
+
+
+def test_jpeg_baseline_decodes_at_reduced_resolution():
+    ds = read(width=512, height=384, bits_stored=8, transfer_syntax="jpeg_baseline")
+    assert decode_frame(ds).shape == (384, 512)
+    assert decode_frame(ds, max_side=256).shape == (192, 256)
+
+
+def test_select_decoder_prefers_the_fastest_and_gil_free_plugins():
+    assert select_decoder(JPEGBaseline8Bit) == "pillow"
+    assert select_decoder(JPEG2000Lossless) == "pylibjpeg"
+    assert select_decoder(JPEG2000Lossless, parallel=True) == "pillow"
+    assert select_decoder(pydicom.uid.ExplicitVRLittleEndian) == ""
+
+
+def test_decode_frames_in_parallel_matches_serial():
+    ds = read(width=96, height=64, frames=4, transfer_syntax="jpeg2000")
+    serial = decode_frames(ds, max_workers=1)
+    parallel = decode_frames(ds, max_workers=4)
+    assert len(parallel) == 4
+    assert all(np.array_equal(a, b) for a, b in zip(serial, parallel))
+
+
+def test_conversion_scales_down_to_decode_max_side(mocker):
+    mocker.patch("app.services.settings.DECODE_MAX_SIDE", 200)
+    for transfer_syntax in ("explicit_le", "jpeg2000"):
+        pil_image, png_bytes, error = convert_dicom_to_pil_and_png(
+            make_dicom(width=640, height=480, transfer_syntax=transfer_syntax)
+        )
+        assert error is None
+        assert max(pil_image.size) == 200 if transfer_syntax == "explicit_le" else max(pil_image.size) <= 320
@@ -0,0 +1,135 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.detector import parse_class_names
+from app.onnx_detector import batched_nms, letterbox, non_max_suppression
+
+INPUT_SIZE = 64
+
+# Raw model output in letterboxed input pixels: centre x, centre y, w, h, then class scores.
+RAW_PREDICTIONS = np.array([
+    # Two overlapping class-0 boxes; NMS keeps the stronger one.
+    [32, 32, 20, 20, 0.90, 0.00],
+    [33, 32, 20, 20, 0.80, 0.00],
+    # Below the 0.30 confidence threshold.
+    [10, 20, 8, 8, 0.00, 0.20],
+    # Overlaps the first box but is class 1, so it survives class-aware NMS.
+    [32, 32, 18, 18, 0.00, 0.70],
+], dtype=np.float32).T
+
+
+def make_onnx_model(path):
+    """Tiny model with a dynamic batch axis that emits RAW_PREDICTIONS for every image."""
+    onnx = pytest.importorskip("onnx")
+    from onnx import TensorProto, helper, numpy_helper
+
+    graph = helper.make_graph(
+        [
+            helper.make_node("ReduceMean", ["images"], ["mean"], axes=[1, 2, 3], keepdims=1),
+            helper.make_node("Squeeze", ["mean", "squeeze_axes"], ["per_image"]),
+            helper.make_node("Mul", ["per_image", "zero"], ["zeros"]),
+            helper.make_node("Add", ["zeros", "predictions"], ["output0"]),
+        ],
+        "tiny_detector",
+        [helper.make_tensor_value_info("images", TensorProto.FLOAT, ["batch", 3, INPUT_SIZE, INPUT_SIZE])],
+        [helper.make_tensor_value_info("output0", TensorProto.FLOAT, ["batch", 6, 4])],
+        initializer=[
+            numpy_helper.from_array(np.array([3], dtype=np.int64), "squeeze_axes"),
+            numpy_helper.from_array(np.zeros(1, dtype=np.float32), "zero"),
+            numpy_helper.from_array(RAW_PREDICTIONS[None], "predictions"),
+        ],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    helper.set_model_props(model, {"names": "{0: 'caries', 1: 'periapical lesion'}"})
+    onnx.save(model, str(path))
+    return str(path)
+
+
+@pytest.fixture
+def onnx_detector(tmp_path):
+    pytest.importorskip("onnxruntime")
+    from app.onnx_detector import OnnxDetector
+
+    return OnnxDetector(
+        make_onnx_model(tmp_path / "tiny.onnx"),
+        confidence_threshold=0.30,
+        iou_threshold=0.50,
+        input_size=INPUT_SIZE,
+        batch_size=4,
+    )
+
+
+def test_letterbox_pads_to_square_and_reports_offsets():
+    image = Image.new("L", (128, 64), color=255)
+    array, scale, pad_x, pad_y = letterbox(image, INPUT_SIZE)
+    assert array.shape == (3, INPUT_SIZE, INPUT_SIZE)
+    assert array.dtype == np.float32
+    assert (scale, pad_x, pad_y) == (0.5, 0.0, 16.0)
+    assert array[0, 16:48].min() == pytest.approx(1.0)
+    assert array[0, :16].max() == pytest.approx(114 / 255)
+
+
+def test_non_max_suppression_keeps_highest_scoring_overlap():
+    boxes = np.array([[0, 0, 10, 10], [1, 0, 11, 10], [20, 20, 30, 30]], dtype=np.float32)
+    scores = np.array([0.6, 0.9, 0.5], dtype=np.float32)
+    assert non_max_suppression(boxes, scores, 0.5).tolist() == [1, 2]
+    assert non_max_suppression(np.empty((0, 4)), np.empty(0), 0.5).tolist() == []
+
+
+def test_batched_nms_is_class_aware():
+    boxes = np.array([[0, 0, 10, 10], [0, 0, 10, 10]], dtype=np.float32)
+    scores = np.array([0.9, 0.8], dtype=np.float32)
+    assert batched_nms(boxes, scores, np.array([0, 0]), 0.5).tolist() == [0]
+    assert batched_nms(boxes, scores, np.array([0, 1]), 0.5).tolist() == [0, 1]
+
+
+def test_parse_class_names_accepts_list_and_metadata_dict():
+    assert parse_class_names("caries, calculus,") == ["caries", "calculus"]
+    assert parse_class_names("{1: 'calculus', 0: 'caries'}") == ["caries", "calculus"]
+    assert parse_class_names("") == []
+
+
+def test_onnx_detector_batch_outputs_predictions_in_original_pixels(onnx_detector):
+    images = [Image.new("L", (128, 64)) for _ in range(5)]
+    results = onnx_detector.detect_batch(images)
+    assert len(results) == 5
+
+    predictions, error = results[0]
+    assert error is None
+    assert [(p.class_name, round(p.confidence, 2)) for p in predictions] == [
+        ("caries", 0.90), ("periapical lesion", 0.70)
+    ]
+    caries = predictions[0]
+    # Input-space (32, 32, 20x20) maps back through scale 0.5 and a 16px top pad.
+    assert (caries.x, caries.y, caries.width, caries.height) == pytest.approx((64, 32, 40, 40))
+    assert all(result == results[0] for result in results)
+
+
+def test_detect_objects_uses_configured_onnx_backend(mocker, tmp_path):
+    pytest.importorskip("onnxruntime")
+    from app import services
+    from app.onnx_detector import OnnxDetector
+
+    mocker.patch("app.services.settings.DETECTOR_BACKEND", "onnx")
+    mocker.patch("app.services.settings.ONNX_MODEL_PATH", make_onnx_model(tmp_path / "tiny.onnx"))
+    mocker.patch("app.services.settings.ONNX_INPUT_SIZE", INPUT_SIZE)
+    mocker.patch("app.services._detector", None)
+
+    predictions, error = services.detect_objects_roboflow_sdk(Image.new("L", (64, 64)))
+    assert error is None
+    assert predictions[0].class_name == "caries"
+    assert isinstance(services.get_detector(), OnnxDetector)
+
+
+def test_missing_onnx_model_reports_error(mocker):
+    from app import services
+
+    mocker.patch("app.services.settings.DETECTOR_BACKEND", "onnx")
+    mocker.patch("app.services.settings.ONNX_MODEL_PATH", "/nonexistent/model.onnx")
+    mocker.patch("app.services._detector", None)
+
+    results = services.detect_objects_roboflow_sdk_batch([Image.new("L", (8, 8))])
+    assert results[0][0] == []
+    assert "ONNX model could not be loaded" in results[0][1]
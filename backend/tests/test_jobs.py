@@ -0,0 +1,125 @@
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from app import jobs
+from app.jobs import COMPLETED, FAILED, QUEUED, JobStore, LeaseLostError, run_next_job
+from app.main import app
+from app.models import RoboflowPrediction
+
+client = TestClient(app)
+
+DICOM_BYTES = b"\x00" * 128 + b"DICM" + b"Not a real DICOM body."
+
+
+@pytest.fixture
+def store(tmp_path, mocker):
+    mocker.patch("app.jobs.settings.JOB_DATA_DIR", str(tmp_path))
+    mocker.patch("app.jobs.settings.JOB_RETRY_BACKOFF_SECONDS", 0)
+    mocker.patch("app.jobs._job_store", None)
+    job_store = jobs.get_job_store()
+    yield job_store
+    job_store.close()
+
+
+def mock_pipeline(mocker, detections=None, report=("Job report.", True)):
+    mocker.patch(
+        "app.services.convert_dicom_file_to_pil_and_png",
+        return_value=(Image.new("L", (40, 20)), b"\x89PNG job image", None),
+    )
+    detect = mocker.patch(
+        "app.services.detect_objects_roboflow_sdk",
+        side_effect=detections or [([RoboflowPrediction(x=5, y=5, width=2, height=2, confidence=0.9, class_name="caries")], None)],
+    )
+    mocker.patch("app.services.generate_llm_report_with_source", return_value=report)
+    return detect
+
+
+def enqueue(store, tmp_path, name="study.dcm"):
+    upload = tmp_path / f"upload-{time.monotonic_ns()}.dcm"
+    upload.write_bytes(DICOM_BYTES)
+    return store.enqueue(name, str(upload), "0" * 64)
+
+
+def test_job_api_queues_runs_and_reports_result(store, mocker):
+    mock_pipeline(mocker)
+    response = client.post("/api/jobs", files={"file": ("study.dcm", DICOM_BYTES, "application/octet-stream")})
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+    assert response.json()["status"] == QUEUED
+
+    assert run_next_job(store, "test-worker") is True
+    assert run_next_job(store, "test-worker") is False
+
+    status = client.get(f"/api/jobs/{job_id}").json()
+    assert status["status"] == COMPLETED and status["stage"] == "done" and status["attempts"] == 1
+    assert status["result"]["diagnostic_report"] == "Job report."
+    assert status["result"]["annotations"][0]["class"] == "caries"
+    assert client.get(f"/api/images/{status['result']['image_id']}").content == b"\x89PNG job image"
+    assert client.get("/api/jobs").json()[COMPLETED] == 1
+
+    events = client.get(f"/api/jobs/{job_id}/events")
+    assert events.headers["content-type"].startswith("text/event-stream")
+    assert events.text.startswith("event: completed\ndata: ")
+
+
+def test_job_api_rejects_non_dicom_and_unknown_ids(store):
+    response = client.post("/api/jobs", files={"file": ("study.dcm", b"plain text", "application/octet-stream")})
+    assert response.status_code == 400
+    assert client.get("/api/jobs/does-not-exist").status_code == 404
+
+
+def test_job_retries_failed_detection_stage(store, tmp_path, mocker):
+    detect = mock_pipeline(mocker, detections=[
+        ([], "Roboflow API request failed: 503"),
+        ([RoboflowPrediction(x=5, y=5, width=2, height=2, confidence=0.8, class_name="caries")], None),
+    ])
+    job = enqueue(store, tmp_path)
+    run_next_job(store, "test-worker")
+
+    finished = store.get(job.id).to_status()
+    assert detect.call_count == 2
+    assert finished.status == COMPLETED and finished.result.error is None
+    assert len(finished.result.annotations) == 1
+
+
+def test_job_requeued_after_unexpected_error_then_failed(store, tmp_path, mocker):
+    mocker.patch("app.jobs.settings.JOB_MAX_ATTEMPTS", 2)
+    mocker.patch("app.services.convert_dicom_file_to_pil_and_png", side_effect=RuntimeError("worker bug"))
+    job = enqueue(store, tmp_path)
+
+    run_next_job(store, "test-worker")
+    retried = store.get(job.id)
+    assert retried.status == QUEUED and retried.attempts == 1 and "worker bug" in retried.error
+
+    run_next_job(store, "test-worker")
+    failed = store.get(job.id)
+    assert failed.status == FAILED and failed.attempts == 2
+
+
+def test_expired_lease_is_reclaimed_and_old_worker_cannot_write(store, tmp_path):
+    job = enqueue(store, tmp_path)
+    first = store.claim("worker-a", lease_seconds=-1, max_attempts=3)
+    assert first.id == job.id
+
+    # worker-a stopped heartbeating; its lease has expired.
+    second = store.claim("worker-b", lease_seconds=60, max_attempts=3)
+    assert second.id == job.id and second.attempts == 2
+    assert store.claim("worker-c", lease_seconds=60, max_attempts=3) is None
+    with pytest.raises(LeaseLostError):
+        store.set_stage(first, "decode", 60)
+    store.set_stage(second, "decode", 60)
+
+
+def test_jobs_survive_a_store_restart(tmp_path):
+    first = JobStore(str(tmp_path))
+    job = enqueue(first, tmp_path)
+    first.close()
+
+    reopened = JobStore(str(tmp_path))
+    claimed = reopened.claim("worker", lease_seconds=60, max_attempts=3)
+    reopened.close()
+    assert claimed.id == job.id
+    assert open(claimed.input_path, "rb").read() == DICOM_BYTES
@@ -0,0 +1,130 @@
+import json
+import logging
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import logs
+from app.logs import LazyRepr, SamplingFilter, correlation_scope, parse_stage_levels, stage_logger
+from app.main import app
+from app.services import _parse_roboflow_result
+
+
+def make_record(sample_key=None) -> logging.LogRecord:
+    record = logging.LogRecord("app.stage.detection", logging.DEBUG, __file__, 1, "prediction %d", (1,), None)
+    if sample_key is not None:
+        record.sample_key = sample_key
+    return record
+
+
+class CountingRepr:
+    calls = 0
+
+    def __repr__(self):
+        CountingRepr.calls += 1
+        return "counted"
+
+
+@pytest.fixture
+def app_logging(mocker):
+    """Runs configure_logging with the given settings and restores the default setup afterwards."""
+    def configure(**overrides):
+        for name, value in overrides.items():
+            mocker.patch(f"app.logs.settings.{name}", value)
+        logs.configure_logging()
+
+    yield configure
+    logs.shutdown_logging()
+    mocker.stopall()
+    logs.configure_logging()
+    stage_logger("detection").setLevel(logging.NOTSET)
+
+
+def test_sampling_filter_rate_limits_per_key_and_counts_drops(mocker):
+    clock = mocker.patch("app.logs.time.monotonic", return_value=100.0)
+    sampler = SamplingFilter(rate=1.0, max_per_second=5)
+
+    kept = [sampler.filter(make_record("prediction")) for _ in range(20)]
+    assert sum(kept) == 5
+    # Other keys and unkeyed records have their own budget.
+    assert sampler.filter(make_record("other"))
+    assert sampler.filter(make_record())
+
+    clock.return_value = 101.0
+    record = make_record("prediction")
+    assert sampler.filter(record)
+    assert record.dropped == 15
+
+
+def test_sampling_filter_keeps_a_fraction():
+    sampler = SamplingFilter(rate=0.1, max_per_second=0, seed=1)
+    kept = sum(sampler.filter(make_record("prediction")) for _ in range(1000))
+    assert 50 < kept < 150
+
+
+def test_lazy_repr_is_bounded_and_only_rendered_when_written():
+    text = str(LazyRepr({"predictions": [{"x": i, "class": "caries"} for i in range(1000)]}))
+    assert len(text) < 600 and "..." in text
+
+    CountingRepr.calls = 0
+    logging.getLogger("app.stage.test").debug("value %s", LazyRepr(CountingRepr()))
+    assert CountingRepr.calls == 0
+
+
+def test_parse_stage_levels():
+    assert parse_stage_levels("detection=DEBUG, app.cache=warning,bogus,report=LOUD") == {
+        "app.stage.detection": logging.DEBUG,
+        "app.cache": logging.WARNING,
+    }
+
+
+def test_parse_roboflow_result_formats_nothing_below_debug(caplog):
+    caplog.set_level(logging.INFO)
+    CountingRepr.calls = 0
+    predictions = [{"x": i, "y": i, "width": 5, "height": 5, "confidence": 0.9, "class": "caries", "raw": CountingRepr()}
+                   for i in range(300)]
+
+    parsed, error = _parse_roboflow_result({"predictions": predictions})
+
+    assert error is None and len(parsed) == 300
+    assert CountingRepr.calls == 0
+    assert not [r for r in caplog.records if r.name == "app.stage.detection"]
+
+
+def test_verbose_detection_records_are_sampled(app_logging, capsys):
+    app_logging(LOG_STAGE_LEVELS="detection=DEBUG", LOG_SAMPLE_MAX_PER_SECOND=10, LOG_FORMAT="json")
+    predictions = [{"x": i, "y": i, "width": 5, "height": 5, "confidence": 0.9, "class": "caries"} for i in range(200)]
+
+    with correlation_scope("req-123"):
+        _parse_roboflow_result({"predictions": predictions})
+    logs.shutdown_logging()
+
+    entries = [json.loads(line) for line in capsys.readouterr().err.splitlines() if line.startswith("{")]
+    per_prediction = [e for e in entries if e.get("sample_key") == "roboflow_prediction"]
+    assert 1 <= len(per_prediction) <= 11
+    assert any("Parsed 200 of 200" in e["message"] for e in entries)
+    assert all(e["request_id"] == "req-123" for e in entries if e["logger"] == "app.stage.detection")
+
+
+def test_json_records_keep_the_traceback_apart(app_logging, capsys):
+    app_logging(LOG_FORMAT="json")
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        logging.getLogger("app.test").error("Failed: %s", "boom", exc_info=True)
+    logs.shutdown_logging()
+
+    entry = json.loads(capsys.readouterr().err.strip().splitlines()[-1])
+    assert entry["message"] == "Failed: boom"
+    assert "ValueError: boom" in entry["exception"]
+
+
+def test_requests_get_a_correlation_id():
+    client = TestClient(app)
+    generated = client.get("/")
+    assert len(generated.headers["X-Request-ID"]) == 16
+
+    assert client.get("/", headers={"X-Request-ID": "abc-123"}).headers["X-Request-ID"] == "abc-123"
+    # Anything that could forge log lines is replaced.
+    replaced = client.get("/", headers={"X-Request-ID": "bad id\nINFO forged"}).headers["X-Request-ID"]
+    assert replaced != "bad id\nINFO forged" and len(replaced) == 16
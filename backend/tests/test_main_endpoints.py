@@ -6,12 +6,12 @@ import io
 from PIL import Image 
 
 from app.main import app 
-from app.models import DiagnosisResponse 
+from app.models import DiagnosisResponse, RoboflowPrediction 
 
 client = TestClient(app)
 
 def create_dummy_dcm_file(filename="test.dcm") -> Path:
-    content = b"This is not a real DICOM file but for testing upload."
+    content = b"\x00" * 128 + b"DICM" + b"This is not a real DICOM file but for testing upload."
     test_file_path = Path(filename)
     with open(test_file_path, "wb") as f:
         f.write(content)
@@ -31,10 +31,10 @@ def test_read_root():
 
 def test_diagnose_image_success(mocker):
     mock_pil_image = Image.new('L', (100,100)) 
-    mock_base64_image = base64.b64encode(create_dummy_png_image_bytes()).decode('utf-8')
+    mock_png_image = create_dummy_png_image_bytes()
     mocker.patch(
-        "app.main.convert_dicom_to_pil_and_base64",  # <--- CORRECTED TARGET
-        return_value=(mock_pil_image, mock_base64_image, None)
+        "app.main.convert_dicom_file_to_pil_and_png",  # <--- CORRECTED TARGET
+        return_value=(mock_pil_image, mock_png_image, None)
     )
 
     mock_annotations = [
@@ -47,8 +47,8 @@ def test_diagnose_image_success(mocker):
 
     mock_report_text = "Mocked diagnostic report for cavity."
     mocker.patch(
-        "app.main.generate_llm_report",  # <--- CORRECTED TARGET
-        return_value=mock_report_text
+        "app.main.generate_llm_report_with_source",  # <--- CORRECTED TARGET
+        return_value=(mock_report_text, True)
     )
 
     dummy_file_path = create_dummy_dcm_file("test_success.dcm")
@@ -66,7 +66,11 @@ def test_diagnose_image_success(mocker):
         pytest.fail(f"Response validation failed: {e}\nResponse data: {data}")
 
     assert data["image_filename"] == "test_success.dcm"
-    assert data["converted_image_base64"] == mock_base64_image
+    assert data["converted_image_base64"] == ""
+    assert data["image_width"] == 100 and data["image_height"] == 100
+    image_response = client.get(f"/api/images/{data['image_id']}")
+    assert image_response.status_code == 200
+    assert image_response.content == mock_png_image
     assert len(data["annotations"]) == 1
     assert data["annotations"][0]["class"] == "cavity"
     assert data["annotations"][0]["confidence"] == 0.9
@@ -92,7 +96,7 @@ def test_diagnose_image_invalid_file_type():
 
 def test_diagnose_image_dicom_conversion_failure(mocker):
     mocker.patch(
-        "app.main.convert_dicom_to_pil_and_base64",  # <--- CORRECTED TARGET
+        "app.main.convert_dicom_file_to_pil_and_png",  # <--- CORRECTED TARGET
         return_value=(None, None, "Mocked DICOM conversion error")
     )
     
@@ -112,10 +116,10 @@ def test_diagnose_image_dicom_conversion_failure(mocker):
 
 def test_diagnose_image_roboflow_failure(mocker):
     mock_pil_image = Image.new('L', (100,100))
-    mock_base64_image = base64.b64encode(create_dummy_png_image_bytes()).decode('utf-8')
+    mock_png_image = create_dummy_png_image_bytes()
     mocker.patch(
-        "app.main.convert_dicom_to_pil_and_base64",   # <--- CORRECTED TARGET
-        return_value=(mock_pil_image, mock_base64_image, None)
+        "app.main.convert_dicom_file_to_pil_and_png",   # <--- CORRECTED TARGET
+        return_value=(mock_pil_image, mock_png_image, None)
     )
     mocker.patch(
         "app.main.detect_objects_roboflow_sdk",  # <--- CORRECTED TARGET
@@ -134,8 +138,355 @@ def test_diagnose_image_roboflow_failure(mocker):
     assert response.status_code == 200
     data = response.json()
     assert "Roboflow detection failed: Mocked Roboflow API error" in data["error"]
-    assert data["converted_image_base64"] == mock_base64_image
+    assert data["image_id"]
     assert len(data["annotations"]) == 0
     assert data["diagnostic_report"] == "No pathologies detected by the model, or an error occurred during detection."
 
-    dummy_file_path.unlink()
\ No newline at end of file
+    dummy_file_path.unlink()
+
+def test_diagnose_image_stage_saturated_returns_503(mocker):
+    from app.concurrency import StageSaturatedError
+
+    mocker.patch(
+        "app.main.run_cpu_bound",
+        side_effect=StageSaturatedError("decode", 7)
+    )
+
+    dummy_file_path = create_dummy_dcm_file("test_saturated.dcm")
+    with open(dummy_file_path, "rb") as f:
+        files = {"file": (dummy_file_path.name, f, "application/octet-stream")}
+        response = client.post("/api/diagnose", files=files)
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "7"
+    assert "decode" in response.json()["detail"]
+
+    dummy_file_path.unlink()
+
+
+def test_diagnose_image_repeat_upload_served_from_cache(mocker):
+    mock_pil_image = Image.new('L', (100,100))
+    mock_png_image = create_dummy_png_image_bytes()
+    convert_mock = mocker.patch(
+        "app.main.convert_dicom_file_to_pil_and_png",
+        return_value=(mock_pil_image, mock_png_image, None)
+    )
+    detect_mock = mocker.patch(
+        "app.main.detect_objects_roboflow_sdk",
+        return_value=([{"x": 5, "y": 5, "width": 2, "height": 2, "confidence": 0.8, "class": "caries"}], None)
+    )
+    report_mock = mocker.patch("app.main.generate_llm_report_with_source", return_value=("Cached report.", True))
+
+    dummy_file_path = create_dummy_dcm_file("test_cache.dcm")
+    responses = []
+    for _ in range(2):
+        with open(dummy_file_path, "rb") as f:
+            files = {"file": (dummy_file_path.name, f, "application/octet-stream")}
+            responses.append(client.post("/api/diagnose", files=files))
+
+    assert [r.status_code for r in responses] == [200, 200]
+    assert responses[0].json() == responses[1].json()
+    assert convert_mock.call_count == 1
+    assert detect_mock.call_count == 1
+    assert report_mock.call_count == 1
+
+    stats = client.get("/api/cache/stats").json()
+    assert stats["enabled"] is True
+    assert stats["hits"] >= 1
+
+    dummy_file_path.unlink()
+
+
+def test_diagnose_batch_streams_results_and_series_report(mocker):
+    import json
+    import zipfile
+
+    mock_png_image = create_dummy_png_image_bytes()
+
+    def fake_convert(contents):
+        if contents == b"broken":
+            return None, None, "Mocked DICOM conversion error"
+        return Image.new('L', (10, 10)), mock_png_image, None
+
+    mocker.patch("app.batch.convert_dicom_to_pil_and_png", side_effect=fake_convert)
+    detect_mock = mocker.patch(
+        "app.batch.detect_objects_roboflow_sdk_batch",
+        side_effect=lambda images: [
+            ([RoboflowPrediction(x=1, y=1, width=1, height=1, confidence=0.7, **{"class": "caries"})], None)
+            for _ in images
+        ]
+    )
+    series_mock = mocker.patch("app.batch.generate_series_report", return_value="Series report.")
+
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, "w") as archive:
+        archive.writestr("series/tooth_3.dcm", b"third image")
+        archive.writestr("series/notes.txt", b"ignored")
+
+    files = [
+        ("files", ("tooth_1.dcm", b"first image", "application/octet-stream")),
+        ("files", ("tooth_2.rvg", b"broken", "application/octet-stream")),
+        ("files", ("series.zip", zip_buffer.getvalue(), "application/zip")),
+    ]
+    response = client.post("/api/diagnose/batch", files=files)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    results = [line for line in lines if line["event"] == "result"]
+    assert len(results) == 3
+    assert sorted(r["index"] for r in results) == [0, 1, 2]
+    by_name = {r["result"]["image_filename"]: r["result"] for r in results}
+    assert "Failed to convert DICOM" in by_name["tooth_2.rvg"]["error"]
+    assert by_name["series/tooth_3.dcm"]["annotations"][0]["class"] == "caries"
+    assert by_name["tooth_1.dcm"]["error"] is None
+
+    assert lines[-1] == {"event": "series_report", "files": 3, "failed": 1, "diagnostic_report": "Series report."}
+    assert sum(len(call.args[0]) for call in detect_mock.call_args_list) == 2
+    series_mock.assert_called_once()
+    assert {name for name, _ in series_mock.call_args.args[0]} == {"tooth_1.dcm", "series/tooth_3.dcm"}
+
+
+def test_diagnose_batch_rejects_invalid_file_type():
+    files = [("files", ("notes.txt", b"text", "text/plain"))]
+    response = client.post("/api/diagnose/batch", files=files)
+    assert response.status_code == 400
+    assert "Invalid file type" in response.json()["detail"]
+
+
+def test_diagnose_batch_stage_exception_still_completes_stream(mocker):
+    import json
+
+    mock_png_image = create_dummy_png_image_bytes()
+    mocker.patch(
+        "app.batch.convert_dicom_to_pil_and_png",
+        return_value=(Image.new('L', (10, 10)), mock_png_image, None)
+    )
+    mocker.patch(
+        "app.batch.detect_objects_roboflow_sdk_batch",
+        side_effect=lambda images: [([], None) for _ in images]
+    )
+    mocker.patch("app.batch.summarize_annotations", side_effect=RuntimeError("summary exploded"))
+    mocker.patch("app.batch.generate_series_report", return_value="Series report.")
+
+    files = [
+        ("files", ("a.dcm", b"first", "application/octet-stream")),
+        ("files", ("b.dcm", b"second", "application/octet-stream")),
+    ]
+    response = client.post("/api/diagnose/batch", files=files)
+
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    results = [line["result"] for line in lines if line["event"] == "result"]
+    assert len(results) == 2
+    assert all("summary exploded" in r["error"] for r in results)
+    assert all("No pathologies detected" not in r["diagnostic_report"] for r in results)
+    assert lines[-1]["failed"] == 2
+
+
+def test_diagnose_batch_rejects_oversized_zip_before_extracting(mocker):
+    import zipfile
+
+    mocker.patch("app.main.settings.BATCH_MAX_TOTAL_BYTES", 1000)
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("bomb.dcm", b"\0" * 100_000)
+    read_spy = mocker.spy(zipfile.ZipFile, "open")
+
+    files = [("files", ("series.zip", zip_buffer.getvalue(), "application/zip"))]
+    response = client.post("/api/diagnose/batch", files=files)
+
+    assert response.status_code == 413
+    assert read_spy.call_count == 0
+
+
+def test_diagnose_batch_rejects_empty_zip_entry():
+    import zipfile
+
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, "w") as archive:
+        archive.writestr("empty.dcm", b"")
+
+    files = [("files", ("series.zip", zip_buffer.getvalue(), "application/zip"))]
+    response = client.post("/api/diagnose/batch", files=files)
+
+    assert response.status_code == 400
+    assert "Empty file" in response.json()["detail"]
+
+
+def test_diagnose_image_broken_decode_pool_returns_conversion_error(mocker):
+    from concurrent.futures.process import BrokenProcessPool
+
+    mocker.patch("app.main.run_cpu_bound", side_effect=BrokenProcessPool("worker died"))
+
+    dummy_file_path = create_dummy_dcm_file("test_broken_pool.dcm")
+    with open(dummy_file_path, "rb") as f:
+        files = {"file": (dummy_file_path.name, f, "application/octet-stream")}
+        response = client.post("/api/diagnose", files=files)
+
+    assert response.status_code == 200
+    assert "Failed to convert DICOM" in response.json()["error"]
+
+    dummy_file_path.unlink()
+
+
+def test_diagnose_image_simulated_fallback_report_is_not_cached(mocker):
+    mock_png_image = create_dummy_png_image_bytes()
+    mocker.patch(
+        "app.main.convert_dicom_file_to_pil_and_png",
+        return_value=(Image.new('L', (100,100)), mock_png_image, None)
+    )
+    mocker.patch(
+        "app.main.detect_objects_roboflow_sdk",
+        return_value=([{"x": 5, "y": 5, "width": 2, "height": 2, "confidence": 0.8, "class": "caries"}], None)
+    )
+    report_mock = mocker.patch(
+        "app.main.generate_llm_report_with_source",
+        return_value=("--- SIMULATED DIAGNOSTIC REPORT ---", False)
+    )
+
+    dummy_file_path = create_dummy_dcm_file("test_fallback.dcm")
+    for _ in range(2):
+        with open(dummy_file_path, "rb") as f:
+            files = {"file": (dummy_file_path.name, f, "application/octet-stream")}
+            assert client.post("/api/diagnose", files=files).status_code == 200
+
+    assert report_mock.call_count == 2
+
+    dummy_file_path.unlink()
+
+
+def test_image_endpoints_serve_binary_with_etag_preview_and_tiles():
+    from app.image_store import image_store
+
+    img = Image.linear_gradient('L').resize((1200, 700))
+    byte_arr = io.BytesIO()
+    img.save(byte_arr, format='PNG')
+    image_id = image_store.put(byte_arr.getvalue())
+
+    response = client.get(f"/api/images/{image_id}")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/png"
+    assert "immutable" in response.headers["cache-control"]
+    etag = response.headers["etag"]
+    assert client.get(f"/api/images/{image_id}", headers={"If-None-Match": etag}).status_code == 304
+
+    preview = client.get(f"/api/images/{image_id}/preview?size=256&format=jpeg")
+    assert preview.status_code == 200
+    assert preview.headers["content-type"] == "image/jpeg"
+    assert max(Image.open(io.BytesIO(preview.content)).size) == 256
+
+    info = client.get(f"/api/images/{image_id}/info").json()
+    assert (info["width"], info["height"], info["levels"]) == (1200, 700, 3)
+    tile = client.get(f"/api/images/{image_id}/tiles/0/2/1")
+    assert Image.open(io.BytesIO(tile.content)).size == (1200 - 1024, 700 - 512)
+    assert Image.open(io.BytesIO(client.get(f"/api/images/{image_id}/tiles/2/0/0").content)).size == (300, 175)
+    assert client.get(f"/api/images/{image_id}/tiles/3/0/0").status_code == 404
+    assert client.get("/api/images/0123456789abcdef0123456789abcdef").status_code == 404
+    assert client.get("/api/images/..%2Fsecret").status_code == 404
+
+
+def test_diagnose_image_inline_image_opt_in(mocker):
+    mock_png_image = create_dummy_png_image_bytes()
+    mocker.patch(
+        "app.main.convert_dicom_file_to_pil_and_png",
+        return_value=(Image.new('L', (60, 30)), mock_png_image, None)
+    )
+    mocker.patch("app.main.detect_objects_roboflow_sdk", return_value=([], "Mocked Roboflow API error"))
+
+    dummy_file_path = create_dummy_dcm_file("test_inline.dcm")
+    with open(dummy_file_path, "rb") as f:
+        files = {"file": (dummy_file_path.name, f, "application/octet-stream")}
+        response = client.post("/api/diagnose?inline_image=true", files=files)
+
+    assert base64.b64decode(response.json()["converted_image_base64"]) == mock_png_image
+
+    dummy_file_path.unlink()
+
+
+def test_diagnose_image_rejects_oversized_upload(mocker):
+    mocker.patch("app.ingest.settings.UPLOAD_MAX_BYTES", 100)
+    mocker.patch("app.ingest.settings.UPLOAD_CHUNK_BYTES", 16)
+    convert_mock = mocker.patch("app.main.convert_dicom_file_to_pil_and_png")
+
+    files = {"file": ("big.dcm", b"\x00" * 128 + b"DICM" + b"x" * 64, "application/octet-stream")}
+    response = client.post("/api/diagnose", files=files)
+
+    assert response.status_code == 413
+    assert convert_mock.call_count == 0
+
+
+def test_diagnose_image_rejects_file_without_dicom_magic(mocker):
+    convert_mock = mocker.patch("app.main.convert_dicom_file_to_pil_and_png")
+
+    files = {"file": ("fake.dcm", b"This is not a real DICOM file but for testing upload." * 4, "application/octet-stream")}
+    response = client.post("/api/diagnose", files=files)
+
+    assert response.status_code == 400
+    assert "DICM" in response.json()["detail"]
+    assert convert_mock.call_count == 0
+
+
+def test_diagnose_image_decodes_from_removed_temp_file(mocker):
+    import os
+
+    seen_paths = []
+
+    def fake_convert(path):
+        seen_paths.append(path)
+        with open(path, "rb") as f:
+            assert f.read(132)[128:] == b"DICM"
+        return Image.new('L', (60, 30)), create_dummy_png_image_bytes(), None
+
+    mocker.patch("app.main.convert_dicom_file_to_pil_and_png", side_effect=fake_convert)
+    mocker.patch("app.main.detect_objects_roboflow_sdk", return_value=([], "Mocked Roboflow API error"))
+
+    dummy_file_path = create_dummy_dcm_file("test_spooled.dcm")
+    with open(dummy_file_path, "rb") as f:
+        response = client.post("/api/diagnose", files={"file": (dummy_file_path.name, f, "application/octet-stream")})
+
+    assert response.status_code == 200
+    assert len(seen_paths) == 1 and not os.path.exists(seen_paths[0])
+
+    dummy_file_path.unlink()
+
+
+def test_diagnose_image_rejects_declared_oversized_body_before_parsing(mocker):
+    mocker.patch("app.main.settings.UPLOAD_MAX_BYTES", 10)
+    spool_mock = mocker.patch("app.main.spool_upload")
+
+    files = {"file": ("big.dcm", b"\x00" * 200 * 1024, "application/octet-stream")}
+    response = client.post("/api/diagnose", files=files)
+
+    assert response.status_code == 413
+    assert spool_mock.call_count == 0
+
+
+def test_importing_app_does_not_load_heavy_sdks():
+    # Startup cost: the SDKs are imported by the backends that use them, not by app.main.
+    import subprocess
+    import sys
+
+    code = (
+        "import sys, app.main; "
+        "print(','.join(m for m in ('pydicom', 'numpy', 'onnxruntime', 'requests', 'google.generativeai') "
+        "if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, timeout=60,
+        cwd=Path(__file__).resolve().parents[1], check=True,
+    )
+    assert result.stdout.strip() == ""
+
+
+def test_warmup_endpoint_reports_component_timings(mocker):
+    from app import warmup
+
+    mocker.patch.object(warmup, "_result", None)
+    with TestClient(app) as warm_client:
+        first = warm_client.post("/api/warmup").json()
+        second = warm_client.post("/api/warmup").json()
+
+    assert set(first["timings_ms"]) >= {"detector", "decoders", "clients", "total"}
+    assert second["already_warm"] is True
+    assert second["timings_ms"] == first["timings_ms"]
@@ -0,0 +1,90 @@
+import io
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from app import metrics
+from app.main import app
+
+client = TestClient(app)
+
+
+@pytest.fixture(autouse=True)
+def clean_metrics():
+    metrics.reset_metrics()
+    yield
+    metrics.reset_metrics()
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram("test_seconds", "Test.", ["stage"], buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value, "decode")
+    lines = histogram.render()
+    assert 'test_seconds_bucket{stage="decode",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{stage="decode",le="1"} 2' in lines
+    assert 'test_seconds_bucket{stage="decode",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{stage="decode"} 3' in lines
+
+
+def test_stage_timer_counts_errors():
+    with pytest.raises(RuntimeError):
+        with metrics.stage_timer("gemini"):
+            raise RuntimeError("boom")
+    assert metrics.STAGE_ERRORS.value("gemini") == 1
+    assert metrics.STAGE_SECONDS.count("gemini") == 1
+
+
+def test_stage_timer_is_noop_when_disabled(mocker):
+    mocker.patch("app.metrics.settings.METRICS_ENABLED", False)
+    timer = metrics.stage_timer("decode")
+    assert timer is metrics.stage_timer("windowing")
+    with timer:
+        pass
+    assert metrics.STAGE_SECONDS.count("decode") == 0
+    assert client.get("/metrics").status_code == 404
+
+
+def test_worker_timings_are_replayed_once():
+    def work():
+        with metrics.stage_timer("windowing"):
+            return 42
+
+    result, timings = metrics.run_with_stage_timings(work)
+    assert result == 42 and [stage for stage, _, _ in timings] == ["windowing"]
+    assert metrics.STAGE_SECONDS.count("windowing") == 0
+    metrics.record_stage_timings(timings)
+    assert metrics.STAGE_SECONDS.count("windowing") == 1
+
+
+def test_diagnose_records_stages_and_server_timing(mocker):
+    def fake_convert(path):
+        with metrics.stage_timer("windowing"):
+            pass
+        buffered = io.BytesIO()
+        Image.new("L", (60, 30)).save(buffered, format="PNG")
+        return Image.new("L", (60, 30)), buffered.getvalue(), None
+
+    mocker.patch("app.metrics.settings.SERVER_TIMING_ENABLED", True)
+    mocker.patch("app.main.convert_dicom_file_to_pil_and_png", side_effect=fake_convert)
+    mocker.patch("app.main.detect_objects_roboflow_sdk", return_value=([], "Mocked Roboflow API error"))
+
+    content = b"\x00" * 128 + b"DICM" + b"metrics test"
+    response = client.post("/api/diagnose", files={"file": ("m.dcm", content, "application/octet-stream")})
+
+    assert response.status_code == 200
+    server_timing = response.headers["Server-Timing"]
+    for stage in ("decode", "windowing", "inference", "report"):
+        assert f"{stage};dur=" in server_timing
+
+    body = client.get("/metrics").text
+    assert 'diagnose_stage_seconds_count{stage="windowing"} 1' in body
+    assert 'diagnose_stage_errors_total{stage="inference"} 1' in body
+    assert 'diagnose_payload_bytes_count{kind="upload"} 1' in body
+    assert 'http_request_duration_seconds_count{method="POST",route="/api/diagnose",status="200"} 1' in body
+    assert "http_requests_in_flight" in body
+
+
+def test_server_timing_header_is_off_by_default():
+    assert "Server-Timing" not in client.get("/").headers
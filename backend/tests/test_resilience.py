@@ -0,0 +1,161 @@
+import threading
+import time
+
+import pytest
+from PIL import Image
+
+from app import resilience
+from app.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    DeadlineExceededError,
+    call_timeout,
+    call_upstream,
+    deadline_scope,
+)
+from benchmarks.stub_servers import StubGeminiServer, StubRoboflowServer
+
+
+def test_call_timeout_follows_budget_and_reserve():
+    assert call_timeout(30.0) == 30.0
+    with deadline_scope(5.0):
+        assert 3.9 < call_timeout(30.0, reserve=1.0) <= 4.0
+        assert call_timeout(2.0, reserve=1.0) == 2.0
+        # Once the reserve cannot be afforded, the call gets what is left.
+        assert 4.9 < call_timeout(30.0, reserve=10.0) <= 5.0
+    with deadline_scope(0.01):
+        time.sleep(0.02)
+        with pytest.raises(DeadlineExceededError):
+            call_timeout(30.0)
+
+
+def test_circuit_breaker_opens_probes_and_closes():
+    breaker = CircuitBreaker("svc", failure_threshold=2, reset_seconds=0.05)
+    breaker.before_call()
+    breaker.record("error", failed=True)
+    breaker.before_call()
+    breaker.record("timeout", failed=True)
+    assert breaker.state == resilience.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    time.sleep(0.06)
+    breaker.before_call()
+    assert breaker.state == resilience.HALF_OPEN
+    # Only one probe at a time.
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record("success", failed=False)
+    assert breaker.state == resilience.CLOSED
+    assert breaker.snapshot()["counts"] == {"error": 1, "timeout": 1, "success": 1}
+
+
+def test_client_errors_do_not_trip_the_breaker(mocker):
+    mocker.patch("app.resilience.settings.BREAKER_FAILURE_THRESHOLD", 1)
+
+    class Rejected(Exception):
+        code = 400
+
+    def call(timeout):
+        raise Rejected()
+
+    for _ in range(3):
+        with pytest.raises(Rejected):
+            call_upstream("svc", call, cap=1.0)
+    assert resilience.upstream_snapshot()["svc"]["state"] == resilience.CLOSED
+
+
+def test_hedged_call_returns_the_faster_copy():
+    calls = []
+    lock = threading.Lock()
+
+    def call(timeout):
+        with lock:
+            calls.append(timeout)
+            first = len(calls) == 1
+        time.sleep(1.0 if first else 0.01)
+        return "slow" if first else "fast"
+
+    started = time.perf_counter()
+    assert call_upstream("svc", call, cap=5.0, hedge_after=0.05) == "fast"
+    assert time.perf_counter() - started < 0.5
+    assert len(calls) == 2
+
+
+@pytest.fixture
+def roboflow_stub(mocker):
+    from app import clients, services
+
+    def start(**stub_options):
+        server = StubRoboflowServer(**stub_options).__enter__()
+        mocker.patch("app.services.settings.ROBOFLOW_API_KEY", "test-key")
+        mocker.patch("app.services.settings.ROBOFLOW_MODEL_ID", "adr/6")
+        mocker.patch("app.clients.settings.ROBOFLOW_API_URL", server.url)
+        mocker.patch("app.services._detector", services.RoboflowDetector())
+        clients.close_clients()
+        servers.append(server)
+        return server
+
+    servers = []
+    yield start
+    clients.close_clients()
+    for server in servers:
+        server.__exit__(None, None, None)
+
+
+def test_slow_roboflow_is_cut_off_by_the_budget_then_skipped(mocker, roboflow_stub):
+    from app import services
+
+    mocker.patch("app.resilience.settings.BREAKER_FAILURE_THRESHOLD", 2)
+    mocker.patch("app.services.settings.REPORT_RESERVE_SECONDS", 0.0)
+    server = roboflow_stub(response_delay=1.0)
+
+    started = time.perf_counter()
+    for _ in range(2):
+        with deadline_scope(0.2):
+            predictions, error = services.detect_objects_roboflow_sdk(Image.new("L", (16, 16)))
+        assert predictions == [] and "timed out" in error
+    assert time.perf_counter() - started < 1.5
+
+    # The circuit is open: detection is skipped without calling the service.
+    predictions, error = services.detect_objects_roboflow_sdk(Image.new("L", (16, 16)))
+    assert predictions == [] and error.startswith("Detection skipped")
+    assert len(server.requests) == 2
+    assert resilience.upstream_snapshot()["roboflow"]["counts"] == {"timeout": 2, "short_circuited": 1}
+
+
+def test_roboflow_hedge_against_stub(mocker, roboflow_stub):
+    from app import services
+
+    mocker.patch("app.services.settings.ROBOFLOW_HEDGE_AFTER_SECONDS", 0.1)
+    server = roboflow_stub(response_delays=[1.0])
+
+    started = time.perf_counter()
+    predictions, error = services.detect_objects_roboflow_sdk(Image.new("L", (16, 16)))
+    assert error is None and predictions[0].class_name == "caries"
+    assert time.perf_counter() - started < 0.8
+    assert len(server.requests) == 2
+
+
+def test_open_gemini_circuit_falls_back_to_simulated_report(mocker):
+    from app import clients, services
+    from app.models import RoboflowPrediction
+
+    mocker.patch("app.services.settings.GEMINI_API_KEY", "test-key")
+    mocker.patch("app.services.settings.REPORT_CACHE_ENABLED", False)
+    mocker.patch("app.services.report_cache", None)
+    mocker.patch("app.resilience.settings.BREAKER_FAILURE_THRESHOLD", 1)
+    annotations = [RoboflowPrediction(x=1, y=1, width=2, height=2, confidence=0.9, **{"class": "caries"})]
+    with StubGeminiServer(status=503) as server:
+        mocker.patch("app.clients.settings.GEMINI_API_ENDPOINT", server.url)
+        clients.close_clients()
+        try:
+            first, first_final = services.generate_llm_report_with_source(annotations)
+            second, second_final = services.generate_llm_report_with_source(annotations)
+        finally:
+            clients.close_clients()
+
+    assert not first_final and not second_final
+    assert first == second
+    assert len([r for r in server.requests if r["method"] == "POST"]) == 1
+    assert resilience.upstream_snapshot()["gemini"]["state"] == resilience.OPEN
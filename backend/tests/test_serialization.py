@@ -0,0 +1,99 @@
+import io
+import json
+
+import msgpack
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from app.main import app
+from app.models import DiagnosisResponse, RoboflowPrediction
+from app.serialization import (
+    JSON_MEDIA_TYPE,
+    MSGPACK_MEDIA_TYPE,
+    columnar_annotations,
+    diagnosis_content,
+    encode_diagnosis,
+    negotiate,
+)
+
+client = TestClient(app)
+
+DICOM_BYTES = b"\x00" * 128 + b"DICM" + b"Not a real DICOM file, the decode stage is mocked."
+
+
+def prediction(x: float, class_name: str, confidence: float = 0.9) -> RoboflowPrediction:
+    return RoboflowPrediction(x=x, y=x + 1, width=10, height=20, confidence=confidence, **{"class": class_name})
+
+
+def png_bytes() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("L", (64, 48), color="grey").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def mock_pipeline(mocker, annotations):
+    png = png_bytes()
+    mocker.patch("app.main.convert_dicom_file_to_pil_and_png", return_value=(Image.new("L", (64, 48)), png, None))
+    mocker.patch("app.main.detect_objects_roboflow_sdk", return_value=(annotations, None))
+    mocker.patch("app.main.generate_llm_report_with_source", return_value=("Report.", True))
+    return png
+
+
+def test_negotiate_prefers_msgpack_only_when_asked():
+    assert negotiate(None) == JSON_MEDIA_TYPE
+    assert negotiate("*/*") == JSON_MEDIA_TYPE
+    assert negotiate("application/msgpack") == MSGPACK_MEDIA_TYPE
+    assert negotiate("application/x-msgpack, application/json;q=0.5") == MSGPACK_MEDIA_TYPE
+    assert negotiate("application/msgpack;q=0.2, application/json") == JSON_MEDIA_TYPE
+    assert negotiate("text/html") == JSON_MEDIA_TYPE
+
+
+def test_columnar_annotations_share_class_names():
+    columns = columnar_annotations([prediction(1, "caries"), prediction(2, "calculus", 0.5), prediction(3, "caries")])
+    assert columns["classes"] == ["caries", "calculus"]
+    assert columns["class_id"] == [0, 1, 0]
+    assert columns["x"] == [1, 2, 3]
+    assert columns["confidence"] == [0.9, 0.5, 0.9]
+    assert columnar_annotations([])["classes"] == []
+
+
+def test_json_encoding_matches_the_model_dump():
+    response = DiagnosisResponse(
+        image_filename="a.dcm", image_id="abc", annotations=[prediction(5, "caries")], diagnostic_report="Report."
+    )
+    encoded = encode_diagnosis(response)
+    assert encoded.media_type == JSON_MEDIA_TYPE
+    assert json.loads(encoded.body) == json.loads(response.model_dump_json(by_alias=True))
+    assert diagnosis_content(response, image_png=b"png")["converted_image"] == b"png"
+
+
+def test_diagnose_msgpack_carries_the_image_as_bytes(mocker):
+    png = mock_pipeline(mocker, [prediction(5, "caries")])
+
+    response = client.post(
+        "/api/diagnose?inline_image=true",
+        files={"file": ("binary.dcm", DICOM_BYTES, "application/octet-stream")},
+        headers={"Accept": "application/msgpack"},
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == MSGPACK_MEDIA_TYPE
+    data = msgpack.unpackb(response.content)
+    assert data["converted_image"] == png
+    assert "converted_image_base64" not in data
+    assert data["annotations"][0]["class"] == "caries"
+    assert data["diagnostic_report"] == "Report."
+
+
+def test_diagnose_columnar_annotations_in_json(mocker):
+    mock_pipeline(mocker, [prediction(5, "caries"), prediction(7, "calculus")])
+
+    response = client.post(
+        "/api/diagnose?columnar_annotations=true",
+        files={"file": ("columnar.dcm", DICOM_BYTES, "application/octet-stream")},
+    )
+
+    assert response.status_code == 200
+    annotations = response.json()["annotations"]
+    assert annotations["classes"] == ["caries", "calculus"]
+    assert annotations["x"] == [5, 7] and annotations["class_id"] == [0, 1]
@@ -0,0 +1,170 @@
+import pydicom
+import pytest
+
+from app.models import RoboflowPrediction
+from app.services import convert_dicom_to_pil_and_png, generate_series_report, summarize_annotations
+
+
+def make_prediction(class_name: str, confidence: float) -> RoboflowPrediction:
+    return RoboflowPrediction(x=10, y=10, width=5, height=5, confidence=confidence, **{"class": class_name})
+
+
+def test_summarize_annotations():
+    assert "No pathologies detected" in summarize_annotations([])
+    summary = summarize_annotations([make_prediction("caries", 0.91)])
+    assert "caries (Confidence: 91%)" in summary
+
+
+def test_generate_series_report_simulated_covers_all_images(mocker):
+    mocker.patch("app.services.settings.GEMINI_API_KEY", None)
+    report = generate_series_report([
+        ("a.dcm", [make_prediction("caries", 0.8)]),
+        ("b.dcm", []),
+        ("c.dcm", [make_prediction("periapical lesion", 0.6)]),
+    ])
+    assert report.startswith("--- SIMULATED SERIES DIAGNOSTIC REPORT ---")
+    assert "3 radiographic images" in report
+    assert "a.dcm: caries (80%)" in report
+    assert "c.dcm: periapical lesion (60%)" in report
+
+
+def test_generate_series_report_without_findings():
+    assert "No pathologies detected" in generate_series_report([("a.dcm", []), ("b.dcm", [])])
+
+
+def test_generate_llm_report_with_source_flags_simulated_fallback(mocker):
+    from app.services import generate_llm_report_with_source
+
+    mocker.patch("app.services.settings.GEMINI_API_KEY", "test-key")
+    mocker.patch("app.services._generate_gemini_text", return_value=None)
+    report, is_final = generate_llm_report_with_source([make_prediction("caries", 0.8)])
+    assert report.startswith("--- SIMULATED DIAGNOSTIC REPORT ---")
+    assert is_final is False
+
+    mocker.patch("app.services._generate_gemini_text", return_value="Gemini report.")
+    assert generate_llm_report_with_source([make_prediction("caries", 0.8)]) == ("Gemini report.", True)
+
+
+def test_convert_dicom_file_rejects_oversized_image_from_header(mocker, tmp_path):
+    import numpy as np
+    from pydicom.dataset import FileMetaDataset
+    from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+    from app.services import convert_dicom_file_to_pil_and_png
+
+    ds = pydicom.Dataset()
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds.file_meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.1.1"
+    ds.file_meta.MediaStorageSOPInstanceUID = generate_uid()
+    ds.Rows, ds.Columns = 32, 48
+    ds.SamplesPerPixel, ds.PhotometricInterpretation = 1, "MONOCHROME2"
+    ds.BitsAllocated, ds.BitsStored, ds.HighBit, ds.PixelRepresentation = 16, 12, 11, 0
+    ds.PixelData = (np.arange(32 * 48, dtype=np.uint16) % 4096).tobytes()
+    path = tmp_path / "image.dcm"
+    ds.save_as(path, enforce_file_format=True)
+
+    pil_image, png_bytes, error = convert_dicom_file_to_pil_and_png(str(path))
+    assert error is None
+    assert pil_image.size == (48, 32) and png_bytes.startswith(b"\x89PNG")
+
+    mocker.patch("app.services.settings.DECODE_MAX_PIXEL_BYTES", 1024)
+    dcmread = mocker.spy(pydicom, "dcmread")
+    pil_image, png_bytes, error = convert_dicom_file_to_pil_and_png(str(path))
+    assert pil_image is None and "limit" in error
+    assert dcmread.call_args.kwargs == {"stop_before_pixels": True}
+
+
+def test_findings_signature_is_order_and_case_insensitive():
+    from app.services import findings_signature
+
+    a = findings_signature([make_prediction("Caries", 0.87), make_prediction("periapical lesion", 0.61), make_prediction("caries", 0.82)])
+    b = findings_signature([make_prediction("periapical lesion", 0.65), make_prediction("caries", 0.81), make_prediction("caries", 0.89)])
+    assert a == b
+    assert a.endswith("caries x2@0.8,0.8;periapical lesion x1@0.6")
+    assert findings_signature([make_prediction("caries", 0.91)]) != findings_signature([make_prediction("caries", 0.81)])
+
+
+def test_llm_report_is_cached_by_findings_signature(mocker):
+    from app.services import generate_llm_report_with_source
+
+    mocker.patch("app.services.settings.GEMINI_API_KEY", "test-key")
+    gemini = mocker.patch("app.services._generate_gemini_text", return_value="Gemini report.")
+
+    first = generate_llm_report_with_source([make_prediction("caries", 0.84)])
+    second = generate_llm_report_with_source([make_prediction("caries", 0.88)])
+
+    assert first == second == ("Gemini report.", True)
+    assert gemini.call_count == 1
+    prompt = gemini.call_args.args[0]
+    assert "caries (Confidence: 0.80-0.90)" in prompt
+
+
+def test_concurrent_identical_findings_share_one_llm_call(mocker):
+    import threading
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    from app.cache import report_cache
+    from app.services import generate_llm_report_with_source
+
+    calls = []
+    release = threading.Event()
+
+    def slow_gemini(prompt):
+        calls.append(prompt)
+        release.wait(5)
+        return "Shared report."
+
+    mocker.patch("app.services.settings.GEMINI_API_KEY", "test-key")
+    mocker.patch("app.services._generate_gemini_text", side_effect=slow_gemini)
+
+    before = report_cache.stats()
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures = [pool.submit(generate_llm_report_with_source, [make_prediction("caries", 0.8)]) for _ in range(8)]
+        while not calls:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert len(calls) == 1
+    assert results == [("Shared report.", True)] * 8
+    after = report_cache.stats()
+    assert (after["coalesced"] - before["coalesced"]) + (after["hits"] - before["hits"]) == 7
+
+
+def test_simulated_fallback_report_is_not_cached(mocker):
+    from app.services import generate_llm_report_with_source
+
+    mocker.patch("app.services.settings.GEMINI_API_KEY", "test-key")
+    gemini = mocker.patch("app.services._generate_gemini_text", side_effect=[None, "Gemini report."])
+
+    assert generate_llm_report_with_source([make_prediction("caries", 0.8)])[1] is False
+    assert generate_llm_report_with_source([make_prediction("caries", 0.8)]) == ("Gemini report.", True)
+    assert gemini.call_count == 2
+
+
+@pytest.mark.parametrize("options", [
+    {},
+    {"bits_stored": 8},
+    {"bits_stored": 16},
+    {"photometric": "MONOCHROME1"},
+    {"frames": 3},
+    {"transfer_syntax": "deflate"},
+    {"transfer_syntax": "rle"},
+    {"transfer_syntax": "jpeg2000"},
+])
+def test_synthetic_dicom_variants_convert(options):
+    import numpy as np
+
+    from benchmarks.dicom_synth import make_dicom
+
+    baseline, _, _ = convert_dicom_to_pil_and_png(make_dicom(width=96, height=64))
+    pil_image, png_bytes, error = convert_dicom_to_pil_and_png(make_dicom(width=96, height=64, **options))
+
+    assert error is None and png_bytes
+    assert pil_image.size == (96, 64)
+    # Every variant encodes the same radiograph, so it should display the same.
+    difference = np.abs(np.asarray(pil_image, dtype=int) - np.asarray(baseline, dtype=int))
+    assert difference.mean() < 4
@@ -0,0 +1,150 @@
+import io
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from app import clients, services
+from app.main import app
+from app.models import RoboflowPrediction
+from benchmarks.stub_servers import DEFAULT_REPORT, StubGeminiServer
+
+client = TestClient(app)
+
+DICOM_BYTES = b"\x00" * 128 + b"DICM" + b"Not a real DICOM file, the decode stage is mocked."
+ANNOTATIONS = [RoboflowPrediction(x=50, y=50, width=10, height=10, confidence=0.9, **{"class": "caries"})]
+
+
+def parse_sse(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def png_bytes() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("L", (64, 48), color="grey").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def gemini_stub(mocker):
+    mocker.patch("app.services.settings.GEMINI_API_KEY", "test-key")
+    servers = []
+
+    def start(**stub_options):
+        server = StubGeminiServer(**stub_options).__enter__()
+        servers.append(server)
+        mocker.patch("app.clients.settings.GEMINI_API_ENDPOINT", server.url)
+        clients.close_clients()
+        return server
+
+    yield start
+    clients.close_clients()
+    for server in servers:
+        server.__exit__(None, None, None)
+
+
+def test_text_chunks_join_back_into_the_text():
+    text = "--- SIMULATED REPORT ---\nAutomated  analysis suggests caries. Clinical correlation is advised."
+    chunks = list(services.text_chunks(text, size=10))
+    assert "".join(chunks) == text
+    assert len(chunks) > 3
+    assert list(services.text_chunks("")) == []
+
+
+def test_stream_llm_report_streams_gemini_and_caches_it(gemini_stub):
+    server = gemini_stub(stream_chunk_words=3)
+    events = []
+    report, source = services.stream_llm_report(ANNOTATIONS, lambda kind, text: events.append((kind, text)))
+
+    assert source == "gemini"
+    assert report == DEFAULT_REPORT
+    assert len(events) > 1 and all(kind == "chunk" for kind, _ in events)
+    assert "".join(text for _, text in events) == DEFAULT_REPORT
+    assert server.requests[-1]["path"].endswith(":streamGenerateContent")
+
+    # The assembled report serves the next stream and non-streaming callers from the report cache.
+    cached_events = []
+    assert services.stream_llm_report(ANNOTATIONS, lambda kind, text: cached_events.append(text)) == (report, "cache")
+    assert "".join(cached_events) == report
+    assert services.generate_llm_report_with_source(ANNOTATIONS) == (report, True)
+    assert len([r for r in server.requests if r["method"] == "POST"]) == 1
+
+
+def test_stream_failing_mid_way_is_reset_to_the_simulated_report(gemini_stub):
+    gemini_stub(stream_chunk_words=3, stream_fail_after=2)
+    events = []
+    report, source = services.stream_llm_report(ANNOTATIONS, lambda kind, text: events.append((kind, text)))
+
+    assert source == "simulated"
+    kinds = [kind for kind, _ in events]
+    assert kinds[:2] == ["chunk", "chunk"] and kinds[2] == "reset"
+    assert "".join(text for _, text in events[3:]) == report
+    assert "SIMULATED" in report
+
+
+def test_diagnose_stream_sends_detection_before_the_report(mocker):
+    mocker.patch("app.main.convert_dicom_file_to_pil_and_png", return_value=(Image.new("L", (64, 48)), png_bytes(), None))
+    mocker.patch("app.main.detect_objects_roboflow_sdk", return_value=(ANNOTATIONS, None))
+    mocker.patch("app.services.settings.GEMINI_API_KEY", None)
+
+    response = client.post("/api/diagnose/stream", files={"file": ("stream.dcm", DICOM_BYTES, "application/octet-stream")})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = parse_sse(response.text)
+    assert events[0][0] == "diagnosis"
+    diagnosis = events[0][1]
+    assert diagnosis["diagnostic_report"] == ""
+    assert diagnosis["annotations"][0]["class"] == "caries"
+    assert diagnosis["image_width"] == 64 and diagnosis["image_id"]
+
+    chunks = [data["text"] for event, data in events if event == "report_chunk"]
+    assert len(chunks) > 1
+    assert events[-1][0] == "report_done"
+    done = events[-1][1]
+    assert done["source"] == "simulated"
+    assert done["diagnostic_report"] == "".join(chunks)
+    assert done["ttft_ms"] > 0
+
+
+def test_diagnose_stream_caches_a_final_report_for_both_endpoints(mocker):
+    mocker.patch("app.main.convert_dicom_file_to_pil_and_png", return_value=(Image.new("L", (64, 48)), png_bytes(), None))
+    detect = mocker.patch("app.main.detect_objects_roboflow_sdk", return_value=(ANNOTATIONS, None))
+
+    def fake_stream(annotations, emit):
+        for piece in ("Caries on ", "the left ", "molar."):
+            emit("chunk", piece)
+        return "Caries on the left molar.", "gemini"
+
+    mocker.patch("app.main.stream_llm_report", side_effect=fake_stream)
+    files = {"file": ("cached.dcm", DICOM_BYTES, "application/octet-stream")}
+
+    first = parse_sse(client.post("/api/diagnose/stream", files=files).text)
+    assert first[-1][1]["source"] == "gemini"
+    assert [data["text"] for event, data in first if event == "report_chunk"] == ["Caries on ", "the left ", "molar."]
+
+    second = parse_sse(client.post("/api/diagnose/stream", files=files).text)
+    assert [event for event, _ in second] == ["diagnosis", "report_chunk", "report_done"]
+    assert second[-1][1] == {"diagnostic_report": "Caries on the left molar.", "source": "cache", "ttft_ms": second[-1][1]["ttft_ms"]}
+
+    plain = client.post("/api/diagnose", files=files).json()
+    assert plain["diagnostic_report"] == "Caries on the left molar."
+    assert detect.call_count == 1
+
+
+def test_diagnose_stream_reports_failed_detection_in_the_stream(mocker):
+    mocker.patch("app.main.convert_dicom_file_to_pil_and_png", return_value=(Image.new("L", (64, 48)), png_bytes(), None))
+    mocker.patch("app.main.detect_objects_roboflow_sdk", return_value=([], "upstream down"))
+
+    events = parse_sse(client.post(
+        "/api/diagnose/stream", files={"file": ("failed.dcm", DICOM_BYTES, "application/octet-stream")}
+    ).text)
+
+    assert "upstream down" in events[0][1]["error"]
+    assert events[-1][1]["source"] == "static"
+    assert events[-1][1]["diagnostic_report"].startswith("No pathologies detected")
@@ -0,0 +1,115 @@
+import numpy as np
+from PIL import Image
+
+from app.detector import Detector
+from app.models import RoboflowPrediction
+from app.tiling import detect_tiled, merge_detections, pairwise_ios, tile_boxes
+
+
+class BrightRegionDetector(Detector):
+    """Reports the bounding box of the bright pixels in each input, like a one-lesion model."""
+
+    name = "bright"
+
+    def __init__(self):
+        self.sizes = []
+
+    def detect_batch(self, pil_images):
+        results = []
+        for image in pil_images:
+            self.sizes.append(image.size)
+            ys, xs = np.nonzero(np.asarray(image) > 128)
+            if xs.size == 0:
+                results.append(([], None))
+                continue
+            x1, y1, x2, y2 = xs.min(), ys.min(), xs.max() + 1, ys.max() + 1
+            results.append(([RoboflowPrediction(
+                x=(x1 + x2) / 2, y=(y1 + y2) / 2, width=x2 - x1, height=y2 - y1,
+                confidence=0.5 + 0.4 * (x2 - x1) * (y2 - y1) / 3600, class_name="caries",
+            )], None))
+        return results
+
+
+def test_tile_boxes_cover_the_image_with_overlap():
+    boxes = tile_boxes(2500, 1200, 1024, 0.2)
+    assert boxes[0] == (0, 0, 1024, 1024)
+    assert boxes[-1] == (2500 - 1024, 1200 - 1024, 2500, 1200)
+    covered = np.zeros((1200, 2500), dtype=bool)
+    for left, top, right, bottom in boxes:
+        assert right - left == 1024 and bottom - top == 1024
+        covered[top:bottom, left:right] = True
+    assert covered.all()
+    assert tile_boxes(500, 400, 1024, 0.2) == [(0, 0, 500, 400)]
+
+
+def test_pairwise_ios_matches_a_cut_off_box_to_the_whole_one():
+    boxes = np.array([[0, 0, 10, 10], [5, 0, 10, 10], [20, 20, 30, 30]], dtype=float)
+    ios = pairwise_ios(boxes)
+    assert ios[0, 1] == 1.0 and ios[0, 2] == 0.0
+
+
+def test_merge_detections_nms_and_wbf():
+    boxes = np.array([[0, 0, 10, 10], [2, 0, 12, 10], [0, 0, 10, 10], [50, 50, 60, 60]], dtype=float)
+    scores = np.array([0.9, 0.3, 0.8, 0.7])
+    class_ids = np.array([0, 0, 1, 0])
+
+    kept_boxes, kept_scores, kept_classes = merge_detections(boxes, scores, class_ids, "nms", 0.5)
+    assert sorted(kept_scores.tolist()) == [0.7, 0.8, 0.9]
+
+    fused_boxes, fused_scores, fused_classes = merge_detections(boxes, scores, class_ids, "wbf", 0.5)
+    first = np.flatnonzero((fused_classes == 0) & (fused_boxes[:, 0] < 20))[0]
+    assert np.allclose(fused_boxes[first], [0.5, 0, 10.5, 10])
+    assert np.isclose(fused_scores[first], 0.6)
+    assert len(fused_scores) == 3
+
+
+def test_detect_tiled_merges_a_lesion_split_across_tiles(mocker):
+    mocker.patch("app.tiling.settings.TILING_THRESHOLD_PIXELS", 1000)
+    mocker.patch("app.tiling.settings.TILING_TILE_SIZE", 600)
+    mocker.patch("app.tiling.settings.TILING_OVERLAP", 0.25)
+    pixels = np.zeros((800, 1500), dtype=np.uint8)
+    # Straddles the seams between the first tiles (at x=450..600 and y=450..600).
+    pixels[430:490, 420:480] = 255
+    large = Image.fromarray(pixels)
+    small = Image.fromarray(pixels[300:700, 300:700])
+
+    detector = BrightRegionDetector()
+    (large_predictions, large_error), (small_predictions, small_error) = detect_tiled(detector, [large, small])
+
+    assert large_error is None and small_error is None
+    assert len(large_predictions) == 1
+    merged = large_predictions[0]
+    assert (merged.x, merged.y, merged.width, merged.height) == (450, 460, 60, 60)
+    # Tiles, the whole image, and the small image untiled, all in one detector call.
+    assert len(detector.sizes) == len(tile_boxes(1500, 800, 600, 0.25)) + 2
+    assert detector.sizes[-1] == (400, 400)
+    assert small_predictions[0].width == 60
+
+
+def test_detect_tiled_reports_failed_tiles(mocker):
+    mocker.patch("app.tiling.settings.TILING_THRESHOLD_PIXELS", 100)
+    mocker.patch("app.tiling.settings.TILING_TILE_SIZE", 100)
+
+    class FailingDetector(Detector):
+        name = "failing"
+
+        def detect_batch(self, pil_images):
+            return [([], "boom" if index == 1 else None) for index in range(len(pil_images))]
+
+    predictions, error = detect_tiled(FailingDetector(), [Image.new("L", (250, 100))])[0]
+    assert predictions == []
+    assert error.startswith("Tiled detection failed on 1 of") and error.endswith("boom")
+
+
+def test_detection_tiles_only_above_threshold(mocker):
+    from app import services
+
+    detector = BrightRegionDetector()
+    mocker.patch("app.services._detector", detector)
+    mocker.patch("app.services.settings.TILING_THRESHOLD_PIXELS", 1000)
+    tiled = mocker.patch("app.tiling.detect_tiled", return_value=[([], None)])
+
+    services.detect_objects_roboflow_sdk(Image.new("L", (800, 600)))
+    tiled.assert_not_called()
+    services.detect_objects_roboflow_sdk(Image.new("L", (1600, 600)))
+    tiled.assert_called_once()
@@ -0,0 +1,57 @@
+import numpy as np
+
+from app.windowing import get_window_lut, window_to_uint8
+
+
+def reference_window(values, window_center, window_width):
+    lower = window_center - window_width / 2
+    clipped = np.clip(values.astype(np.float64), lower, lower + window_width)
+    return ((clipped - lower) / window_width * 255.0).astype(np.uint8)
+
+
+def test_lut_matches_float64_reference_for_16bit_data():
+    rng = np.random.default_rng(1)
+    for dtype, low, high in ((np.uint16, 0, 4096), (np.int16, -2000, 2000)):
+        pixels = rng.integers(low, high, size=(64, 48)).astype(dtype)
+        result = window_to_uint8(pixels, window_center=300.0, window_width=1500.0)
+        assert result.dtype == np.uint8
+        assert result.shape == pixels.shape
+        np.testing.assert_array_equal(result, reference_window(pixels, 300.0, 1500.0))
+
+
+def test_rescale_and_monochrome1_are_applied():
+    pixels = np.array([[0, 1024, 2048]], dtype=np.uint16)
+    result = window_to_uint8(
+        pixels,
+        window_center=0.0,
+        window_width=2048.0,
+        slope=1.0,
+        intercept=-1024.0,
+        photometric_interpretation="MONOCHROME1",
+    )
+    np.testing.assert_array_equal(result, 255 - np.array([[0, 127, 255]], dtype=np.uint8))
+
+
+def test_min_max_fallback_and_degenerate_window():
+    pixels = np.array([[10, 20], [30, 40]], dtype=np.uint16)
+    np.testing.assert_array_equal(window_to_uint8(pixels), [[0, 85], [170, 255]])
+
+    flat = np.full((2, 2), 7, dtype=np.uint16)
+    np.testing.assert_array_equal(window_to_uint8(flat), np.zeros((2, 2), dtype=np.uint8))
+    np.testing.assert_array_equal(window_to_uint8(pixels, 20.0, 0.0), np.zeros((2, 2), dtype=np.uint8))
+
+
+def test_lut_is_cached_across_calls():
+    get_window_lut.cache_clear()
+    pixels = np.arange(16, dtype=np.uint16).reshape(4, 4)
+    window_to_uint8(pixels, 100.0, 200.0)
+    window_to_uint8(pixels + 1, 100.0, 200.0)
+    assert get_window_lut.cache_info().hits == 1
+
+
+def test_float_data_uses_float32_path():
+    pixels = np.linspace(0.0, 1000.0, 12, dtype=np.float64).reshape(3, 4)
+    result = window_to_uint8(pixels, window_center=500.0, window_width=1000.0)
+    expected = reference_window(pixels, 500.0, 1000.0)
+    assert result.dtype == np.uint8
+    assert np.max(np.abs(result.astype(int) - expected.astype(int))) <= 1
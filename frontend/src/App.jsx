@@ -1,5 +1,4 @@
 import React, { useState, useEffect, useCallback } from 'react';
-import axios from 'axios';
 import ImageUpload from './components/ImageUpload';
 import ImageViewer from './components/ImageViewer';
 import ReportDisplay from './components/ReportDisplay';
@@ -7,6 +6,30 @@ import DarkModeToggle from './components/DarkModeToggle';
 import './App.css'; 
 
 
+// Reads a Server-Sent Events body from fetch, calling onEvent(name, data) for each event.
+async function readEventStream(response, onEvent) {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  for (;;) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const block = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      let event = 'message';
+      const data = [];
+      for (const line of block.split('\n')) {
+        if (line.startsWith('event: ')) event = line.slice(7);
+        else if (line.startsWith('data: ')) data.push(line.slice(6));
+      }
+      if (data.length) onEvent(event, JSON.parse(data.join('\n')));
+    }
+  }
+}
+
 function App() {
   const [isDarkMode, setIsDarkMode] = useState(() => {
     const savedMode = localStorage.getItem('darkMode');
@@ -58,46 +81,70 @@ function App() {
         imageSrc: '', 
         annotations: [], 
         report: '', 
+        timings: '',
         error: '' 
     };
 
-    try {
-      const apiUrl = `${import.meta.env.VITE_API_BASE_URL}/diagnose`;
-      const response = await axios.post(apiUrl, formData, {
-        headers: { 'Content-Type': 'multipart/form-data' },
-      });
-      const data = response.data;
-
-      if (data.error && !data.converted_image_base64) { 
-        fileSpecificResult.error = data.error;
-        setError(`Error (file: ${fileToProcess.name}): ${data.error}`); 
-      } else {
-        if (data.converted_image_base64) {
-          fileSpecificResult.imageSrc = `data:image/png;base64,${data.converted_image_base64}`;
+    // The result is listed as soon as detection finishes and its report fills in as it streams.
+    const showResult = () => {
+      const snapshot = { ...fileSpecificResult };
+      setResults(prevResults => {
+        const index = prevResults.findIndex(res => res.id === snapshot.id);
+        if (index !== -1) {
+          return prevResults.map(res => (res.id === snapshot.id ? snapshot : res));
         }
-        fileSpecificResult.annotations = data.annotations || [];
-        fileSpecificResult.report = data.diagnostic_report || 'No report generated.';
-        if (data.error) { 
-          fileSpecificResult.error = `Note: ${data.error}`;
+        const updatedResults = [...prevResults, snapshot];
+        if (activeResultIndex === null && updatedResults.length === 1) {
+            setActiveResultIndex(0);
         }
+        return updatedResults;
+      });
+    };
+
+    try {
+      const apiUrl = `${import.meta.env.VITE_API_BASE_URL}/diagnose/stream`;
+      const response = await fetch(apiUrl, { method: 'POST', body: formData });
+      if (!response.ok) {
+        const body = await response.json().catch(() => ({}));
+        throw new Error(body.detail || `Request failed with status ${response.status}`);
       }
+
+      await readEventStream(response, (event, data) => {
+        if (event === 'diagnosis') {
+          if (data.error && !data.image_id && !data.converted_image_base64) {
+            fileSpecificResult.error = data.error;
+            setError(`Error (file: ${fileToProcess.name}): ${data.error}`);
+          } else {
+            if (data.image_id) {
+              fileSpecificResult.imageSrc = `${import.meta.env.VITE_API_BASE_URL}/images/${data.image_id}`;
+            } else if (data.converted_image_base64) {
+              fileSpecificResult.imageSrc = `data:image/png;base64,${data.converted_image_base64}`;
+            }
+            fileSpecificResult.annotations = data.annotations || [];
+            if (data.error) {
+              fileSpecificResult.error = `Note: ${data.error}`;
+            }
+          }
+        } else if (event === 'report_chunk') {
+          fileSpecificResult.report += data.text;
+        } else if (event === 'report_reset') {
+          fileSpecificResult.report = '';
+        } else if (event === 'report_done') {
+          fileSpecificResult.report = data.diagnostic_report || 'No report generated.';
+          fileSpecificResult.timings = data.ttft_ms != null ? `first report text after ${Math.round(data.ttft_ms)} ms` : '';
+        } else if (event === 'error') {
+          throw new Error(data.detail);
+        }
+        showResult();
+      });
     } catch (err) {
-      let errorMessage = `Failed to process ${fileToProcess.name}.`;
-      if (err.response?.data?.detail) {
-        errorMessage = `${fileToProcess.name}: ${err.response.data.detail}`;
-      } else if (err.message) {
-        errorMessage = `${fileToProcess.name}: ${err.message}`;
-      }
+      const errorMessage = err.message
+        ? `${fileToProcess.name}: ${err.message}`
+        : `Failed to process ${fileToProcess.name}.`;
       fileSpecificResult.error = errorMessage;
       setError(errorMessage); 
     } finally {
-      setResults(prevResults => {
-        const updatedResults = [...prevResults, fileSpecificResult];
-        if (activeResultIndex === null && updatedResults.length === 1) {
-            setActiveResultIndex(0);
-        }
-        return updatedResults;
-      });
+      showResult();
       setCurrentProcessingFile(null); 
     }
   }, [activeResultIndex]); 
@@ -120,6 +167,7 @@ function App() {
   const displayImageSrc = activeFileResult?.imageSrc || '';
   const displayAnnotations = activeFileResult?.annotations || [];
   const displayReport = activeFileResult?.report || '';
+  const displayTimings = activeFileResult?.timings || '';
   const displayErrorForActiveFile = activeFileResult?.error || '';
 
   const totalFilesInBatch = results.length + fileQueue.length + (currentProcessingFile ? 1 : 0);
@@ -150,7 +198,7 @@ function App() {
             </div>
           )}
           
-          { displayImageSrc && (!isLoading || !currentProcessingFile || currentProcessingFile?.name !== activeFileResult?.fileName) && (
+          { displayImageSrc && (
             <ImageViewer 
                 imageSrc={displayImageSrc} 
                 annotations={displayAnnotations} 
@@ -164,6 +212,7 @@ function App() {
         <div className="right-panel">
           <ReportDisplay 
             report={displayReport} 
+            timings={displayTimings}
             isLoading={isLoading && currentProcessingFile?.name === activeFileResult?.fileName && !displayReport && !displayErrorForActiveFile} 
           />
           
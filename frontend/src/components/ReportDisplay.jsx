@@ -1,7 +1,7 @@
 import React from 'react';
 import './ReportDisplay.css'; 
 
-function ReportDisplay({ report, isLoading }) {
+function ReportDisplay({ report, timings, isLoading }) {
   if (isLoading) {
     return <div className="report-display-placeholder">Generating report... This may take a moment.</div>;
   }
@@ -13,6 +13,7 @@ function ReportDisplay({ report, isLoading }) {
     <div className="report-display">
       <h3>Diagnostic Report</h3>
       <pre className="report-content">{report}</pre>
+      {timings && <p className="report-timings">Processing time: {timings}</p>}
     </div>
   );
 }